@@ -0,0 +1,57 @@
+"""empty message
+
+Revision ID: d8a3f5c2b7e4
+Revises: c6e2a9d4f1b3
+Create Date: 2026-10-19 14:37:05.518230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8a3f5c2b7e4'
+down_revision: Union[str, None] = 'c6e2a9d4f1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+index_version = sa.table('index_version',
+                         sa.column('name', sa.String),
+                         sa.column('version', sa.Integer))
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect
+    if dialect.name == 'mysql':
+        # InnoDB before MySQL 8.0 (MariaDB 10.2.4) resets AUTO_INCREMENT to
+        # MAX(id) + 1 at restart, the ids of the last archived questions and
+        # answers would be given again
+        required = (10, 2, 4) if dialect.is_mariadb else (8, 0)
+        if dialect.server_version_info < required:
+            raise RuntimeError(f'Archiving needs MySQL 8.0 or MariaDB 10.2.4 and later, '
+                               f'the server is {dialect.server_version_info}.')
+    op.bulk_insert(index_version, [{'name': 'duplicates', 'version': 0}])
+    if dialect.name != 'sqlite':
+        return
+    # Without AUTOINCREMENT SQLite gives the ids of archived questions and
+    # answers again, the tables are rebuilt with it and their sequences start
+    # above the archived ids.
+    for table in ('question', 'answer'):
+        with op.batch_alter_table(table, recreate='always',
+                                  table_kwargs={'sqlite_autoincrement': True}):
+            pass
+        op.execute(f"DELETE FROM sqlite_sequence WHERE name = '{table}'")
+        op.execute(f"INSERT INTO sqlite_sequence (name, seq) VALUES ('{table}', max("
+                   f"(SELECT coalesce(max(id), 0) FROM {table}), "
+                   f"(SELECT coalesce(max(id), 0) FROM archived_{table})))")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('question', 'answer'):
+            with op.batch_alter_table(table, recreate='always'):
+                pass
+    op.execute(index_version.delete().where(index_version.c.name == 'duplicates'))
@@ -0,0 +1,46 @@
+"""empty message
+
+Revision ID: e5b9c1d7a2f6
+Revises: d8a3f5c2b7e4
+Create Date: 2026-10-19 16:05:41.902117
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlmodel import Session
+
+from app.backfill import run_backfill_in_migration
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b9c1d7a2f6'
+down_revision: Union[str, None] = 'd8a3f5c2b7e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# the tables as they are at this revision
+answer = sa.table('answer',
+                  sa.column('id', sa.Integer),
+                  sa.column('score', sa.Integer))
+answer_vote = sa.table('answer_vote',
+                       sa.column('answer_id', sa.Integer),
+                       sa.column('value', sa.Integer))
+
+
+def recount_scores(session: Session, ids: list[int]):
+    votes = sa.select(sa.func.coalesce(sa.func.sum(answer_vote.c.value), 0)).\
+        where(answer_vote.c.answer_id == answer.c.id).scalar_subquery()
+    session.execute(sa.update(answer).where(answer.c.id.in_(ids)).values(score=votes))
+
+
+def upgrade() -> None:
+    # Two concurrent changes of a user's vote both applied their delta to
+    # the answer's score, until the vote was read locked: the scores are
+    # recounted from answer_vote.
+    run_backfill_in_migration('answer_scores_e5b9c1d7a2f6', answer, recount_scores)
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,147 @@
+# Commands run next to the app, e.g.
+#
+#   python -m app worker --workers 4
+#   python -m app rebuild-documents
+#   python -m app archive --days 365
+#   python -m app merge-tags python3 python-3 --into python
+#   python -m app backfill answer_scores
+import argparse
+import asyncio
+import logging
+import signal
+
+from sqlmodel import Session
+
+from .database import engine
+from .documents import rebuild_all_documents
+from .archive import ARCHIVE_AFTER_DAYS, ARCHIVE_CHUNK_SIZE, ARCHIVE_PAUSE, \
+    archive_inactive_questions
+from .jobs import JOBS_WORKERS, work
+from .backfill import BACKFILL_CHUNK_SIZE, BACKFILL_PAUSE, backfills, run_backfill, \
+    get_backfills_status
+from .tag_maintenance import TAGS_BATCH_SIZE, merge_tags, rename_tag, collect_unused_tags
+
+logger = logging.getLogger('app')
+
+
+async def run_workers(workers: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    await asyncio.gather(*(work(engine, stop) for _ in range(workers)))
+
+
+def worker(args: argparse.Namespace):
+    asyncio.run(run_workers(args.workers))
+
+
+def rebuild_documents(args: argparse.Namespace):
+    with Session(engine) as session:
+        done = rebuild_all_documents(
+            session=session, chunk_size=args.chunk_size,
+            progress=lambda done: logger.info('%s documents rebuilt', done))
+    logger.info('Done, %s documents rebuilt', done)
+
+
+def archive(args: argparse.Namespace):
+    with Session(engine) as session:
+        done = archive_inactive_questions(
+            session=session, days=args.days, chunk_size=args.chunk_size, pause=args.pause,
+            progress=lambda done: logger.info('%s questions archived', done))
+    logger.info('Done, %s questions archived', done)
+
+
+def merge_tags_command(args: argparse.Namespace):
+    with Session(engine) as session:
+        done = merge_tags(session=session, names=args.names, into=args.into,
+                          batch_size=args.batch_size,
+                          progress=lambda done: logger.info('%s links moved', done))
+    logger.info('Done, %s links moved to %s', done, args.into)
+
+
+def rename_tag_command(args: argparse.Namespace):
+    with Session(engine) as session:
+        try:
+            done = rename_tag(session=session, name=args.name, new_name=args.new_name,
+                              batch_size=args.batch_size,
+                              progress=lambda done: logger.info('%s questions updated', done))
+        except LookupError as error:
+            raise SystemExit(str(error))
+    logger.info('Done, %s questions updated', done)
+
+
+def gc_tags_command(args: argparse.Namespace):
+    with Session(engine) as session:
+        names = collect_unused_tags(session=session, batch_size=args.batch_size)
+    logger.info('Done, %s unused tags deleted: %s', len(names), ', '.join(names))
+
+
+def backfill(args: argparse.Namespace):
+    with Session(engine) as session:
+        if args.name is None:
+            for status in get_backfills_status(session=session):
+                logger.info('%(name)s: %(rows)s rows up to id %(last_id)s, '
+                            'started %(started)s, finished %(finished)s', status)
+            return
+        checkpoint = run_backfill(
+            session=session, name=args.name, chunk_size=args.chunk_size, pause=args.pause,
+            restart=args.restart,
+            progress=lambda checkpoint, max_id: logger.info(
+                '%s: %s rows, up to id %s of %s', checkpoint.name, checkpoint.rows,
+                checkpoint.last_id, max_id))
+        logger.info('Done, %s rows backfilled by %s', checkpoint.rows, checkpoint.name)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog='python -m app')
+    commands = parser.add_subparsers(required=True)
+
+    worker_parser = commands.add_parser('worker', help='run the jobs of the job table')
+    worker_parser.add_argument('--workers', type=int, default=max(JOBS_WORKERS, 1))
+    worker_parser.set_defaults(command=worker)
+
+    documents_parser = commands.add_parser('rebuild-documents',
+                                           help="render every question's document again")
+    documents_parser.add_argument('--chunk-size', type=int, default=500)
+    documents_parser.set_defaults(command=rebuild_documents)
+
+    archive_parser = commands.add_parser('archive',
+                                         help='move the inactive questions to the archive')
+    archive_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument('--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE)
+    archive_parser.add_argument('--pause', type=float, default=ARCHIVE_PAUSE)
+    archive_parser.set_defaults(command=archive)
+
+    merge_parser = commands.add_parser('merge-tags', help='move the questions of tags to another')
+    merge_parser.add_argument('names', nargs='+')
+    merge_parser.add_argument('--into', required=True)
+    merge_parser.add_argument('--batch-size', type=int, default=TAGS_BATCH_SIZE)
+    merge_parser.set_defaults(command=merge_tags_command)
+
+    rename_parser = commands.add_parser('rename-tag', help='rename a tag, merging it if taken')
+    rename_parser.add_argument('name')
+    rename_parser.add_argument('new_name')
+    rename_parser.add_argument('--batch-size', type=int, default=TAGS_BATCH_SIZE)
+    rename_parser.set_defaults(command=rename_tag_command)
+
+    gc_parser = commands.add_parser('gc-tags', help='delete the tags no question uses')
+    gc_parser.add_argument('--batch-size', type=int, default=TAGS_BATCH_SIZE)
+    gc_parser.set_defaults(command=gc_tags_command)
+
+    backfill_parser = commands.add_parser(
+        'backfill', help='run a backfill, resuming it, or list them without a name')
+    backfill_parser.add_argument('name', nargs='?', choices=sorted(backfills))
+    backfill_parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+    backfill_parser.add_argument('--pause', type=float, default=BACKFILL_PAUSE)
+    backfill_parser.add_argument('--restart', action='store_true',
+                                 help='start again from the first row')
+    backfill_parser.set_defaults(command=backfill)
+
+    args = parser.parse_args()
+    args.command(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+from decouple import config
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+# Requests are split into classes, each with its own number of requests
+# handled at once (limit), number of requests allowed to wait for a free
+# slot (queue) and time a request may wait before it is shed (timeout, seconds).
+# Auth requests hash passwords with bcrypt, so they get few slots of their own
+# and can't starve reads and writes.
+ADMISSION_LIMITS = {
+    'read': (config('ADMISSION_READ_LIMIT', default=64, cast=int),
+             config('ADMISSION_READ_QUEUE', default=256, cast=int),
+             config('ADMISSION_READ_TIMEOUT', default=2.0, cast=float)),
+    'write': (config('ADMISSION_WRITE_LIMIT', default=16, cast=int),
+              config('ADMISSION_WRITE_QUEUE', default=64, cast=int),
+              config('ADMISSION_WRITE_TIMEOUT', default=2.0, cast=float)),
+    'auth': (config('ADMISSION_AUTH_LIMIT', default=4, cast=int),
+             config('ADMISSION_AUTH_QUEUE', default=16, cast=int),
+             config('ADMISSION_AUTH_TIMEOUT', default=1.0, cast=float)),
+}
+# seconds clients are asked to wait before retrying a shed request
+ADMISSION_RETRY_AFTER = config('ADMISSION_RETRY_AFTER', default=1, cast=int)
+# requests to these paths are never queued nor shed, the probes don't touch
+# the database; /debug isn't one of them, some of its routes query it
+ADMISSION_EXEMPT_PREFIXES = ('/health',)
+
+AUTH_ROUTES = {('POST', '/users/login'), ('POST', '/users'), ('POST', '/users/')}
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class ConcurrencyLimiter:
+
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.shed_queue_full += 1
+            return False
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed_timeout += 1
+            return False
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {'limit': self.limit, 'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'in_flight': self.in_flight, 'queued': self.queued,
+                'admitted': self.admitted, 'shed_queue_full': self.shed_queue_full,
+                'shed_timeout': self.shed_timeout}
+
+
+def create_limiters() -> dict[str, ConcurrencyLimiter]:
+    return {name: ConcurrencyLimiter(limit=limit, max_queue=max_queue, queue_timeout=timeout)
+            for name, (limit, max_queue, timeout) in ADMISSION_LIMITS.items()}
+
+
+limiters = create_limiters()
+
+
+def get_request_class(method: str, path: str) -> str | None:
+    if path.startswith(ADMISSION_EXEMPT_PREFIXES):
+        return None
+    if (method, path) in AUTH_ROUTES:
+        return 'auth'
+    if method in READ_METHODS:
+        return 'read'
+    return 'write'
+
+
+class AdmissionMiddleware:
+    # Lets a bounded number of requests of each class in at once and answers
+    # the ones that can't get in quickly enough with 503 and Retry-After,
+    # instead of letting every request wait until all of them time out.
+
+    def __init__(self, app: ASGIApp, limiters: dict[str, ConcurrencyLimiter] = limiters) -> None:
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_class = get_request_class(scope['method'], scope['path'])
+        if request_class is None:
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiters[request_class]
+        if not await limiter.acquire():
+            await self.shed(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def shed(self, send: Send) -> None:
+        body = json.dumps({'detail': 'Server is overloaded, retry later.'}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode()),
+                        (b'retry-after', str(ADMISSION_RETRY_AFTER).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,235 @@
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from decouple import config
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert, lambda_stmt, or_
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel, select, delete
+
+from .database import begin_write
+from .documents import get_documents, dump_document, rebuild_user_documents
+from .indexes import bump_index_versions
+from .jobs import enqueue, job_handler
+from .models import Question, Answer, AnswerVote, TaggedQuestions, Tag, QuestionRank, \
+    QuestionDocument, RelatedQuestion, ArchivedQuestion, ArchivedAnswer, \
+    ArchivedAnswerVote, ArchivedTaggedQuestions, User
+from .models import Job
+from .schemas import UserRead
+
+
+# A question is archived once nothing happened to it for ARCHIVE_AFTER_DAYS:
+# it was published and last updated before that, and its rank (answers
+# and views, see app/ranking.py) wasn't touched since. It is moved with its
+# answers, their votes and its tag links to the archived_* tables, in chunks
+# of ARCHIVE_CHUNK_SIZE questions, a transaction each, ARCHIVE_PAUSE seconds
+# apart so that the move doesn't hog the database. Listings only scan the
+# hot tables, reads of a question and of its answers fall back to the archive,
+# where the question is read-only: writes answer 404 as for a missing question.
+# In the app, archival is a single 'archive' job of the job queue, run by
+# whichever worker claims it, which enqueues the next run when done.
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=365, cast=int)
+ARCHIVE_CHUNK_SIZE = config('ARCHIVE_CHUNK_SIZE', default=200, cast=int)
+ARCHIVE_PAUSE = config('ARCHIVE_PAUSE', default=0.5, cast=float)
+# hours between two archival runs in the app, 0 leaves them to `python -m app archive`
+ARCHIVE_INTERVAL_HOURS = config('ARCHIVE_INTERVAL_HOURS', default=24.0, cast=float)
+# chunks moved by a job, the next chunks are left to a job enqueued right
+# away so that a run stays well within the job's lease (JOBS_LEASE_SECONDS)
+ARCHIVE_CHUNKS_PER_JOB = config('ARCHIVE_CHUNKS_PER_JOB', default=10, cast=int)
+
+logger = logging.getLogger(__name__)
+
+
+def get_archive_candidates(session: Session, cutoff: datetime, limit: int) -> list[int]:
+    # locked, so that no answer is posted to a question while it is moved;
+    # those locked by a concurrent write are left for the next run
+    return session.exec(
+        select(Question.id).
+        outerjoin(QuestionRank, QuestionRank.question_id == Question.id).
+        where(Question.published < cutoff,
+              or_(Question.updated == None, Question.updated < cutoff),
+              or_(QuestionRank.updated == None, QuestionRank.updated < cutoff)).
+        order_by(Question.id).
+        limit(limit).
+        with_for_update(skip_locked=True, of=Question)).all()
+
+
+def copy_rows(session: Session, source: type[SQLModel], target: type[SQLModel], where):
+    # INSERT ... SELECT of the columns both tables have
+    names = [column.name for column in target.__table__.columns]
+    session.exec(insert(target).from_select(
+        names, select(*(source.__table__.c[name] for name in names)).where(where)))
+
+
+def archive_questions(session: Session, questions_ids: list[int],
+                      now: datetime | None = None) -> dict[int, list[str]]:
+    # Moves the questions with everything hanging off them, the caller commits.
+    # Returns the tags' names of the moved questions, by question.
+    now = now or datetime.utcnow()
+    documents = get_documents(session=session, questions_ids=questions_ids)
+    rows = session.exec(
+        select(Question.id, Question.title, Question.content,
+               Question.published, Question.updated, Question.user_id).
+        where(Question.id.in_(questions_ids))).all()
+    if not rows:
+        return {}
+    ids = [row.id for row in rows]
+    tags_names: dict[int, list[str]] = {id: [] for id in ids}
+    for question_id, name in session.exec(
+            select(TaggedQuestions.question_id, Tag.name).
+            join(Tag, Tag.id == TaggedQuestions.tag_id).
+            where(TaggedQuestions.question_id.in_(ids))).all():
+        tags_names[question_id].append(name)
+    # the questions that had these as neighbours look for new ones
+    neighbours = set(session.exec(
+        select(RelatedQuestion.related_id).distinct().
+        where(RelatedQuestion.question_id.in_(ids))).all()) - set(ids)
+
+    session.execute(insert(ArchivedQuestion), [
+        {**row._mapping, 'archived': now, 'document': documents[row.id]} for row in rows])
+    answers_ids = select(Answer.id).where(Answer.question_id.in_(ids))
+    copy_rows(session, Answer, ArchivedAnswer, Answer.question_id.in_(ids))
+    copy_rows(session, AnswerVote, ArchivedAnswerVote, AnswerVote.answer_id.in_(answers_ids))
+    copy_rows(session, TaggedQuestions, ArchivedTaggedQuestions,
+              TaggedQuestions.question_id.in_(ids))
+
+    session.exec(delete(RelatedQuestion).
+                 where(or_(RelatedQuestion.question_id.in_(ids),
+                           RelatedQuestion.related_id.in_(ids))))
+    session.exec(delete(QuestionRank).where(QuestionRank.question_id.in_(ids)))
+    session.exec(delete(QuestionDocument).where(QuestionDocument.question_id.in_(ids)))
+    # a subquery can't be evaluated against the session's objects,
+    # they are expired by the commit anyway
+    session.exec(delete(AnswerVote).where(AnswerVote.answer_id.in_(answers_ids)).
+                 execution_options(synchronize_session=False))
+    session.exec(delete(TaggedQuestions).where(TaggedQuestions.question_id.in_(ids)))
+    session.exec(delete(Answer).where(Answer.question_id.in_(ids)))
+    session.exec(delete(Question).where(Question.id.in_(ids)))
+    enqueue(session=session, kind='refresh_related',
+            payloads=[{'question_id': id} for id in sorted(neighbours)])
+    return tags_names
+
+
+def archive_inactive_questions(session: Session,
+                               days: int = ARCHIVE_AFTER_DAYS,
+                               chunk_size: int = ARCHIVE_CHUNK_SIZE,
+                               pause: float = ARCHIVE_PAUSE,
+                               max_chunks: int | None = None,
+                               progress=None) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    done = 0
+    chunks = 0
+    while True:
+        # in SQLite mode the lock of get_archive_candidates is the write
+        # transaction's, which has to begin before the chunk is read
+        begin_write(session)
+        ids = get_archive_candidates(session=session, cutoff=cutoff, limit=chunk_size)
+        if not ids:
+            session.rollback()
+            return done
+        tags_names = archive_questions(session=session, questions_ids=ids)
+        # the questions are gone from the hot tables the indexes are loaded
+        # from, every app process reloads them (see app/indexes.py)
+        bump_index_versions(session=session, names=['tags', 'duplicates'])
+        session.commit()
+        done += len(tags_names)
+        chunks += 1
+        if progress:
+            progress(done)
+        if len(ids) < chunk_size or chunks == max_chunks:
+            return done
+        time.sleep(pause)
+
+
+def schedule_archival(engine: Engine, interval: float = ARCHIVE_INTERVAL_HOURS * 3600):
+    # Run by every app process at its start, enqueues the first run one
+    # interval later unless an archive job is already waiting.
+    with Session(engine) as session:
+        begin_write(session)
+        pending = session.exec(select(Job.id).
+                               where(Job.kind == 'archive', Job.failed == False)).first()
+        if pending is None:
+            enqueue(session=session, kind='archive', payloads=[{}],
+                    run_after=datetime.utcnow() + timedelta(seconds=interval))
+        session.commit()
+
+
+@job_handler('archive')
+def handle_archive(session: Session, payloads: list[dict]):
+    # the next run is enqueued with the deletion of this one, right away
+    # when the chunks moved show that more questions are due
+    archived = archive_inactive_questions(session=session, days=ARCHIVE_AFTER_DAYS,
+                                          chunk_size=ARCHIVE_CHUNK_SIZE, pause=ARCHIVE_PAUSE,
+                                          max_chunks=ARCHIVE_CHUNKS_PER_JOB)
+    logger.info('%s questions archived', archived)
+    more = archived >= ARCHIVE_CHUNKS_PER_JOB * ARCHIVE_CHUNK_SIZE
+    delay = 0 if more else ARCHIVE_INTERVAL_HOURS * 3600
+    enqueue(session=session, kind='archive', payloads=[{}],
+            run_after=datetime.utcnow() + timedelta(seconds=delay))
+
+
+def get_archived_document(session: Session, question_id: int) -> str | None:
+    statement = lambda_stmt(
+        lambda: select(ArchivedQuestion.document).
+        where(ArchivedQuestion.id == question_id))
+    return session.execute(statement).scalars().first()
+
+
+def is_archived(session: Session, question_id: int) -> bool:
+    return session.exec(select(ArchivedQuestion.id).
+                        where(ArchivedQuestion.id == question_id)).first() is not None
+
+
+def update_archived_documents_user(session: Session, user: User, chunk_size: int = 500) -> int:
+    # the archived documents hold their author's username and email too,
+    # they are edited in place, a transaction per chunk
+    user_json = jsonable_encoder(UserRead.from_orm(user))
+    done = 0
+    last_id = 0
+    while True:
+        begin_write(session)
+        archived_questions = session.exec(
+            select(ArchivedQuestion).
+            where(ArchivedQuestion.user_id == user.id, ArchivedQuestion.id > last_id).
+            order_by(ArchivedQuestion.id).
+            limit(chunk_size)).all()
+        if not archived_questions:
+            return done
+        last_id = archived_questions[-1].id
+        for archived in archived_questions:
+            document = json.loads(archived.document)
+            document['user'] = user_json
+            archived.document = dump_document(document)
+            session.add(archived)
+        session.commit()
+        done += len(archived_questions)
+
+
+@job_handler('user_documents')
+def handle_user_documents(session: Session, payloads: list[dict]):
+    # enqueued by a change of a user's username or email, the documents
+    # are rendered with the user as it is when the job runs
+    for user_id in sorted({payload['user_id'] for payload in payloads}):
+        user = session.get(User, user_id)
+        if user is None:
+            continue
+        rebuild_user_documents(session=session, user_id=user_id)
+        update_archived_documents_user(session=session, user=user)
+
+
+def update_archived_documents_tags(session: Session, questions_ids: list[int]):
+    # after the questions' archived tag links changed, the caller commits
+    tags: dict[int, list[dict]] = {id: [] for id in questions_ids}
+    for question_id, name, id in session.exec(
+            select(ArchivedTaggedQuestions.question_id, Tag.name, Tag.id).
+            join(Tag, Tag.id == ArchivedTaggedQuestions.tag_id).
+            where(ArchivedTaggedQuestions.question_id.in_(questions_ids))).all():
+        tags[question_id].append({'name': name, 'id': id})
+    for archived in session.exec(select(ArchivedQuestion).
+                                 where(ArchivedQuestion.id.in_(questions_ids))).all():
+        document = json.loads(archived.document)
+        document['tags'] = tags[archived.id]
+        archived.document = dump_document(document)
+        session.add(archived)
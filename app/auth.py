@@ -9,7 +9,7 @@ from passlib.context import CryptContext
 from pydantic import BaseModel
 from sqlmodel import Session
 
-from .database import get_session
+from .database import get_read_session
 from .crud import get_user_with_username
 from .models import User
 
@@ -41,15 +41,19 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def authenticate_user(*, session: Session, username: str, password: str) -> bool | User:
+def authenticate_user(*, session: Session, username: str, password: str) -> bool | tuple[int, str]:
+    # returns the user's id and username, read before the rollback expires the user
     user: User = get_user_with_username(session=session,
                                         username=username)
     if not user:
         return False
+    user_id, username, hashed_password = user.id, user.username, user.hashed_password
+    # the session's connection goes back to the pool while bcrypt runs
+    session.rollback()
     if not verify_password(plain_password=password,
-                           hashed_password=user.hashed_password):
+                           hashed_password=hashed_password):
         return False
-    return user
+    return user_id, username
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -64,7 +68,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 def get_current_user(token: Annotated[str, Depends(oauth2_scheme)],
-                     session: Annotated[Session, Depends(get_session)]) -> User:
+                     session: Annotated[Session, Depends(get_read_session)]) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
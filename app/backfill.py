@@ -0,0 +1,218 @@
+import time
+from datetime import datetime
+from typing import Callable
+
+from decouple import config
+from sqlalchemy import DateTime, Integer, String, column, func, insert, table
+from sqlalchemy.sql import TableClause
+from sqlmodel import Session, SQLModel, select, update
+
+from .database import begin_write
+from .documents import rebuild_documents
+from .models import Answer, AnswerVote, BackfillCheckpoint, Question
+
+
+# A backfill changes the rows of a large table a chunk at a time, in primary
+# key order, instead of with one UPDATE locking the whole table. Each chunk of
+# BACKFILL_CHUNK_SIZE rows is a transaction of its own, that also saves how far
+# the backfill got in backfill_checkpoint, and the next one starts
+# BACKFILL_PAUSE seconds later, so that the backfill can run under load.
+# An interrupted backfill resumes from its checkpoint. A chunk may be applied
+# again after a crash (not in a transaction, see run_backfill_in_migration),
+# so backfills must be idempotent.
+#
+# Backfills are registered with @backfill and run with
+# `python -m app backfill <name>`. They use the app's models, which follow
+# the latest schema, so a migration doesn't run them: it runs its own,
+# written against tables frozen as they are at its revision:
+#
+#   answer = sa.table('answer', sa.column('id', sa.Integer), ...)
+#
+#   def upgrade() -> None:
+#       op.add_column(...)
+#       run_backfill_in_migration('answer_scores_<revision>', answer, apply)
+BACKFILL_CHUNK_SIZE = config('BACKFILL_CHUNK_SIZE', default=1000, cast=int)
+BACKFILL_PAUSE = config('BACKFILL_PAUSE', default=0.1, cast=float)
+
+# backfill_checkpoint as created by revision b4d1e7f09a62, for the backfills
+# run by migrations, which can't use BackfillCheckpoint either
+migration_checkpoints = table('backfill_checkpoint',
+                              column('name', String),
+                              column('last_id', Integer),
+                              column('rows', Integer),
+                              column('started', DateTime),
+                              column('updated', DateTime),
+                              column('finished', DateTime))
+
+
+class Checkpoint:
+    # a row of backfill_checkpoint, read and saved by execute_backfill
+
+    def __init__(self, name: str, last_id: int = 0, rows: int = 0,
+                 started: datetime | None = None, updated: datetime | None = None,
+                 finished: datetime | None = None):
+        self.name = name
+        self.last_id = last_id
+        self.rows = rows
+        self.started = started
+        self.updated = updated
+        self.finished = finished
+
+    def values(self) -> dict:
+        return {'last_id': self.last_id, 'rows': self.rows, 'started': self.started,
+                'updated': self.updated, 'finished': self.finished}
+
+
+class Backfill:
+
+    def __init__(self, name: str, table: TableClause,
+                 apply: Callable[[Session, list[int]], None], where=None,
+                 checkpoints: TableClause = BackfillCheckpoint.__table__):
+        self.name = name
+        # chunked by its id column
+        self.table = table
+        # called with the primary keys of a chunk, the caller commits
+        self.apply = apply
+        # only the rows matching it are chunked, None for all of them
+        self.where = where
+        # where its checkpoint is kept
+        self.checkpoints = checkpoints
+
+
+backfills: dict[str, Backfill] = {}
+
+
+def backfill(name: str, model: type[SQLModel], where=None):
+    def register(apply: Callable[[Session, list[int]], None]):
+        backfills[name] = Backfill(name=name, table=model.__table__, apply=apply, where=where)
+        return apply
+    return register
+
+
+def get_checkpoint(session: Session, name: str) -> BackfillCheckpoint | None:
+    return session.get(BackfillCheckpoint, name, populate_existing=True)
+
+
+def read_checkpoint(session: Session, backfill: Backfill) -> Checkpoint | None:
+    checkpoints = backfill.checkpoints
+    row = session.execute(select(checkpoints.c.name, checkpoints.c.last_id, checkpoints.c.rows,
+                                 checkpoints.c.started, checkpoints.c.updated,
+                                 checkpoints.c.finished).
+                          where(checkpoints.c.name == backfill.name)).first()
+    return Checkpoint(**row._mapping) if row else None
+
+
+def save_checkpoint(session: Session, backfill: Backfill, checkpoint: Checkpoint, new: bool):
+    checkpoints = backfill.checkpoints
+    if new:
+        session.execute(insert(checkpoints).values(name=checkpoint.name, **checkpoint.values()))
+    else:
+        session.execute(update(checkpoints).where(checkpoints.c.name == checkpoint.name).
+                        values(**checkpoint.values()))
+
+
+def get_chunk(session: Session, backfill: Backfill, after_id: int, limit: int) -> list[int]:
+    id = backfill.table.c.id
+    statement = select(id).where(id > after_id)
+    if backfill.where is not None:
+        statement = statement.where(backfill.where)
+    return session.exec(statement.order_by(id).limit(limit)).all()
+
+
+def run_backfill(session: Session,
+                 name: str,
+                 chunk_size: int = BACKFILL_CHUNK_SIZE,
+                 pause: float = BACKFILL_PAUSE,
+                 restart: bool = False,
+                 progress=None) -> Checkpoint:
+    return execute_backfill(session=session, backfill=backfills[name], chunk_size=chunk_size,
+                            pause=pause, restart=restart, progress=progress)
+
+
+def execute_backfill(session: Session,
+                     backfill: Backfill,
+                     chunk_size: int = BACKFILL_CHUNK_SIZE,
+                     pause: float = BACKFILL_PAUSE,
+                     restart: bool = False,
+                     progress=None) -> Checkpoint:
+    # progress is called after every chunk with the checkpoint
+    # and the largest primary key when the backfill started
+    name = backfill.name
+    now = datetime.utcnow()
+    begin_write(session)
+    checkpoint = read_checkpoint(session=session, backfill=backfill)
+    new = checkpoint is None
+    if new or restart:
+        checkpoint = Checkpoint(name=name, started=now)
+    elif checkpoint.finished is not None:
+        return checkpoint
+    checkpoint.updated = now
+    save_checkpoint(session=session, backfill=backfill, checkpoint=checkpoint, new=new)
+    session.commit()
+    max_id = session.exec(select(func.max(backfill.table.c.id))).one() or 0
+    while ids := get_chunk(session=session, backfill=backfill,
+                           after_id=checkpoint.last_id, limit=chunk_size):
+        begin_write(session)
+        backfill.apply(session, ids)
+        checkpoint.last_id = ids[-1]
+        checkpoint.rows += len(ids)
+        checkpoint.updated = datetime.utcnow()
+        save_checkpoint(session=session, backfill=backfill, checkpoint=checkpoint, new=False)
+        session.commit()
+        if progress:
+            progress(checkpoint, max_id)
+        if len(ids) < chunk_size:
+            break
+        time.sleep(pause)
+    checkpoint.finished = datetime.utcnow()
+    save_checkpoint(session=session, backfill=backfill, checkpoint=checkpoint, new=False)
+    session.commit()
+    return checkpoint
+
+
+def run_backfill_in_migration(name: str, table: TableClause,
+                              apply: Callable[[Session, list[int]], None],
+                              where=None, **options) -> Checkpoint:
+    # Runs a backfill defined by the migration, with the migration's frozen
+    # table, its name (unique, with the revision's id) keeps its checkpoint
+    # in migration_checkpoints.
+    # The migration's transaction is committed first, the chunks run
+    # in autocommit mode on the migration's connection; on MySQL, DDL
+    # commits anyway. A backfill too long for a deployment is better
+    # registered and run with `python -m app backfill` after the migration.
+    from alembic import op
+
+    backfill = Backfill(name=name, table=table, apply=apply, where=where,
+                        checkpoints=migration_checkpoints)
+    with op.get_context().autocommit_block():
+        with Session(bind=op.get_bind()) as session:
+            return execute_backfill(session=session, backfill=backfill, **options)
+
+
+def get_backfills_status(session: Session) -> list[dict]:
+    checkpoints = {checkpoint.name: checkpoint
+                   for checkpoint in session.exec(select(BackfillCheckpoint)).all()}
+    status = []
+    # the ones run by migrations only have their checkpoint
+    for name in sorted(set(backfills) | set(checkpoints)):
+        checkpoint = checkpoints.get(name)
+        status.append({'name': name,
+                       'last_id': checkpoint.last_id if checkpoint else None,
+                       'rows': checkpoint.rows if checkpoint else 0,
+                       'started': checkpoint.started if checkpoint else None,
+                       'finished': checkpoint.finished if checkpoint else None})
+    return status
+
+
+@backfill('answer_scores', Answer)
+def backfill_answer_scores(session: Session, ids: list[int]):
+    # recomputes the scores kept in step with answer_vote
+    votes = select(func.coalesce(func.sum(AnswerVote.value), 0)).\
+        where(AnswerVote.answer_id == Answer.id).scalar_subquery()
+    session.exec(update(Answer).where(Answer.id.in_(ids)).values(score=votes).
+                 execution_options(synchronize_session=False))
+
+
+@backfill('question_documents', Question)
+def backfill_question_documents(session: Session, ids: list[int]):
+    rebuild_documents(session=session, questions_ids=ids)
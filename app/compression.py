@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+
+from decouple import config
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, without it only gzip is offered
+    brotli = None
+
+
+COMPRESSION_MINIMUM_SIZE = config('COMPRESSION_MINIMUM_SIZE', default=1000, cast=int)
+COMPRESSION_GZIP_LEVEL = config('COMPRESSION_GZIP_LEVEL', default=6, cast=int)
+COMPRESSION_BROTLI_QUALITY = config('COMPRESSION_BROTLI_QUALITY', default=5, cast=int)
+# number of compressed bodies kept, bodies larger than
+# COMPRESSION_CACHE_MAX_BODY_SIZE are compressed every time
+COMPRESSION_CACHE_SIZE = config('COMPRESSION_CACHE_SIZE', default=512, cast=int)
+COMPRESSION_CACHE_MAX_BODY_SIZE = config('COMPRESSION_CACHE_MAX_BODY_SIZE',
+                                         default=1024 * 1024, cast=int)
+# bodies from this size on are compressed in the threadpool, compressing
+# them would hold the event loop and every other request with it
+COMPRESSION_THREADPOOL_MIN_SIZE = config('COMPRESSION_THREADPOOL_MIN_SIZE',
+                                         default=32 * 1024, cast=int)
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    # picks br, then gzip, among the encodings accepted with a non zero q
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime is fixed so that the same body is always compressed to the same bytes
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    # Compresses complete JSON and text responses with brotli or gzip.
+    # Compressed bodies are cached by a digest of the uncompressed body,
+    # so the hot pages that are rendered to the same bytes again and again
+    # are compressed only once. Streaming responses are passed through.
+
+    def __init__(self,
+                 app: ASGIApp,
+                 minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+                 gzip_level: int = COMPRESSION_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESSION_BROTLI_QUALITY,
+                 cache_size: int = COMPRESSION_CACHE_SIZE,
+                 threadpool_min_size: int = COMPRESSION_THREADPOOL_MIN_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.threadpool_min_size = threadpool_min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache = LRUCache(maxsize=cache_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await CompressionResponder(self, encoding, send)(self.app, scope, receive)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if len(body) > COMPRESSION_CACHE_MAX_BODY_SIZE:
+            return compress(body, encoding, self.gzip_level, self.brotli_quality)
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            self.cache.set(key, compressed)
+        return compressed
+
+
+class CompressionResponder:
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send) -> None:
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message: Message | None = None
+        self.passthrough = False
+
+    async def __call__(self, app: ASGIApp, scope: Scope, receive: Receive) -> None:
+        await app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            headers = Headers(raw=message['headers'])
+            content_type = headers.get('content-type', '')
+            self.passthrough = ('content-encoding' in headers
+                                or not content_type.startswith(COMPRESSIBLE_TYPES))
+            if self.passthrough:
+                await self.send(message)
+            else:
+                # held back until the body is known
+                self.start_message = message
+            return
+        if self.passthrough or message['type'] != 'http.response.body':
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        start_message, self.start_message = self.start_message, None
+        self.passthrough = True
+        headers = MutableHeaders(raw=start_message['headers'])
+        headers.add_vary_header('Accept-Encoding')
+        if more_body or len(body) < self.middleware.minimum_size:
+            await self.send(start_message)
+            await self.send(message)
+            return
+        if len(body) >= self.middleware.threadpool_min_size:
+            body = await run_in_threadpool(self.middleware.compress, body, self.encoding)
+        else:
+            body = self.middleware.compress(body, self.encoding)
+        headers['Content-Encoding'] = self.encoding
+        headers['Content-Length'] = str(len(body))
+        await self.send(start_message)
+        await self.send({'type': 'http.response.body', 'body': body})
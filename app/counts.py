@@ -0,0 +1,70 @@
+from typing import Callable, Hashable, Literal
+
+from decouple import config
+from sqlalchemy import text
+from sqlmodel import Session
+
+from .cache import LRUCache
+from .crud import count_questions, count_answers
+from .models import Answer, ArchivedAnswer
+
+
+# Totals of the listings for their X-Total-Count header. An exact count is
+# a single COUNT over an index, an approximate one is read from the table's
+# statistics when the listing isn't filtered (MySQL only) and is otherwise
+# an exact count cached for COUNT_CACHE_TTL seconds, so paging through a
+# listing doesn't count it again for every page.
+COUNT_CACHE_SIZE = config('COUNT_CACHE_SIZE', default=1024, cast=int)
+COUNT_CACHE_TTL = config('COUNT_CACHE_TTL', default=30.0, cast=float)
+
+CountMode = Literal['exact', 'approx']
+
+counts_cache = LRUCache(maxsize=COUNT_CACHE_SIZE, ttl=COUNT_CACHE_TTL)
+
+
+def get_table_rows_estimate(session: Session, table_name: str) -> int | None:
+    # InnoDB's estimate, refreshed by its statistics sampling,
+    # may be off by a few tens of percent
+    if session.get_bind().dialect.name != 'mysql':
+        return None
+    return session.execute(
+        text('SELECT TABLE_ROWS FROM information_schema.TABLES '
+             'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name'),
+        {'name': table_name}).scalar()
+
+
+def get_count(key: Hashable, mode: CountMode, count: Callable[[], int],
+              estimate: Callable[[], int | None] | None = None) -> int:
+    if mode == 'exact':
+        return count()
+    total = counts_cache.get(key)
+    if total is None:
+        total = estimate() if estimate else None
+        if total is None:
+            total = count()
+        counts_cache.set(key, total)
+    return total
+
+
+def get_questions_count(session: Session,
+                        mode: CountMode,
+                        search_string: str | None = None,
+                        ids: list[int] | None = None) -> int:
+    def count() -> int:
+        return count_questions(session=session, search_string=search_string, ids=ids)
+
+    def estimate() -> int | None:
+        return get_table_rows_estimate(session=session, table_name='question')
+
+    unfiltered = not search_string and ids is None
+    return get_count(key=('questions', search_string or None, tuple(ids or ())),
+                     mode=mode, count=count, estimate=estimate if unfiltered else None)
+
+
+def get_answers_count(session: Session,
+                      mode: CountMode,
+                      question_id: int,
+                      model: type[Answer] | type[ArchivedAnswer] = Answer) -> int:
+    return get_count(key=('answers', question_id), mode=mode,
+                     count=lambda: count_answers(session=session, question_id=question_id,
+                                                 model=model))
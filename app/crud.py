@@ -1,78 +1,279 @@
 from sqlmodel import Session, select, and_
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, func, tuple_, lambda_stmt
 from sqlalchemy.orm import joinedload
 
-from .models import User, Tag, Question, Answer
+from .models import User, Tag, Question, Answer, AnswerVote, TaggedQuestions, \
+    ArchivedQuestion, ArchivedAnswer
 
 
+# fields that can be requested from the listings with ?fields=
+QUESTION_FIELDS = ('id', 'title', 'content', 'published', 'updated', 'user', 'tags')
+ANSWER_FIELDS = ('id', 'question_id', 'content', 'published', 'updated', 'score', 'user')
+
+
+# The hot queries below are lambda statements: the lambdas' code is the
+# statement's cache key, so after the first call the select isn't built
+# again, only the values of the variables used in the lambdas are extracted.
+# Optional parts are separate lambdas added only when used, so that
+# a lambda never has to produce differently shaped SQL.
+
 def get_user_with_username(session: Session, username: str) -> User | None:
-    return session.exec(select(User).where(User.username == username)).first()
+    statement = lambda_stmt(lambda: select(User).where(User.username == username))
+    return session.execute(statement).scalars().first()
 
 
 def get_user_with_email(session: Session, email: str) -> User | None:
     return session.exec(select(User).where(User.email == email)).first()
 
 
+def get_user_stats(session: Session, username: str):
+    # one query, each correlated subquery is answered from
+    # the (user_id, published) index of its table alone
+    def count(model):
+        return select(func.count()).where(model.user_id == User.id).scalar_subquery()
+
+    def latest(model):
+        return select(func.max(model.published)).where(model.user_id == User.id).\
+            scalar_subquery()
+
+    # archived questions and answers count too, the latest of either table
+    # is picked by get_user_profile
+    return session.exec(
+        select(User.id, User.username, User.email,
+               (count(Question) + count(ArchivedQuestion)).label('questions_count'),
+               (count(Answer) + count(ArchivedAnswer)).label('answers_count'),
+               latest(Question).label('last_question_published'),
+               latest(Answer).label('last_answer_published'),
+               latest(ArchivedQuestion).label('last_archived_question_published'),
+               latest(ArchivedAnswer).label('last_archived_answer_published')).
+        where(User.username == username)).first()
+
+
+def get_answers_authors(session: Session, question_id: int) -> list[str]:
+    return session.exec(
+        select(User.username).distinct().
+        join(Answer, Answer.user_id == User.id).
+        where(Answer.question_id == question_id)).all()
+
+
 def get_tag_by_name(session: Session, name: str) -> Tag | None:
     return session.exec(select(Tag).where(Tag.name == name)).first()
 
 
+def get_tags_by_names(session: Session, names: list[str]) -> list[Tag]:
+    if not names:
+        return []
+    return session.exec(select(Tag).where(Tag.name.in_(names))).all()
+
+
+def select_fields(model: type[Question] | type[Answer] | type[ArchivedAnswer], fields: list[str]):
+    # selects only the requested columns of the model and its id,
+    # the user is joined only when requested, tags are loaded by get_fields_rows
+    columns = [model.id] + [getattr(model, field) for field in fields
+                            if field not in ('id', 'user', 'tags')]
+    if 'user' not in fields:
+        return select(*columns)
+    return select(*columns,
+                  User.id.label('user__id'),
+                  User.username.label('user__username'),
+                  User.email.label('user__email')).join(User, model.user_id == User.id)
+
+
+def get_fields_rows(session: Session, rows, fields: list[str]) -> list[dict]:
+    items = []
+    for row in rows:
+        mapping = row._mapping
+        item = {}
+        for field in fields:
+            if field == 'user':
+                item['user'] = {'username': mapping['user__username'],
+                                'email': mapping['user__email'],
+                                'id': mapping['user__id']}
+            elif field == 'tags':
+                item['tags'] = []
+            else:
+                item[field] = mapping[field]
+        items.append((mapping['id'], item))
+    if 'tags' in fields and items:
+        by_id = dict(items)
+        tags = session.exec(
+            select(TaggedQuestions.question_id, Tag.name, Tag.id).
+            join(Tag, Tag.id == TaggedQuestions.tag_id).
+            where(TaggedQuestions.question_id.in_(list(by_id)))).all()
+        for question_id, name, id in tags:
+            by_id[question_id]['tags'].append({'name': name, 'id': id})
+    return [item for _, item in items]
+
+
 def get_question_by_id(session: Session, id: int) -> Question | None:
-    return session.exec(select(Question).
-                        where(Question.id == id).
-                        options(joinedload(Question.tags), joinedload(Question.user))).first()
+    statement = lambda_stmt(
+        lambda: select(Question).
+        where(Question.id == id).
+        options(joinedload(Question.tags), joinedload(Question.user)))
+    return session.execute(statement).unique().scalars().first()
+
+
+def get_questions_titles(session: Session, ids: list[int]) -> dict[int, str]:
+    if not ids:
+        return {}
+    return dict(session.exec(select(Question.id, Question.title).
+                             where(Question.id.in_(ids))).all())
 
 
 def get_all_questions(session: Session,
                       limit: int | None = None,
                       offset: int | None = None,
-                      search_string: str | None = None):
+                      search_string: str | None = None,
+                      ids: list[int] | None = None,
+                      fields: list[str] | None = None):
+    # with fields, plain dicts holding only those fields are returned
+    if fields is not None:
+        statement = select_fields(Question, fields)
+        if search_string:
+            statement = statement.where(Question.title.contains(search_string))
+        if ids is not None:
+            statement = statement.where(Question.id.in_(ids))
+        statement = statement.offset(offset=offset).limit(limit=limit).\
+            order_by(asc(Question.id))
+        return get_fields_rows(session=session, rows=session.exec(statement).all(),
+                               fields=fields)
+    statement = lambda_stmt(lambda: select(Question))
     if search_string:
-        return session.exec(
-            select(Question).where(Question.title.contains(search_string)).
-            offset(offset=offset).
-            limit(limit=limit).
-            options(
-                joinedload(Question.tags),
-                joinedload(Question.user)
-            ).order_by(asc(Question.id))).unique().all()
-    return session.exec(
-        select(Question).
-        offset(offset=offset).
-        limit(limit=limit).
-        options(
-            joinedload(Question.tags),
-            joinedload(Question.user)
-        ).order_by(asc(Question.id))).unique().all()
+        statement += lambda statement: statement.where(Question.title.contains(search_string))
+    if ids is not None:
+        statement += lambda statement: statement.where(Question.id.in_(ids))
+    if offset is not None:
+        statement += lambda statement: statement.offset(offset)
+    if limit is not None:
+        statement += lambda statement: statement.limit(limit)
+    statement += lambda statement: statement.order_by(asc(Question.id)).\
+        options(joinedload(Question.tags), joinedload(Question.user))
+    return session.execute(statement).unique().scalars().all()
+
+
+def get_questions_ids(session: Session,
+                      limit: int | None = None,
+                      offset: int | None = None,
+                      search_string: str | None = None,
+                      ids: list[int] | None = None) -> list[int]:
+    # the page of get_all_questions, read from the primary key alone
+    statement = lambda_stmt(lambda: select(Question.id))
+    if search_string:
+        statement += lambda statement: statement.where(Question.title.contains(search_string))
+    if ids is not None:
+        statement += lambda statement: statement.where(Question.id.in_(ids))
+    if offset is not None:
+        statement += lambda statement: statement.offset(offset)
+    if limit is not None:
+        statement += lambda statement: statement.limit(limit)
+    statement += lambda statement: statement.order_by(asc(Question.id))
+    return session.execute(statement).scalars().all()
+
+
+def count_questions(session: Session,
+                    search_string: str | None = None,
+                    ids: list[int] | None = None) -> int:
+    # the total of get_questions_ids' pages
+    statement = lambda_stmt(lambda: select(func.count(Question.id)))
+    if search_string:
+        statement += lambda statement: statement.where(Question.title.contains(search_string))
+    if ids is not None:
+        statement += lambda statement: statement.where(Question.id.in_(ids))
+    return session.execute(statement).scalar_one()
 
 
 def get_answer_by_id_and_question_id(session: Session,
                                      question_id: int,
-                                     id: int) -> Answer | None:
+                                     id: int,
+                                     model: type[Answer] | type[ArchivedAnswer] = Answer
+                                     ) -> Answer | ArchivedAnswer | None:
     return session.exec(
-        select(Answer).
-        where(and_(Answer.id == id,
-                   Answer.question_id == question_id)).
+        select(model).
+        where(and_(model.id == id,
+                   model.question_id == question_id)).
         options(
-            joinedload(Answer.user)
+            joinedload(model.user)
         )).first()
 
 
+def get_answers_by_ids(session: Session, ids: list[int]) -> list[Answer]:
+    return session.exec(
+        select(Answer).
+        where(Answer.id.in_(ids)).
+        options(joinedload(Answer.user))).all()
+
+
 def get_all_answers(session: Session,
                     question_id: int,
                     offset: int | None = None,
                     limit: int | None = None,
-                    by_date_asc: bool | None = None):
+                    by_date_asc: bool | None = None,
+                    fields: list[str] | None = None,
+                    model: type[Answer] | type[ArchivedAnswer] = Answer):
+    # model is ArchivedAnswer for the answers of an archived question
     ordering = None
     if by_date_asc == None:
-        ordering = asc(Answer.id)
+        ordering = asc(model.id)
     if by_date_asc == True:
-        ordering = asc(Answer.published)
+        ordering = asc(model.published)
     if by_date_asc == False:
-        ordering = desc(Answer.published)
-    return session.exec(
-        select(Answer).
-        where(Answer.question_id == question_id).
-        offset(offset=offset).limit(limit=limit).
-        options(joinedload(Answer.user)).
-        order_by(ordering)).all()
+        ordering = desc(model.published)
+    if fields is not None:
+        statement = select_fields(model, fields).\
+            where(model.question_id == question_id).\
+            offset(offset=offset).limit(limit=limit).order_by(ordering)
+        return get_fields_rows(session=session, rows=session.exec(statement).all(),
+                               fields=fields)
+    # the model is tracked like any other closure variable,
+    # each table gets its own cached statement
+    statement = lambda_stmt(lambda: select(model).where(model.question_id == question_id))
+    if offset is not None:
+        statement += lambda statement: statement.offset(offset)
+    if limit is not None:
+        statement += lambda statement: statement.limit(limit)
+    # the ordering is a SQL expression, its own cache key becomes part of the lambda's
+    statement += lambda statement: statement.order_by(ordering).\
+        options(joinedload(model.user))
+    return session.execute(statement).scalars().all()
+
+
+def get_answers_by_score(session: Session,
+                         question_id: int,
+                         limit: int | None = None,
+                         after_score: int | None = None,
+                         after_id: int | None = None,
+                         fields: list[str] | None = None,
+                         model: type[Answer] | type[ArchivedAnswer] = Answer):
+    # best answers first, ties broken by the newest id;
+    # walks ix_answer_question_id_score_id backwards,
+    # (after_score, after_id) is the keyset cursor of the previous page
+    statement = select(model) if fields is None else select_fields(model, fields)
+    statement = statement.where(model.question_id == question_id)
+    if after_score is not None and after_id is not None:
+        statement = statement.where(
+            tuple_(model.score, model.id) < tuple_(after_score, after_id))
+    statement = statement.limit(limit=limit).\
+        order_by(desc(model.score), desc(model.id))
+    if fields is not None:
+        return get_fields_rows(session=session, rows=session.exec(statement).all(),
+                               fields=fields)
+    return session.exec(statement.options(joinedload(model.user))).all()
+
+
+def count_answers(session: Session,
+                  question_id: int,
+                  model: type[Answer] | type[ArchivedAnswer] = Answer) -> int:
+    # answered from the (question_id, score, id) index alone
+    statement = lambda_stmt(
+        lambda: select(func.count(model.id)).where(model.question_id == question_id))
+    return session.execute(statement).scalar_one()
+
+
+def get_answer_vote(session: Session,
+                    user_id: int,
+                    answer_id: int,
+                    lock: bool = False) -> AnswerVote | None:
+    # locked, the vote is read as of now rather than as of the transaction's
+    # snapshot, and a concurrent vote of the user waits for this one
+    return session.get(AnswerVote, (user_id, answer_id),
+                       with_for_update=lock, populate_existing=lock)
@@ -1,13 +1,353 @@
+import json
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
 from sqlmodel import Session, create_engine
 from decouple import config
+from fastapi import Request
 
 
 DATABASE_URL = config("DATABASE_URL")
+# number of compiled statements the engine keeps, shared by all connections;
+# every distinct shape of a query (with or without search, each ordering...)
+# takes an entry
+DATABASE_QUERY_CACHE_SIZE = config("DATABASE_QUERY_CACHE_SIZE", default=1200, cast=int)
+# pool settings, ignored for SQLite which doesn't use a QueuePool
+DATABASE_POOL_SIZE = config("DATABASE_POOL_SIZE", default=10, cast=int)
+DATABASE_MAX_OVERFLOW = config("DATABASE_MAX_OVERFLOW", default=10, cast=int)
+# seconds a request waits for a free connection before failing with 503
+DATABASE_POOL_TIMEOUT = config("DATABASE_POOL_TIMEOUT", default=5.0, cast=float)
+DATABASE_POOL_PRE_PING = config("DATABASE_POOL_PRE_PING", default=True, cast=bool)
+# seconds after which a connection is replaced, below MySQL's wait_timeout
+DATABASE_POOL_RECYCLE = config("DATABASE_POOL_RECYCLE", default=1800, cast=int)
+# seconds a statement may run before it is cancelled, 0 disables the limit;
+# routes set their own budgets with the statement_timeout dependency
+DATABASE_STATEMENT_TIMEOUT = config("DATABASE_STATEMENT_TIMEOUT", default=10.0, cast=float)
+# statements taking longer than that many seconds are logged, 0 disables the log
+SLOW_QUERY_THRESHOLD = config("SLOW_QUERY_THRESHOLD", default=0.5, cast=float)
+# number of slow statements kept for GET /debug/slow-queries
+SLOW_QUERY_LOG_SIZE = config("SLOW_QUERY_LOG_SIZE", default=100, cast=int)
+SLOW_QUERY_EXPLAIN = config("SLOW_QUERY_EXPLAIN", default=True, cast=bool)
+# SQLite mode, used when DATABASE_URL is a SQLite file: the pragmas every
+# connection is opened with, see set_sqlite_mode
+SQLITE_JOURNAL_MODE = config("SQLITE_JOURNAL_MODE", default="WAL")
+SQLITE_SYNCHRONOUS = config("SQLITE_SYNCHRONOUS", default="NORMAL")
+SQLITE_MMAP_SIZE = config("SQLITE_MMAP_SIZE", default=256 * 1024 * 1024, cast=int)
+# negative values are in KiB, positive ones in pages
+SQLITE_CACHE_SIZE = config("SQLITE_CACHE_SIZE", default=-64 * 1024, cast=int)
+# milliseconds a writer waits for another process' write to finish
+SQLITE_BUSY_TIMEOUT = config("SQLITE_BUSY_TIMEOUT", default=5000, cast=int)
+
+# MySQL's error for a statement interrupted by MAX_EXECUTION_TIME
+ER_QUERY_TIMEOUT = 3024
+# number of SQLite virtual machine instructions between deadline checks
+SQLITE_PROGRESS_INSTRUCTIONS = 1000
+
+
+def is_sqlite_file(url: str) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def get_engine_options(url: str) -> dict:
+    options = {'query_cache_size': DATABASE_QUERY_CACHE_SIZE}
+    if is_sqlite_file(url):
+        # connections are kept open, so their pragmas and page cache are set up once
+        options.update(poolclass=QueuePool,
+                       pool_size=DATABASE_POOL_SIZE,
+                       max_overflow=DATABASE_MAX_OVERFLOW,
+                       pool_timeout=DATABASE_POOL_TIMEOUT,
+                       connect_args={'check_same_thread': False})
+    elif not url.startswith('sqlite'):
+        options.update(pool_size=DATABASE_POOL_SIZE,
+                       max_overflow=DATABASE_MAX_OVERFLOW,
+                       pool_timeout=DATABASE_POOL_TIMEOUT,
+                       pool_pre_ping=DATABASE_POOL_PRE_PING,
+                       pool_recycle=DATABASE_POOL_RECYCLE)
+    return options
+
+
+def begin_immediate(dbapi_connection):
+    if not dbapi_connection.in_transaction:
+        try:
+            dbapi_connection.execute('BEGIN IMMEDIATE')
+        except dbapi_connection.OperationalError as error:
+            # raised as the statement's own error would be, e.g. 'database is locked'
+            raise OperationalError('BEGIN IMMEDIATE', (), error) from error
+
+
+def begin_on_write(connection, cursor, statement, parameters, context, executemany):
+    # the writer's reads run in autocommit mode, its transaction
+    # and the write lock are only taken by its first write
+    if statement.lstrip()[:6].upper() not in ('SELECT', 'PRAGMA'):
+        begin_immediate(cursor.connection)
+
+
+def set_sqlite_mode(engine: Engine, read_only: bool):
+    # Opens every connection with the SQLITE_* pragmas and begins the
+    # transactions itself, pysqlite would only begin them at the first write.
+    # The writer's begin with BEGIN IMMEDIATE at their first write: a writer
+    # waits busy_timeout for the write lock up front, instead of failing to
+    # upgrade its read lock halfway, and a session holds the lock only from
+    # its first write to its commit, not while it reads, hashes a password...
+    # The readers' begin with a deferred BEGIN, with WAL they read
+    # their snapshot while a write is in progress.
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+        cursor.execute(f'PRAGMA cache_size={SQLITE_CACHE_SIZE}')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=1')
+        else:
+            connection_record.info['sqlite_writer'] = True
+        cursor.close()
+
+    if read_only:
+        @event.listens_for(engine, 'begin')
+        def begin(connection):
+            connection.exec_driver_sql('BEGIN')
+    else:
+        event.listen(engine, 'before_cursor_execute', begin_on_write)
+
+
+def begin_write(session: Session):
+    # For a write depending on what the session reads first (claiming
+    # jobs...): in SQLite mode, begins the write transaction before
+    # those reads, which would otherwise run outside of it.
+    # Elsewhere the session's transaction is already open.
+    connection = session.connection()
+    if connection.info.get('sqlite_writer'):
+        begin_immediate(connection.connection.dbapi_connection)
+
+
+def create_engines(url: str) -> tuple[Engine, Engine]:
+    # the engine for writes and the one for reads, which is the same one
+    # but in SQLite mode, where the readers have their own connections
+    engine = create_engine(url, **get_engine_options(url))
+    if not is_sqlite_file(url):
+        return engine, engine
+    read_engine = create_engine(url, **get_engine_options(url))
+    set_sqlite_mode(engine, read_only=False)
+    set_sqlite_mode(read_engine, read_only=True)
+    return engine, read_engine
+
+
+engine, read_engine = create_engines(DATABASE_URL)
+engines = [engine] if read_engine is engine else [engine, read_engine]
+
+
+class StatementTimeoutError(Exception):
+    pass
+
+
+# seconds the statements of the current request may take,
+# None means DATABASE_STATEMENT_TIMEOUT
+current_statement_timeout: ContextVar[float | None] = ContextVar(
+    'current_statement_timeout', default=None)
+
+
+def statement_timeout(seconds: float):
+    # Dependency setting the statements' budget of the routes using it.
+    # It has to be async: a sync dependency runs in the threadpool,
+    # in a copy of the context that the route never sees.
+    async def set_statement_timeout():
+        current_statement_timeout.set(seconds)
+    return set_statement_timeout
+
+
+def get_statement_timeout() -> float:
+    timeout = current_statement_timeout.get()
+    return DATABASE_STATEMENT_TIMEOUT if timeout is None else timeout
+
+
+def limit_mysql_statement(connection, cursor, statement, parameters, context, executemany):
+    # the optimizer hint only applies to SELECT statements, which the slow ones are
+    timeout = get_statement_timeout()
+    if timeout > 0 and statement.startswith('SELECT '):
+        statement = f'SELECT /*+ MAX_EXECUTION_TIME({int(timeout * 1000)}) */ {statement[7:]}'
+    return statement, parameters
+
+
+def limit_sqlite_statement(connection, cursor, statement, parameters, context, executemany):
+    # SQLite has no statement timeout, the progress handler
+    # interrupts the statement once it runs past its deadline
+    timeout = get_statement_timeout()
+    if timeout > 0:
+        deadline = time.monotonic() + timeout
+        cursor.connection.set_progress_handler(lambda: time.monotonic() > deadline,
+                                               SQLITE_PROGRESS_INSTRUCTIONS)
+
+
+def clear_sqlite_limit(connection, cursor, statement, parameters, context, executemany):
+    cursor.connection.set_progress_handler(None, SQLITE_PROGRESS_INSTRUCTIONS)
+
 
+def is_statement_timeout(error: Exception) -> bool:
+    args = getattr(error, 'args', ())
+    return bool(args) and (args[0] == ER_QUERY_TIMEOUT or args[0] == 'interrupted')
 
-engine = create_engine(DATABASE_URL)
+
+def raise_statement_timeout(context):
+    if context.cursor is not None and context.engine.dialect.name == 'sqlite':
+        context.cursor.connection.set_progress_handler(None, SQLITE_PROGRESS_INSTRUCTIONS)
+    if is_statement_timeout(context.original_exception):
+        raise StatementTimeoutError(
+            f'Statement cancelled after {get_statement_timeout()} seconds') \
+            from context.original_exception
+
+
+def set_statement_timeouts(engine: Engine):
+    if engine.dialect.name == 'mysql':
+        event.listen(engine, 'before_cursor_execute', limit_mysql_statement, retval=True)
+    elif engine.dialect.name == 'sqlite':
+        event.listen(engine, 'before_cursor_execute', limit_sqlite_statement)
+        event.listen(engine, 'after_cursor_execute', clear_sqlite_limit)
+    event.listen(engine, 'handle_error', raise_statement_timeout)
+
+
+for each in engines:
+    set_statement_timeouts(each)
+
+
+class StatementCacheStats:
+    # Counts the statements executed with a compiled form taken from
+    # the engine's cache (hits), compiled and put in it (misses), and
+    # compiled without being cached (uncached, e.g. textual SQL).
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+    def record(self, connection, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        if context.cache_hit is CACHE_HIT:
+            self.hits += 1
+        elif context.cache_hit is CACHE_MISS:
+            self.misses += 1
+        else:
+            self.uncached += 1
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+    def stats(self, engine: Engine) -> dict:
+        cache = engine._compiled_cache
+        return {'size': len(cache) if cache is not None else 0,
+                'maxsize': cache.capacity if cache is not None else 0,
+                'hits': self.hits, 'misses': self.misses, 'uncached': self.uncached}
+
+
+def track_statement_cache(engine: Engine, stats: StatementCacheStats) -> StatementCacheStats:
+    event.listen(engine, 'before_cursor_execute', stats.record)
+    return stats
+
+
+statement_cache_stats = StatementCacheStats()
+for each in engines:
+    track_statement_cache(each, statement_cache_stats)
+
+
+# method and path template of the route being handled, for the slow query log
+current_route: ContextVar[str | None] = ContextVar('current_route', default=None)
+
+
+async def set_current_route(request: Request):
+    # app wide dependency, async for the same reason as statement_timeout
+    route = request.scope.get('route')
+    current_route.set(f'{request.method} {route.path}' if route else request.url.path)
+
+
+class SlowQueryLog:
+    # Keeps the last `size` statements that took longer than `threshold`
+    # seconds with their parameters' types, the route that issued them and their
+    # query plan, and logs each of them as a JSON line.
+
+    def __init__(self, threshold: float, size: int, explain: bool):
+        self.threshold = threshold
+        self.explain = explain
+        self.entries: deque[dict] = deque(maxlen=size)
+        self.logger = logging.getLogger('app.slow_queries')
+
+    # the start is kept on the statement's execution context, which is
+    # dropped with it when the statement fails; dialect's own statements
+    # without a context aren't timed
+    def before_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_start = time.perf_counter()
+
+    def after_execute(self, connection, cursor, statement, parameters, context, executemany):
+        start = getattr(context, 'slow_query_start', None)
+        if start is None or self.threshold <= 0:
+            return
+        duration = time.perf_counter() - start
+        if duration < self.threshold:
+            return
+        entry = {'time': datetime.utcnow().isoformat(),
+                 'duration_ms': round(duration * 1000, 3),
+                 'route': current_route.get(),
+                 'statement': statement,
+                 # the values are left out, they may be emails, password hashes...
+                 'parameter_types': [type(parameter).__name__ for parameter in parameters]
+                 if isinstance(parameters, (list, tuple))
+                 else {name: type(value).__name__ for name, value in parameters.items()},
+                 'plan': None}
+        if self.explain and not executemany and statement.lstrip().startswith('SELECT'):
+            entry['plan'] = self.get_plan(connection, cursor, statement, parameters)
+        self.entries.append(entry)
+        self.logger.warning(json.dumps(entry, default=str))
+
+    def get_plan(self, connection, cursor, statement, parameters) -> list[list[str]] | None:
+        # a separate DBAPI cursor, the statement's results are still being read
+        # and the engine's events must not fire for the EXPLAIN itself
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+        explain_cursor = cursor.connection.cursor()
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            return [[str(value) for value in row] for row in explain_cursor.fetchall()]
+        except Exception as error:
+            return [[f'EXPLAIN failed: {error!r}']]
+        finally:
+            explain_cursor.close()
+
+    def clear(self):
+        self.entries.clear()
+
+
+def track_slow_queries(engine: Engine, log: SlowQueryLog) -> SlowQueryLog:
+    event.listen(engine, 'before_cursor_execute', log.before_execute)
+    event.listen(engine, 'after_cursor_execute', log.after_execute)
+    return log
+
+
+slow_query_log = SlowQueryLog(threshold=SLOW_QUERY_THRESHOLD, size=SLOW_QUERY_LOG_SIZE,
+                              explain=SLOW_QUERY_EXPLAIN)
+for each in engines:
+    track_slow_queries(each, slow_query_log)
 
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+def get_read_session():
+    # for what only reads, on its own connections in SQLite mode
+    with Session(read_engine) as session:
+        yield session
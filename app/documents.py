@@ -0,0 +1,115 @@
+import json
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import Session, select, delete
+from sqlalchemy import lambda_stmt
+
+from .crud import get_all_questions
+from .database import begin_write
+from .models import Question, QuestionDocument
+from .schemas import QuestionRead
+
+
+# Every question is stored rendered as QuestionRead JSON, with its user and
+# tags, so that reading it is a single primary key lookup instead of joining
+# question, user, tagged_questions and tag. Documents are saved in the
+# transaction changing what they are rendered from, the question and its
+# tags. A change of its author's username or email enqueues a 'user_documents'
+# job (see app/archive.py), which rebuilds the author's documents in chunks
+# as a user may have many questions. A question without a document
+# (not backfilled yet with 'python -m app rebuild-documents') is rendered
+# from the tables.
+
+def dump_document(data: dict) -> str:
+    # rendered like JSONResponse does, documents are sent as they are
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def render_document(question: Question) -> str:
+    return dump_document(jsonable_encoder(QuestionRead.from_orm(question)))
+
+
+def save_documents(session: Session, questions: list[Question], new: bool = False):
+    # the caller flushes the questions before and commits after;
+    # new questions have no document yet, so there is nothing to look up
+    now = datetime.utcnow()
+    existing = {} if new else {
+        document.question_id: document for document in session.exec(
+            select(QuestionDocument).
+            where(QuestionDocument.question_id.in_([question.id for question in questions])))}
+    for question in questions:
+        document = existing.get(question.id)
+        if document is None:
+            document = QuestionDocument(question_id=question.id)
+        document.document = render_document(question)
+        document.updated = now
+        session.add(document)
+
+
+def rebuild_documents(session: Session, questions_ids: list[int], chunk_size: int = 500):
+    for start in range(0, len(questions_ids), chunk_size):
+        questions = get_all_questions(session=session,
+                                      ids=questions_ids[start:start + chunk_size])
+        save_documents(session=session, questions=questions)
+        session.flush()
+
+
+def rebuild_user_documents(session: Session, user_id: int, chunk_size: int = 500) -> int:
+    # the user's questions in id order, a transaction per chunk
+    done = 0
+    last_id = 0
+    while True:
+        ids = session.exec(select(Question.id).
+                           where(Question.user_id == user_id, Question.id > last_id).
+                           order_by(Question.id).
+                           limit(chunk_size)).all()
+        if not ids:
+            return done
+        begin_write(session)
+        rebuild_documents(session=session, questions_ids=ids, chunk_size=chunk_size)
+        session.commit()
+        done += len(ids)
+        last_id = ids[-1]
+
+
+def delete_documents(session: Session, questions_ids: list[int]):
+    session.exec(delete(QuestionDocument).
+                 where(QuestionDocument.question_id.in_(questions_ids)))
+
+
+def get_documents(session: Session, questions_ids: list[int]) -> dict[int, str]:
+    # missing questions and questions without a document are rendered
+    # from the tables, only the found ones are in the result
+    if not questions_ids:
+        return {}
+    statement = lambda_stmt(
+        lambda: select(QuestionDocument.question_id, QuestionDocument.document).
+        where(QuestionDocument.question_id.in_(questions_ids)))
+    documents = dict(session.execute(statement).all())
+    missing = [id for id in questions_ids if id not in documents]
+    if missing:
+        for question in get_all_questions(session=session, ids=missing):
+            documents[question.id] = render_document(question)
+    return documents
+
+
+def rebuild_all_documents(session: Session, chunk_size: int = 500,
+                          progress=None) -> int:
+    # every question in id order, a transaction per chunk
+    done = 0
+    last_id = 0
+    while True:
+        ids = session.exec(select(Question.id).
+                           where(Question.id > last_id).
+                           order_by(Question.id).
+                           limit(chunk_size)).all()
+        if not ids:
+            return done
+        begin_write(session)
+        rebuild_documents(session=session, questions_ids=ids, chunk_size=chunk_size)
+        session.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(done)
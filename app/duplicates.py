@@ -0,0 +1,302 @@
+import os
+import random
+import re
+import struct
+import time
+import zlib
+from array import array
+from datetime import datetime
+from threading import Lock, Thread
+from typing import Sequence
+
+from decouple import config
+from sqlmodel import Session, select, or_
+
+from .models import Question
+
+
+# files the app writes, next to the app package unless set
+DATA_DIR = config('DATA_DIR', default=os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+DUPLICATES_INDEX_PATH = config('DUPLICATES_INDEX_PATH',
+                               default=os.path.join(DATA_DIR, 'duplicates_index.bin'))
+# estimated Jaccard similarity of shingles above which a question is reported
+DUPLICATES_THRESHOLD = config('DUPLICATES_THRESHOLD', default=0.6, cast=float)
+# the index is written to disk after this many changes and on shutdown,
+# changes made after the last save are recovered from the question table on load
+DUPLICATES_SAVE_EVERY = config('DUPLICATES_SAVE_EVERY', default=10000, cast=int)
+# questions minhashed per lock hold while the index catches up after a load
+DUPLICATES_CHUNK_SIZE = config('DUPLICATES_CHUNK_SIZE', default=1000, cast=int)
+# seconds a question's transaction may take to commit after it was published
+# and still be found by the next catch up, see catch_up
+DUPLICATES_SYNC_MARGIN = config('DUPLICATES_SYNC_MARGIN', default=60.0, cast=float)
+
+NUM_PERM = 64
+# 16 bands of 4 rows make questions with similarity around 0.5 and above
+# share at least one bucket with high probability
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_random = random.Random(20230901)
+_PERMUTATIONS = [(_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERM)]
+
+_FILE_HEADER = struct.Struct('<6sIdQQ')
+_FILE_MAGIC = b'MHLSH2'
+
+_word = re.compile(r'\w+')
+
+
+def shingles(title: str, content: str | None = None) -> set[int]:
+    words = _word.findall(f'{title} {content or ""}'.lower())
+    if len(words) < 3:
+        return {zlib.crc32(' '.join(words).encode())}
+    return {zlib.crc32(' '.join(words[i:i + 3]).encode())
+            for i in range(len(words) - 2)}
+
+
+def minhash(title: str, content: str | None = None) -> tuple[int, ...]:
+    hashes = shingles(title=title, content=content)
+    return tuple(min([(a * value + b) % _MERSENNE_PRIME for value in hashes]) & _MAX_HASH
+                 for a, b in _PERMUTATIONS)
+
+
+def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(first, second) if x == y) / NUM_PERM
+
+
+def bands(signature: Sequence[int]) -> list[int]:
+    return [hash((band, *signature[band * ROWS:(band + 1) * ROWS]))
+            for band in range(BANDS)]
+
+
+class DuplicatesIndex:
+    # MinHash signatures of questions' titles and contents,
+    # bucketed by LSH bands so that finding candidates only looks at
+    # questions sharing at least one band with the new one.
+    # Signatures are packed in a single array of 32 bits integers, NUM_PERM
+    # per slot, slots freed by removed questions are reused. Most buckets
+    # hold a single question, held as the id itself rather than a set.
+
+    def __init__(self, path: str = DUPLICATES_INDEX_PATH):
+        self.path = path
+        self._lock = Lock()
+        self._save_lock = Lock()
+        self._reset()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _reset(self):
+        self._slots: dict[int, int] = {}
+        self._signatures = array('I')
+        self._free: list[int] = []
+        self._buckets: dict[int, int | set[int]] = {}
+        self._changes = 0
+        # how far the index caught up with the question table, None if it
+        # never did; what this process added since comes on top of it
+        self.synced_at: float | None = None
+        self.synced_id = 0
+        # False until the questions changed since the index was saved are
+        # in it, it isn't saved before, see catch_up
+        self.complete = False
+        self._touched: set[int] = set()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _signature(self, slot: int) -> array:
+        return self._signatures[slot * NUM_PERM:(slot + 1) * NUM_PERM]
+
+    def _add(self, question_id: int, signature: Sequence[int]):
+        self._remove(question_id)
+        if self._free:
+            slot = self._free.pop()
+            self._signatures[slot * NUM_PERM:(slot + 1) * NUM_PERM] = array('I', signature)
+        else:
+            slot = len(self._signatures) // NUM_PERM
+            self._signatures.extend(signature)
+        self._slots[question_id] = slot
+        self._bucket(question_id, signature)
+
+    def _bucket(self, question_id: int, signature: Sequence[int]):
+        for key in bands(signature):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = question_id
+            elif isinstance(bucket, set):
+                bucket.add(question_id)
+            elif bucket != question_id:
+                self._buckets[key] = {bucket, question_id}
+
+    def _remove(self, question_id: int):
+        slot = self._slots.pop(question_id, None)
+        if slot is None:
+            return
+        for key in bands(self._signature(slot)):
+            bucket = self._buckets.get(key)
+            if isinstance(bucket, set):
+                bucket.discard(question_id)
+                if len(bucket) == 1:
+                    self._buckets[key] = bucket.pop()
+            elif bucket == question_id:
+                del self._buckets[key]
+        self._free.append(slot)
+
+    def add(self, question_id: int, title: str, content: str | None = None):
+        signature = minhash(title=title, content=content)
+        with self._lock:
+            self._add(question_id, signature)
+            self._touch(question_id)
+        self._save_if_due()
+
+    def remove(self, question_id: int):
+        with self._lock:
+            self._remove(question_id)
+            self._touch(question_id)
+        self._save_if_due()
+
+    def _touch(self, question_id: int):
+        # a question written while catching up is newer than what catch_up read
+        self._changes += 1
+        if not self.complete:
+            self._touched.add(question_id)
+
+    def find(self,
+             title: str,
+             content: str | None = None,
+             limit: int = 5) -> list[tuple[int, float]]:
+        signature = minhash(title=title, content=content)
+        with self._lock:
+            candidates = set()
+            for key in bands(signature):
+                bucket = self._buckets.get(key)
+                if isinstance(bucket, set):
+                    candidates.update(bucket)
+                elif bucket is not None:
+                    candidates.add(bucket)
+            scored = [(question_id, similarity(signature,
+                                               self._signature(self._slots[question_id])))
+                      for question_id in candidates]
+        scored = [item for item in scored if item[1] >= DUPLICATES_THRESHOLD]
+        scored.sort(key=lambda item: (item[1], item[0]), reverse=True)
+        return scored[:limit]
+
+    def _save_if_due(self):
+        if (self.complete and self._changes >= DUPLICATES_SAVE_EVERY
+                and not self._save_lock.locked()):
+            Thread(target=self.save, daemon=True).start()
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                synced_at, synced_id = self.synced_at or 0.0, self.synced_id
+                ids = array('q', self._slots)
+                signatures = array('I')
+                for slot in self._slots.values():
+                    signatures.extend(self._signature(slot))
+                self._changes = 0
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary_path = f'{self.path}.tmp'
+            with open(temporary_path, 'wb') as file:
+                file.write(_FILE_HEADER.pack(_FILE_MAGIC, NUM_PERM, synced_at, synced_id,
+                                             len(ids)))
+                ids.tofile(file)
+                signatures.tofile(file)
+            os.replace(temporary_path, self.path)
+
+    def read(self) -> float | None:
+        # Replaces the index with the saved one, returns the time it had
+        # caught up to, or None if there is no file or it can't be used.
+        with self._lock:
+            self._reset()
+            try:
+                with open(self.path, 'rb') as file:
+                    magic, num_perm, synced_at, synced_id, count = _FILE_HEADER.unpack(
+                        file.read(_FILE_HEADER.size))
+                    if magic != _FILE_MAGIC or num_perm != NUM_PERM:
+                        return None
+                    ids = array('q')
+                    ids.fromfile(file, count)
+                    signatures = array('I')
+                    signatures.fromfile(file, count * NUM_PERM)
+            except (OSError, EOFError, struct.error):
+                return None
+            self._signatures = signatures
+            self._slots = {question_id: slot for slot, question_id in enumerate(ids)}
+            for question_id, slot in self._slots.items():
+                self._bucket(question_id, self._signature(slot))
+            self.synced_at, self.synced_id = synced_at, synced_id
+            return synced_at
+
+    def catch_up(self, session: Session, chunk_size: int = DUPLICATES_CHUNK_SIZE) -> int:
+        # Indexes the questions created or edited since the saved index last
+        # caught up, or all of them without a saved index, a chunk at a time:
+        # they are minhashed without the lock, requests finding duplicates
+        # meanwhile see the questions indexed so far. The ids the index holds
+        # don't tell how far it got, the process that saved it only added its
+        # own questions, the other processes' may have lower ids. Questions
+        # deleted before may stay in the index, callers drop candidates that
+        # no longer exist.
+        started = time.time()
+        statement = select(Question.id, Question.title, Question.content)
+        with self._lock:
+            synced_at, synced_id = self.synced_at, self.synced_id
+        if synced_at is not None:
+            since = datetime.utcfromtimestamp(synced_at)
+            statement = statement.where(
+                or_(Question.id > synced_id,
+                    Question.published >= since,
+                    Question.updated >= since))
+        done = 0
+        last_id = 0
+        max_id = synced_id
+        while True:
+            rows = session.exec(statement.
+                                where(Question.id > last_id).
+                                order_by(Question.id).
+                                limit(chunk_size)).all()
+            signatures = [(question_id, minhash(title=title, content=content))
+                          for question_id, title, content in rows]
+            with self._lock:
+                for question_id, signature in signatures:
+                    if question_id not in self._touched:
+                        self._add(question_id, signature)
+            done += len(rows)
+            if rows:
+                max_id = max(max_id, rows[-1][0])
+            if len(rows) < chunk_size:
+                break
+            last_id = rows[-1][0]
+        with self._lock:
+            # a question published before the start but committed after it is
+            # found again by the next catch up if within the margin
+            self.synced_at = started - DUPLICATES_SYNC_MARGIN
+            self.synced_id = max_id
+            self.complete = True
+            self._touched = set()
+        return done
+
+    def load(self, session: Session, chunk_size: int = DUPLICATES_CHUNK_SIZE):
+        self.read()
+        self.catch_up(session=session, chunk_size=chunk_size)
+
+    def prune(self, session: Session, chunk_size: int = 1000):
+        # drops the questions that are no longer in the question table,
+        # archived or deleted by another process
+        with self._lock:
+            ids = sorted(self._slots)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            existing = set(session.exec(select(Question.id).
+                                        where(Question.id.in_(chunk))).all())
+            with self._lock:
+                for question_id in chunk:
+                    if question_id not in existing:
+                        self._remove(question_id)
+
+
+duplicates_index = DuplicatesIndex()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from threading import Lock
+from typing import Callable
+
+from decouple import config
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from .duplicates import duplicates_index
+from .models import IndexVersion
+from .tag_index import tag_index
+
+
+# Every app process keeps the tag and duplicates indexes in memory and
+# updates them after its own writes. The changes made elsewhere, by the maintenance commands or
+# the archival job, bump the index's version in index_version in their own
+# transaction, and each process reloads the indexes whose version changed,
+# looking every INDEXES_CHECK_INTERVAL seconds (a primary key read).
+INDEXES_CHECK_INTERVAL = config('INDEXES_CHECK_INTERVAL', default=5.0, cast=float)
+
+logger = logging.getLogger(__name__)
+
+reloaders: dict[str, Callable[[Session], None]] = {
+    'tags': lambda session: tag_index.load(session=session),
+    'duplicates': lambda session: duplicates_index.prune(session=session),
+}
+
+
+def bump_index_versions(session: Session, names: list[str]):
+    # the caller commits, together with the change; the migrations seed the
+    # rows, an upsert still adds a missing one without racing to add it twice
+    dialect = session.get_bind().dialect.name
+    for name in names:
+        if dialect == 'mysql':
+            statement = mysql.insert(IndexVersion).values(name=name, version=1).\
+                on_duplicate_key_update(version=IndexVersion.version + 1)
+        elif dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = insert(IndexVersion).values(name=name, version=1).\
+                on_conflict_do_update(index_elements=[IndexVersion.name],
+                                      set_={'version': IndexVersion.version + 1})
+        else:
+            bumped = session.exec(update(IndexVersion).
+                                  where(IndexVersion.name == name).
+                                  values(version=IndexVersion.version + 1))
+            if not bumped.rowcount:
+                session.add(IndexVersion(name=name, version=1))
+            continue
+        session.execute(statement)
+
+
+def get_index_versions(session: Session) -> dict[str, int]:
+    return dict(session.exec(select(IndexVersion.name, IndexVersion.version)).all())
+
+
+class IndexWatcher:
+    # the versions of the indexes this process loaded
+
+    def __init__(self):
+        self._lock = Lock()
+        self.versions: dict[str, int] | None = None
+
+    def clear(self):
+        with self._lock:
+            self.versions = None
+
+    def record(self, session: Session):
+        # read before the indexes are loaded, a change made
+        # while they load gets them reloaded at the next check
+        with self._lock:
+            self.versions = get_index_versions(session=session)
+
+    def check(self, session: Session) -> list[str]:
+        # reloads the indexes changed since recorded and returns their names
+        with self._lock:
+            if self.versions is None:
+                return []
+            versions = get_index_versions(session=session)
+            changed = [name for name, version in versions.items()
+                       if name in reloaders and self.versions.get(name, 0) != version]
+            for name in changed:
+                reloaders[name](session)
+            self.versions = versions
+            return changed
+
+
+index_watcher = IndexWatcher()
+
+
+async def watch_indexes(engine: Engine, stop: asyncio.Event,
+                        interval: float = INDEXES_CHECK_INTERVAL):
+    # checks run in the threadpool
+    def check() -> list[str]:
+        with Session(engine) as session:
+            return index_watcher.check(session=session)
+
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            changed = await asyncio.to_thread(check)
+            if changed:
+                logger.info('Indexes reloaded: %s', ', '.join(changed))
+        except Exception:
+            logger.exception('Indexes check failed')
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Callable
+
+from decouple import config
+from sqlalchemy import func, update, delete
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from .database import begin_write
+from .models import Job, Question, TaggedQuestions
+from .ranking import record_activities
+from .related import refresh_related
+
+
+# Side effects of writes (ranking, related questions...) are enqueued
+# as rows of the job table in the write's own transaction, so they are
+# neither lost nor run for a write that was rolled back, and are run later
+# by workers, in the app (JOBS_WORKERS) or in `python -m app worker`.
+# A worker claims a batch of due jobs by pushing their run_after past
+# JOBS_LEASE_SECONDS, so a job held by a worker that died is run again.
+# Jobs of the same kind in a batch are handled by a single call, and
+# one by one when that call fails, so handlers must be idempotent.
+JOBS_WORKERS = config('JOBS_WORKERS', default=1, cast=int)
+JOBS_BATCH_SIZE = config('JOBS_BATCH_SIZE', default=100, cast=int)
+JOBS_LEASE_SECONDS = config('JOBS_LEASE_SECONDS', default=60, cast=int)
+# seconds an idle worker waits before looking for jobs again
+JOBS_POLL_INTERVAL = config('JOBS_POLL_INTERVAL', default=1.0, cast=float)
+JOBS_MAX_ATTEMPTS = config('JOBS_MAX_ATTEMPTS', default=5, cast=int)
+# a failed job is retried after JOBS_RETRY_DELAY * 2 ** (attempts - 1) seconds
+JOBS_RETRY_DELAY = config('JOBS_RETRY_DELAY', default=5, cast=int)
+
+logger = logging.getLogger(__name__)
+
+handlers: dict[str, Callable[[Session, list[dict]], None]] = {}
+
+
+def job_handler(kind: str):
+    def register(handler: Callable[[Session, list[dict]], None]):
+        handlers[kind] = handler
+        return handler
+    return register
+
+
+def enqueue(session: Session, kind: str, payloads: list[dict],
+            run_after: datetime | None = None):
+    # the caller commits, together with the write the jobs follow from
+    now = datetime.utcnow()
+    session.add_all([Job(kind=kind, payload=json.dumps(payload, default=str),
+                         created=now, run_after=run_after or now) for payload in payloads])
+
+
+def claim_jobs(session: Session, limit: int) -> list[Job]:
+    now = datetime.utcnow()
+    due = select(Job.id).where(Job.failed == False, Job.run_after <= now)
+    # looked for without the write lock first, an idle worker polling
+    # doesn't compete with the requests' writes for it in SQLite mode
+    if session.exec(due.limit(1)).first() is None:
+        session.rollback()
+        return []
+    begin_write(session)
+    # SKIP LOCKED lets concurrent workers claim different jobs on MySQL,
+    # SQLite serializes the writers anyway
+    ids = session.exec(
+        due.
+        order_by(Job.id).
+        limit(limit).
+        with_for_update(skip_locked=True)).all()
+    if not ids:
+        session.rollback()
+        return []
+    session.exec(update(Job).
+                 where(Job.id.in_(ids)).
+                 values(run_after=now + timedelta(seconds=JOBS_LEASE_SECONDS)))
+    session.commit()
+    return session.exec(select(Job).where(Job.id.in_(ids)).order_by(Job.id)).all()
+
+
+def run_kind(session: Session, kind: str, jobs: list[Job]):
+    # Raises if the handler does, nothing of the batch is then kept.
+    # Handlers read what they write from, in SQLite mode the write
+    # transaction begins first; one committing as it goes begins again.
+    payloads = [json.loads(job.payload) for job in jobs]
+    begin_write(session)
+    handlers[kind](session, payloads)
+    session.exec(delete(Job).where(Job.id.in_([job.id for job in jobs])))
+    session.commit()
+
+
+def run_jobs(session: Session, jobs: list[Job]):
+    by_kind: dict[str, list[Job]] = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, kind_jobs in by_kind.items():
+        ids = [job.id for job in kind_jobs]
+        try:
+            run_kind(session=session, kind=kind, jobs=kind_jobs)
+        except Exception as error:
+            session.rollback()
+            if len(kind_jobs) > 1 and kind in handlers:
+                # a failing job doesn't take the others of its batch down
+                # with it, they are run again one by one
+                run_jobs_one_by_one(session=session, kind=kind, jobs=kind_jobs)
+            else:
+                logger.exception('Jobs %s of kind %s failed', ids, kind)
+                fail_jobs(session=session, ids=ids, error=error)
+
+
+def run_jobs_one_by_one(session: Session, kind: str, jobs: list[Job]):
+    for job in jobs:
+        try:
+            run_kind(session=session, kind=kind, jobs=[job])
+        except Exception as error:
+            session.rollback()
+            logger.exception('Job %s of kind %s failed', job.id, kind)
+            fail_jobs(session=session, ids=[job.id], error=error)
+
+
+def fail_jobs(session: Session, ids: list[int], error: Exception):
+    now = datetime.utcnow()
+    for job in session.exec(select(Job).where(Job.id.in_(ids))).all():
+        job.attempts += 1
+        job.last_error = repr(error)[:1024]
+        job.failed = job.attempts >= JOBS_MAX_ATTEMPTS
+        job.run_after = now + timedelta(seconds=JOBS_RETRY_DELAY * 2 ** (job.attempts - 1))
+        session.add(job)
+    session.commit()
+
+
+def run_batch(session: Session, limit: int = JOBS_BATCH_SIZE) -> int:
+    jobs = claim_jobs(session=session, limit=limit)
+    if jobs:
+        run_jobs(session=session, jobs=jobs)
+    return len(jobs)
+
+
+def run_pending(session: Session) -> int:
+    # runs every due job, batch after batch, in the calling thread
+    done = 0
+    while processed := run_batch(session=session):
+        done += processed
+    return done
+
+
+async def work(engine: Engine, stop: asyncio.Event):
+    # a worker: batches run in the threadpool, so the app's
+    # event loop isn't blocked by them
+    def run() -> int:
+        with Session(engine) as session:
+            return run_batch(session=session)
+
+    while not stop.is_set():
+        try:
+            processed = await asyncio.to_thread(run)
+        except Exception:
+            logger.exception('Jobs worker failed to run a batch')
+            processed = 0
+        if not processed:
+            try:
+                await asyncio.wait_for(stop.wait(), JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+def get_queue_stats(session: Session) -> dict:
+    now = datetime.utcnow()
+    stats = {'pending': 0, 'failed': 0, 'oldest_pending_seconds': None, 'kinds': {}}
+    rows = session.exec(
+        select(Job.kind, Job.failed, func.count(), func.min(Job.created)).
+        group_by(Job.kind, Job.failed)).all()
+    for kind, failed, count, oldest in rows:
+        kind_stats = stats['kinds'].setdefault(kind, {'pending': 0, 'failed': 0})
+        status = 'failed' if failed else 'pending'
+        kind_stats[status] = count
+        stats[status] += count
+        if not failed:
+            age = (now - oldest).total_seconds()
+            stats['oldest_pending_seconds'] = max(stats['oldest_pending_seconds'] or 0, age)
+    return stats
+
+
+@job_handler('question_activity')
+def handle_question_activity(session: Session, payloads: list[dict]):
+    # questions deleted since are skipped, their ranks are gone with them
+    existing = set(session.exec(
+        select(Question.id).
+        where(Question.id.in_({payload['question_id'] for payload in payloads}))).all())
+    record_activities(session=session, activities=[
+        (payload['question_id'], payload['weight'], datetime.fromisoformat(payload['at']))
+        for payload in payloads if payload['question_id'] in existing])
+
+
+@job_handler('refresh_related')
+def handle_refresh_related(session: Session, payloads: list[dict]):
+    # a question enqueued many times is refreshed once, with its current tags
+    questions_ids = sorted({payload['question_id'] for payload in payloads})
+    existing = set(session.exec(
+        select(Question.id).where(Question.id.in_(questions_ids))).all())
+    tags_ids: dict[int, list[int]] = {question_id: [] for question_id in existing}
+    for question_id, tag_id in session.exec(
+            select(TaggedQuestions.question_id, TaggedQuestions.tag_id).
+            where(TaggedQuestions.question_id.in_(existing))).all():
+        tags_ids[question_id].append(tag_id)
+    for question_id in sorted(existing):
+        refresh_related(session=session, question_id=question_id,
+                        tags_ids=tags_ids[question_id])
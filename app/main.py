@@ -1,14 +1,78 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 
-from .routers import users, questions, answers
+from fastapi import Depends, FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from .database import engine, read_engine, StatementTimeoutError, set_current_route
+from .routers import users, questions, answers, tags, debug, health
 from .schemas import RootModel
+from .duplicates import duplicates_index
+from .compression import CompressionMiddleware
+from .admission import AdmissionMiddleware, ADMISSION_RETRY_AFTER
+from .profiler import ProfilerMiddleware
+from .warmup import WarmupState, warm_up
+from .jobs import JOBS_WORKERS, work
+from .indexes import watch_indexes
+from .archive import ARCHIVE_INTERVAL_HOURS, schedule_archival
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The server accepts requests while warming up,
+    # /health/ready tells the load balancer when to send traffic.
+    app.state.warmup = WarmupState()
+    warmup = asyncio.create_task(asyncio.to_thread(
+        warm_up, engine, app.state.warmup, read_engine=read_engine))
+    stop_workers = asyncio.Event()
+    workers = [asyncio.create_task(work(engine, stop_workers)) for _ in range(JOBS_WORKERS)]
+    workers.append(asyncio.create_task(watch_indexes(read_engine, stop_workers)))
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        try:
+            await asyncio.to_thread(schedule_archival, engine)
+        except Exception:
+            logger.exception('Archival scheduling failed')
+    yield
+    if not warmup.done():
+        app.state.warmup.stop.set()
+        warmup.cancel()
+    # a batch being run is finished, the jobs left wait for the next start
+    stop_workers.set()
+    await asyncio.gather(*workers)
+    # an index that didn't catch up must not overwrite the saved one
+    if duplicates_index.complete:
+        duplicates_index.save()
 
-app = FastAPI(debug=True)
 
+app = FastAPI(debug=True, lifespan=lifespan, dependencies=[Depends(set_current_route)])
+
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ProfilerMiddleware)
+# added last to be the outermost one, shed requests cost as little as possible
+app.add_middleware(AdmissionMiddleware)
 
 app.include_router(users.router)
 app.include_router(questions.router)
 app.include_router(answers.router)
+app.include_router(tags.router)
+app.include_router(debug.router)
+app.include_router(health.router)
+
+
+# A statement over its budget or no free connection in the pool fail only
+# the request, with a 503 the client may retry, instead of holding a worker.
+@app.exception_handler(StatementTimeoutError)
+@app.exception_handler(PoolTimeoutError)
+async def database_timeout_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'detail': 'The database took too long to answer, retry later.'},
+        headers={'Retry-After': str(ADMISSION_RETRY_AFTER)}
+    )
 
 
 @app.get("/")
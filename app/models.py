@@ -1,4 +1,6 @@
 from datetime import datetime
+from typing import Optional
+from sqlalchemy import Column, Index, Text
 from sqlmodel import Field, Relationship, SQLModel
 
 from .schemas import UserBase, QuestionBase, TagBase, AnswerBase
@@ -16,6 +18,11 @@ class User(UserBase, table=True):
 
 class TaggedQuestions(SQLModel, table=True):
     __tablename__ = 'tagged_questions'
+    # the primary key serves lookups by question, this one lookups by tag
+    __table_args__ = (
+        Index('ix_tagged_questions_tag_id_question_id',
+              'tag_id', 'question_id'),
+    )
     question_id: int | None = Field(
         foreign_key='question.id', primary_key=True, default=None
     )
@@ -25,8 +32,16 @@ class TaggedQuestions(SQLModel, table=True):
 
 
 class Question(QuestionBase, table=True):
+    # serves the user profile's count and latest question
+    # ids of archived questions must not be given again, which SQLite
+    # does without AUTOINCREMENT once the highest ids are archived, and
+    # MySQL before 8.0 after a restart: MySQL 8.0 or later is required
+    __table_args__ = (
+        Index('ix_question_user_id_published', 'user_id', 'published'),
+        {'sqlite_autoincrement': True},
+    )
     id: int | None = Field(primary_key=True, default=None)
-    published: datetime = Field(default=datetime.utcnow())
+    published: datetime = Field(default_factory=datetime.utcnow)
     updated: datetime | None = Field(default=None)
     user_id: int = Field(foreign_key="user.id")
 
@@ -34,6 +49,8 @@ class Question(QuestionBase, table=True):
     tags: list["Tag"] = Relationship(link_model=TaggedQuestions)
     answers: list["Answer"] = Relationship(back_populates='question',
                                            sa_relationship_kwargs={"cascade": "delete"})
+    rank: Optional["QuestionRank"] = Relationship(
+        sa_relationship_kwargs={"cascade": "delete", "uselist": False})
 
 
 class Tag(TagBase, table=True):
@@ -41,11 +58,173 @@ class Tag(TagBase, table=True):
 
 
 class Answer(AnswerBase, table=True):
+    # serves score-ordered listings of a question's answers,
+    # including keyset paging on (score, id), without a filesort
+    __table_args__ = (
+        Index('ix_answer_question_id_score_id',
+              'question_id', 'score', 'id'),
+        Index('ix_answer_user_id_published', 'user_id', 'published'),
+        {'sqlite_autoincrement': True},
+    )
     id: int | None = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     question_id: int = Field(foreign_key="question.id")
-    published: datetime = Field(default=datetime.utcnow())
+    published: datetime = Field(default_factory=datetime.utcnow)
     updated: datetime | None = Field(default=None)
+    # sum of all votes on the answer, kept in step with answer_vote
+    score: int = Field(default=0)
 
     user: User = Relationship(back_populates="answers")
     question: Question = Relationship(back_populates="answers")
+    votes: list["AnswerVote"] = Relationship(
+        sa_relationship_kwargs={"cascade": "delete"})
+
+
+class AnswerVote(SQLModel, table=True):
+    __tablename__ = 'answer_vote'
+    user_id: int | None = Field(
+        foreign_key='user.id', primary_key=True, default=None
+    )
+    answer_id: int | None = Field(
+        foreign_key='answer.id', primary_key=True, default=None
+    )
+    # either 1 or -1
+    value: int
+
+
+class QuestionRank(SQLModel, table=True):
+    __tablename__ = 'question_rank'
+    question_id: int | None = Field(
+        foreign_key='question.id', primary_key=True, default=None
+    )
+    # log2 of the question's activity, with every event weighted
+    # by how late it happened, see app/ranking.py
+    hot: float = Field(index=True)
+    updated: datetime
+
+
+class RelatedQuestion(SQLModel, table=True):
+    __tablename__ = 'related_question'
+    # serves a question's neighbours ordered by the number of shared tags
+    __table_args__ = (
+        Index('ix_related_question_question_id_shared_tags',
+              'question_id', 'shared_tags', 'related_id'),
+    )
+    question_id: int | None = Field(
+        foreign_key='question.id', primary_key=True, default=None
+    )
+    related_id: int | None = Field(
+        foreign_key='question.id', primary_key=True, default=None
+    )
+    shared_tags: int
+
+
+class QuestionDocument(SQLModel, table=True):
+    __tablename__ = 'question_document'
+    question_id: int | None = Field(
+        foreign_key='question.id', primary_key=True, default=None
+    )
+    # the question rendered as QuestionRead JSON, see app/documents.py
+    document: str = Field(sa_column=Column(Text, nullable=False))
+    updated: datetime
+
+
+class Job(SQLModel, table=True):
+    # a deferred side effect of a write, see app/jobs.py
+    __table_args__ = (
+        Index('ix_job_failed_run_after', 'failed', 'run_after'),
+    )
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=64)
+    # JSON arguments of the job's handler
+    payload: str = Field(max_length=1024)
+    created: datetime
+    # the job isn't run before that, it is pushed back while a worker
+    # holds the job and after every failure
+    run_after: datetime
+    attempts: int = Field(default=0)
+    last_error: str | None = Field(default=None, max_length=1024)
+    # set once the job failed JOBS_MAX_ATTEMPTS times, it isn't run again
+    failed: bool = Field(default=False)
+
+
+# Questions inactive for ARCHIVE_AFTER_DAYS are moved, with their answers,
+# votes and tag links, to the tables below, see app/archive.py.
+# They are read-only there and the hot tables' indexes don't hold them.
+
+class ArchivedQuestion(QuestionBase, table=True):
+    __tablename__ = 'archived_question'
+    __table_args__ = (
+        Index('ix_archived_question_user_id_published', 'user_id', 'published'),
+    )
+    # the question's id, kept so that its urls still work
+    id: int | None = Field(primary_key=True, default=None)
+    published: datetime
+    updated: datetime | None = Field(default=None)
+    user_id: int = Field(foreign_key="user.id")
+    archived: datetime
+    # the question rendered as QuestionRead JSON when it was archived
+    document: str = Field(sa_column=Column(Text, nullable=False))
+
+
+class ArchivedTaggedQuestions(SQLModel, table=True):
+    __tablename__ = 'archived_tagged_questions'
+    __table_args__ = (
+        Index('ix_archived_tagged_questions_tag_id_question_id',
+              'tag_id', 'question_id'),
+    )
+    question_id: int | None = Field(
+        foreign_key='archived_question.id', primary_key=True, default=None
+    )
+    tag_id: int | None = Field(
+        foreign_key='tag.id', primary_key=True, default=None
+    )
+
+
+class ArchivedAnswer(AnswerBase, table=True):
+    __tablename__ = 'archived_answer'
+    # same indexes as answer's, the listings of answers read either table
+    __table_args__ = (
+        Index('ix_archived_answer_question_id_score_id',
+              'question_id', 'score', 'id'),
+        Index('ix_archived_answer_user_id_published', 'user_id', 'published'),
+    )
+    id: int | None = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    question_id: int = Field(foreign_key="archived_question.id")
+    published: datetime
+    updated: datetime | None = Field(default=None)
+    score: int = Field(default=0)
+
+    user: User = Relationship()
+
+
+class ArchivedAnswerVote(SQLModel, table=True):
+    __tablename__ = 'archived_answer_vote'
+    user_id: int | None = Field(
+        foreign_key='user.id', primary_key=True, default=None
+    )
+    answer_id: int | None = Field(
+        foreign_key='archived_answer.id', primary_key=True, default=None
+    )
+    value: int
+
+
+class BackfillCheckpoint(SQLModel, table=True):
+    # progress of a backfill, see app/backfill.py
+    __tablename__ = 'backfill_checkpoint'
+    name: str = Field(primary_key=True, max_length=255)
+    # the primary key of the last row processed
+    last_id: int = Field(default=0)
+    rows: int = Field(default=0)
+    started: datetime
+    updated: datetime
+    finished: datetime | None = Field(default=None)
+
+
+class IndexVersion(SQLModel, table=True):
+    # bumped by the changes every app process' in-memory index
+    # has to follow, see app/indexes.py
+    __tablename__ = 'index_version'
+    name: str = Field(primary_key=True, max_length=64)
+    version: int = Field(default=0)
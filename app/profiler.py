@@ -0,0 +1,194 @@
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from decouple import config
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# A request is profiled when it carries the X-Profile header with this token
+# (empty disables the header) or, at random, PROFILER_SAMPLE_RATE of them.
+PROFILER_TOKEN = config('PROFILER_TOKEN', default='')
+PROFILER_SAMPLE_RATE = config('PROFILER_SAMPLE_RATE', default=0.0, cast=float)
+# seconds between two samples of the threads' stacks
+PROFILER_INTERVAL = config('PROFILER_INTERVAL', default=0.005, cast=float)
+PROFILER_OUTPUT_DIR = config('PROFILER_OUTPUT_DIR', default='profiles')
+# profiles written at most per minute, the requests over it run unprofiled
+PROFILER_MAX_PER_MINUTE = config('PROFILER_MAX_PER_MINUTE', default=10, cast=int)
+
+WORKER_THREAD_NAME = 'AnyIO worker thread'
+# innermost frames of a thread waiting for work rather than doing it
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py')
+DB_FUNCTIONS = {'do_execute', 'do_executemany', 'do_execute_no_params',
+                'do_commit', 'do_rollback', 'connect'}
+
+logger = logging.getLogger(__name__)
+
+
+def get_bucket(frames: list) -> str:
+    # the innermost frame telling what the thread is busy with decides
+    for frame in reversed(frames):
+        filename = frame.f_code.co_filename
+        if frame.f_code.co_name in DB_FUNCTIONS and \
+                f'sqlalchemy{os.sep}engine' in filename:
+            return 'db'
+        if 'passlib' in filename or f'{os.sep}bcrypt{os.sep}' in filename:
+            return 'bcrypt'
+        if f'{os.sep}pydantic{os.sep}' in filename or \
+                filename.endswith((f'fastapi{os.sep}encoders.py', f'json{os.sep}encoder.py')) or \
+                frame.f_code.co_name == 'serialize_response':
+            return 'serialization'
+        if filename.endswith(f'app{os.sep}crud.py'):
+            return 'crud'
+    return 'other'
+
+
+class Sampler(threading.Thread):
+    # Samples, every `interval` seconds, the stack of the event loop thread
+    # when it runs the profiled request (the request's middleware call is
+    # on it) and the stacks of the busy threadpool workers. Workers aren't
+    # tied to a request, while the profiled one runs their samples are
+    # counted for it.
+
+    def __init__(self, loop_thread_id: int, scope: Scope, interval: float):
+        super().__init__(name='profiler sampler', daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.scope = scope
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.buckets: Counter[str] = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def sample(self):
+        workers = {thread.ident for thread in threading.enumerate()
+                   if thread.name.startswith(WORKER_THREAD_NAME)}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.loop_thread_id:
+                frames = self.get_frames(frame)
+                if not self.runs_request(frames):
+                    continue
+            elif thread_id in workers:
+                if frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                frames = self.get_frames(frame)
+            else:
+                continue
+            self.samples += 1
+            self.buckets[get_bucket(frames)] += 1
+            self.stacks[';'.join(f'{frame.f_code.co_name} '
+                                 f'({os.path.basename(frame.f_code.co_filename)})'
+                                 for frame in frames)] += 1
+
+    @staticmethod
+    def get_frames(frame) -> list:
+        # outermost first, as collapsed stacks are written
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        return frames
+
+    def runs_request(self, frames: list) -> bool:
+        code = ProfilerMiddleware.__call__.__code__
+        return any(frame.f_code is code and frame.f_locals.get('scope') is self.scope
+                   for frame in frames)
+
+
+class ProfilerMiddleware:
+    # Runs the requests asking for it under the sampler and writes, for each,
+    # a collapsed stacks file (flamegraph.pl, speedscope...) and a summary of
+    # the time spent in the database, bcrypt, serialization, crud and the rest.
+
+    def __init__(self,
+                 app: ASGIApp,
+                 token: str = PROFILER_TOKEN,
+                 sample_rate: float = PROFILER_SAMPLE_RATE,
+                 interval: float = PROFILER_INTERVAL,
+                 output_dir: str = PROFILER_OUTPUT_DIR,
+                 max_per_minute: int = PROFILER_MAX_PER_MINUTE) -> None:
+        self.app = app
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.output_dir = output_dir
+        self.max_per_minute = max_per_minute
+        self.captures: deque[float] = deque()
+
+    def wants_profile(self, scope: Scope) -> bool:
+        if self.token:
+            header = Headers(scope=scope).get('x-profile')
+            if header is not None and hmac.compare_digest(header, self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def take_capture(self) -> bool:
+        now = time.monotonic()
+        while self.captures and self.captures[0] <= now - 60:
+            self.captures.popleft()
+        if len(self.captures) >= self.max_per_minute:
+            return False
+        self.captures.append(now)
+        return True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not self.wants_profile(scope) or not self.take_capture():
+            await self.app(scope, receive, send)
+            return
+        status_code = None
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        sampler = Sampler(loop_thread_id=threading.get_ident(), scope=scope,
+                          interval=self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            sampler.stop()
+            duration = time.perf_counter() - start
+            await run_in_threadpool(self.write, scope, status_code, duration, sampler)
+
+    def write(self, scope: Scope, status_code: int | None, duration: float, sampler: Sampler):
+        route = scope.get('route')
+        name = '{}-{}-{}'.format(
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), scope['method'],
+            re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_') or 'root')
+        # every sample stands for one interval of the thread's time
+        summary = {'method': scope['method'], 'path': scope['path'],
+                   'route': route.path if route else None, 'status': status_code,
+                   'duration_ms': round(duration * 1000, 3), 'samples': sampler.samples,
+                   'interval_ms': self.interval * 1000,
+                   'buckets_ms': {bucket: round(count * self.interval * 1000, 3)
+                                  for bucket, count in sampler.buckets.most_common()},
+                   'stacks': f'{name}.folded'}
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, f'{name}.folded'), 'w') as file:
+            file.writelines(f'{stack} {count}\n' for stack, count in sampler.stacks.items())
+        with open(os.path.join(self.output_dir, f'{name}.json'), 'w') as file:
+            json.dump(summary, file)
+        logger.info(json.dumps(summary))
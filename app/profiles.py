@@ -0,0 +1,43 @@
+from typing import Iterable
+
+from decouple import config
+from sqlmodel import Session
+
+from .cache import LRUCache
+from .crud import get_user_stats
+from .schemas import UserProfileRead
+
+
+USER_PROFILE_CACHE_SIZE = config('USER_PROFILE_CACHE_SIZE', default=1024, cast=int)
+# Profiles are invalidated by their users' writes, the ttl bounds
+# how long a profile read while such a write commits can stay stale.
+USER_PROFILE_CACHE_TTL = config('USER_PROFILE_CACHE_TTL', default=300.0, cast=float)
+
+profiles_cache = LRUCache(maxsize=USER_PROFILE_CACHE_SIZE, ttl=USER_PROFILE_CACHE_TTL)
+
+
+def get_user_profile(session: Session, username: str) -> UserProfileRead | None:
+    profile = profiles_cache.get(username)
+    if profile is None:
+        row = get_user_stats(session=session, username=username)
+        if row is None:
+            return None
+        last_question = max(filter(None, (row.last_question_published,
+                                          row.last_archived_question_published)),
+                            default=None)
+        last_answer = max(filter(None, (row.last_answer_published,
+                                        row.last_archived_answer_published)),
+                          default=None)
+        profile = UserProfileRead(
+            id=row.id, username=row.username, email=row.email,
+            questions_count=row.questions_count, answers_count=row.answers_count,
+            last_question_published=last_question, last_answer_published=last_answer,
+            last_active=max(filter(None, (last_question, last_answer)), default=None))
+        profiles_cache.set(username, profile)
+    return profile
+
+
+def invalidate_profiles(usernames: Iterable[str]):
+    # called after the writes changing the users' counts are committed
+    for username in usernames:
+        profiles_cache.delete(username)
@@ -0,0 +1,90 @@
+import math
+from datetime import datetime
+
+from decouple import config
+from sqlmodel import Session, select
+from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
+
+from .database import begin_write
+from .models import Question, QuestionRank
+
+
+# Every event (question posted, answer posted, question viewed) adds its weight
+# to the question's activity, and that weight halves every HOT_HALF_LIFE_HOURS.
+# Instead of decaying all stored scores as time passes, the weight of a new event
+# is scaled up by 2 ** (hours since HOT_EPOCH / HOT_HALF_LIFE_HOURS):
+# the ordering of such scores is the same as the ordering of decayed ones,
+# so a stored score never has to be touched again until the question gets new activity.
+# Scores are kept in log2 to stay within float range.
+HOT_HALF_LIFE_HOURS = config('HOT_HALF_LIFE_HOURS', default=24, cast=float)
+HOT_EPOCH = datetime(2023, 1, 1)
+
+QUESTION_WEIGHT = config('HOT_QUESTION_WEIGHT', default=5, cast=float)
+ANSWER_WEIGHT = config('HOT_ANSWER_WEIGHT', default=10, cast=float)
+VIEW_WEIGHT = config('HOT_VIEW_WEIGHT', default=1, cast=float)
+
+
+def event_score(weight: float, at: datetime) -> float:
+    hours = (at - HOT_EPOCH).total_seconds() / 3600
+    return math.log2(weight) + hours / HOT_HALF_LIFE_HOURS
+
+
+def add_scores(first: float, second: float) -> float:
+    # log2(2 ** first + 2 ** second) without overflowing
+    high, low = max(first, second), min(first, second)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def add_to_rank(session: Session,
+                question_id: int,
+                score: float,
+                at: datetime) -> QuestionRank:
+    begin_write(session)
+    rank = session.get(QuestionRank, question_id, with_for_update=True, populate_existing=True)
+    if rank:
+        rank.hot = add_scores(rank.hot, score)
+        rank.updated = max(rank.updated, at)
+    else:
+        rank = QuestionRank(question_id=question_id, hot=score, updated=at)
+    session.add(rank)
+    return rank
+
+
+def record_activity(session: Session,
+                    question_id: int,
+                    weight: float,
+                    at: datetime | None = None) -> QuestionRank:
+    # the caller commits, so the rank changes in the same transaction as the activity
+    at = at or datetime.utcnow()
+    return add_to_rank(session=session, question_id=question_id,
+                       score=event_score(weight=weight, at=at), at=at)
+
+
+def record_activities(session: Session,
+                      activities: list[tuple[int, float, datetime]]):
+    # (question_id, weight, at) events, those of the same question are added up
+    # first, so that its rank is read and written once for all of them;
+    # ranks are locked in id order, concurrent workers can't deadlock
+    scores: dict[int, tuple[float, datetime]] = {}
+    for question_id, weight, at in activities:
+        score = event_score(weight=weight, at=at)
+        if question_id in scores:
+            previous, latest = scores[question_id]
+            score, at = add_scores(previous, score), max(latest, at)
+        scores[question_id] = (score, at)
+    for question_id, (score, at) in sorted(scores.items()):
+        add_to_rank(session=session, question_id=question_id, score=score, at=at)
+
+
+def get_hot_questions(session: Session, limit: int) -> list[Question]:
+    # reads the first `limit` entries of ix_question_rank_hot
+    return session.exec(
+        select(Question).
+        join(QuestionRank, QuestionRank.question_id == Question.id).
+        order_by(desc(QuestionRank.hot)).
+        limit(limit=limit).
+        options(
+            joinedload(Question.tags),
+            joinedload(Question.user)
+        )).unique().all()
@@ -0,0 +1,109 @@
+from collections import Counter
+
+from decouple import config
+from sqlmodel import Session, select, delete, or_
+from sqlalchemy import desc, func
+from sqlalchemy.orm import joinedload, selectinload
+
+from .models import Question, TaggedQuestions, RelatedQuestion
+
+
+# number of neighbours stored per question
+RELATED_LIMIT = config('RELATED_LIMIT', default=10, cast=int)
+# number of latest questions looked at per tag of the refreshed question,
+# this is what keeps a refresh cheap for tags used by lots of questions
+RELATED_CANDIDATES_PER_TAG = config(
+    'RELATED_CANDIDATES_PER_TAG', default=200, cast=int)
+
+
+def remove_related(session: Session, question_id: int):
+    session.exec(delete(RelatedQuestion).
+                 where(or_(RelatedQuestion.question_id == question_id,
+                           RelatedQuestion.related_id == question_id)))
+
+
+def find_related(session: Session,
+                 question_id: int,
+                 tags_ids: list[int]) -> list[tuple[int, int]]:
+    # at most len(tags_ids) index range scans of RELATED_CANDIDATES_PER_TAG rows
+    shared = Counter()
+    for tag_id in tags_ids:
+        candidates = session.exec(
+            select(TaggedQuestions.question_id).
+            where(TaggedQuestions.tag_id == tag_id,
+                  TaggedQuestions.question_id != question_id).
+            order_by(desc(TaggedQuestions.question_id)).
+            limit(RELATED_CANDIDATES_PER_TAG)).all()
+        shared.update(candidates)
+    best = sorted(shared.items(),
+                  key=lambda item: (item[1], item[0]), reverse=True)
+    return best[:RELATED_LIMIT]
+
+
+def trim_related(session: Session, question_id: int):
+    # keeps only RELATED_LIMIT best neighbours of the question
+    extra = session.exec(
+        select(RelatedQuestion.related_id).
+        where(RelatedQuestion.question_id == question_id).
+        order_by(desc(RelatedQuestion.shared_tags),
+                 desc(RelatedQuestion.related_id)).
+        offset(RELATED_LIMIT)).all()
+    if extra:
+        session.exec(delete(RelatedQuestion).
+                     where(RelatedQuestion.question_id == question_id,
+                           RelatedQuestion.related_id.in_(extra)))
+
+
+def refresh_related(session: Session, question_id: int, tags_ids: list[int]):
+    # Recomputes the neighbours of the question after its tags were set
+    # and offers the question to each of those neighbours' own lists.
+    # The question's tagged_questions rows have to be flushed already,
+    # the caller commits.
+    remove_related(session=session, question_id=question_id)
+    related = find_related(session=session, question_id=question_id,
+                           tags_ids=tags_ids)
+    for related_id, shared_tags in related:
+        session.add(RelatedQuestion(question_id=question_id,
+                                    related_id=related_id,
+                                    shared_tags=shared_tags))
+        session.add(RelatedQuestion(question_id=related_id,
+                                    related_id=question_id,
+                                    shared_tags=shared_tags))
+    session.flush()
+    for related_id, _ in related:
+        trim_related(session=session, question_id=related_id)
+
+
+def get_related_questions(session: Session,
+                          question_id: int,
+                          limit: int | None = None) -> list[Question]:
+    return session.exec(
+        select(Question).
+        join(RelatedQuestion, RelatedQuestion.related_id == Question.id).
+        where(RelatedQuestion.question_id == question_id).
+        order_by(desc(RelatedQuestion.shared_tags),
+                 desc(RelatedQuestion.related_id)).
+        limit(limit=limit).
+        options(
+            # a joined load of the tags would wrap the limited query into a subquery
+            # and join it to the whole tagged_questions table
+            selectinload(Question.tags),
+            joinedload(Question.user)
+        )).all()
+
+
+def get_related_questions_ids_by_join(session: Session,
+                                      question_id: int,
+                                      limit: int | None = None) -> list[tuple[int, int]]:
+    # the naive self join of tagged_questions, kept for benchmarks and checks
+    own_tags = TaggedQuestions.__table__.alias('own_tags')
+    other_tags = TaggedQuestions.__table__.alias('other_tags')
+    shared_tags = func.count().label('shared_tags')
+    return session.exec(
+        select(other_tags.c.question_id, shared_tags).
+        join(own_tags, own_tags.c.tag_id == other_tags.c.tag_id).
+        where(own_tags.c.question_id == question_id,
+              other_tags.c.question_id != question_id).
+        group_by(other_tags.c.question_id).
+        order_by(desc(shared_tags), desc(other_tags.c.question_id)).
+        limit(limit)).all()
@@ -1,25 +1,47 @@
-from typing import Annotated
+from typing import Annotated, Literal
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, Path, Body, HTTPException, status, Query
-from sqlmodel import Session, select
-from sqlalchemy.orm import joinedload
-from sqlalchemy import asc
+from fastapi import APIRouter, Depends, Path, Body, HTTPException, status, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from sqlmodel import Session, update
+from sqlalchemy.exc import IntegrityError
 
 
 from ..auth import get_current_user
-from ..database import get_session
-from ..schemas import AnswerRead, AnswerCreateUpdate
-from ..models import Answer, User, Question
-from ..crud import get_answer_by_id_and_question_id, get_all_answers
+from ..database import get_session, get_read_session, begin_write
+from ..schemas import AnswerRead, AnswerCreateUpdate, AnswerVoteCreate, AnswerBatchItem
+from ..models import Answer, AnswerVote, User, Question, ArchivedAnswer
+from ..crud import get_answer_by_id_and_question_id, get_all_answers, \
+    get_answers_by_score, get_answer_vote, get_answers_by_ids, ANSWER_FIELDS
+from ..ranking import ANSWER_WEIGHT
+from ..jobs import enqueue
+from ..profiles import invalidate_profiles
+from ..archive import is_archived
+from ..counts import CountMode, get_answers_count
+from .questions import BATCH_LIMIT, parse_fields, listing_statement_timeout
 
 router = APIRouter(
     tags=['answers']
 )
 
 
+def get_answers_model(session: Session, question_id: int) -> type[Answer] | type[ArchivedAnswer]:
+    # the answers of an archived question are read from the archive,
+    # only the reads fall back to it, archived questions are read-only
+    if session.get(Question, question_id):
+        return Answer
+    if is_archived(session=session, question_id=question_id):
+        return ArchivedAnswer
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f'Question with id {question_id} was not found.'
+    )
+
+
 @router.post('/questions/{question_id}/answers', response_model=AnswerRead)
-async def post_answer(
+def post_answer(
     user: Annotated[User, Depends(get_current_user)],
     question_id: Annotated[int, Path(ge=1)],
     data: Annotated[AnswerCreateUpdate, Body()],
@@ -34,29 +56,113 @@ async def post_answer(
     answer = Answer(
         content=data.content,
         question=question,
-        user=user
+        user_id=user.id
     )
     session.add(answer)
+    enqueue(session=session, kind='question_activity',
+            payloads=[{'question_id': question_id, 'weight': ANSWER_WEIGHT,
+                       'at': datetime.utcnow().isoformat()}])
     session.commit()
+    invalidate_profiles([user.username])
     session.refresh(answer)
     return answer
 
 
-@router.get('/questions/{question_id}/answers', response_model=list[AnswerRead])
-def get_answers(*,
-                question_id: Annotated[int, Path(ge=1)],
-                offset: Annotated[int | None, Query(gt=0)] = None,
-                limit: Annotated[int | None, Query(gt=0)] = None,
-                by_date_asc: Annotated[bool | None, Query()] = None,
-                session: Annotated[Session, Depends(get_session)]):
+@router.post('/questions/{question_id}/answers/batch', response_model=list[AnswerBatchItem])
+def post_answers_batch(
+    user: Annotated[User, Depends(get_current_user)],
+    question_id: Annotated[int, Path(ge=1)],
+    data: Annotated[list[dict], Body()],
+    session: Annotated[Session, Depends(get_session)]
+):
+    # same as POST /questions/batch
     question = session.get(Question, question_id)
     if not question:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Question with id {question_id} was not found.'
         )
-    answers = get_all_answers(question_id=question_id,
-                              session=session, offset=offset, limit=limit, by_date_asc=by_date_asc)
+    if not data or len(data) > BATCH_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Between 1 and {BATCH_LIMIT} answers can be posted at once.'
+        )
+    results = []
+    valid = []
+    for index, item in enumerate(data):
+        try:
+            valid.append((index, AnswerCreateUpdate.parse_obj(item)))
+        except ValidationError as error:
+            results.append(AnswerBatchItem(index=index, errors=error.errors()))
+    answers = [Answer(content=item.content,
+                      question=question,
+                      user_id=user.id) for _, item in valid]
+    if answers:
+        session.add_all(answers)
+        enqueue(session=session, kind='question_activity',
+                payloads=[{'question_id': question_id, 'weight': ANSWER_WEIGHT * len(answers),
+                           'at': datetime.utcnow().isoformat()}])
+        session.flush()
+        answers_ids = [answer.id for answer in answers]
+        session.commit()
+        invalidate_profiles([user.username])
+        answers = {answer.id: answer
+                   for answer in get_answers_by_ids(session=session, ids=answers_ids)}
+        for (index, _), id in zip(valid, answers_ids):
+            results.append(AnswerBatchItem(index=index,
+                                           answer=AnswerRead.from_orm(answers[id])))
+    results.sort(key=lambda result: result.index)
+    return results
+
+
+@router.get('/questions/{question_id}/answers', response_model=list[AnswerRead],
+            dependencies=[Depends(listing_statement_timeout)])
+def get_answers(*,
+                question_id: Annotated[int, Path(ge=1)],
+                offset: Annotated[int | None, Query(gt=0)] = None,
+                limit: Annotated[int | None, Query(gt=0)] = None,
+                by_date_asc: Annotated[bool | None, Query()] = None,
+                sort: Annotated[Literal['score'] | None, Query()] = None,
+                after_score: Annotated[int | None, Query()] = None,
+                after_id: Annotated[int | None, Query(gt=0)] = None,
+                fields: Annotated[str | None, Query(pattern=r'^\w+(,\w+)*$')] = None,
+                count: Annotated[CountMode | None, Query()] = None,
+                response: Response,
+                session: Annotated[Session, Depends(get_read_session)]):
+    model = get_answers_model(session=session, question_id=question_id)
+    fields_list = parse_fields(fields, ANSWER_FIELDS) if fields else None
+    if sort == 'score':
+        if by_date_asc is not None or offset is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=('by_date_asc and offset cannot be used with sort=score, '
+                        'use after_score and after_id to page instead.')
+            )
+        if (after_score is None) != (after_id is None):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='after_score and after_id must be provided together.'
+            )
+        answers = get_answers_by_score(session=session, question_id=question_id,
+                                       limit=limit, after_score=after_score, after_id=after_id,
+                                       fields=fields_list, model=model)
+    else:
+        if after_score is not None or after_id is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='after_score and after_id can only be used with sort=score.'
+            )
+        answers = get_all_answers(question_id=question_id,
+                                  session=session, offset=offset, limit=limit, by_date_asc=by_date_asc,
+                                  fields=fields_list, model=model)
+    headers = {}
+    if count:
+        headers['X-Total-Count'] = str(get_answers_count(
+            session=session, mode=count, question_id=question_id, model=model))
+    if fields_list:
+        # only the requested fields are selected, so AnswerRead can't validate them
+        return JSONResponse(content=jsonable_encoder(answers), headers=headers)
+    response.headers.update(headers)
     return answers
 
 
@@ -64,15 +170,10 @@ def get_answers(*,
 async def get_answer(*,
                      question_id: Annotated[int, Path(ge=1)],
                      id: Annotated[int, Path(ge=1)],
-                     session: Annotated[Session, Depends(get_session)]):
-    question = session.get(Question, question_id)
-    if not question:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'Question with id {question_id} was not found.'
-        )
+                     session: Annotated[Session, Depends(get_read_session)]):
+    model = get_answers_model(session=session, question_id=question_id)
     answer = get_answer_by_id_and_question_id(
-        session=session, question_id=question_id, id=id
+        session=session, question_id=question_id, id=id, model=model
     )
     if not answer:
         raise HTTPException(
@@ -83,12 +184,12 @@ async def get_answer(*,
 
 
 @router.put('/questions/{question_id}/answers/{id}', response_model=AnswerRead)
-async def update_answer(*,
-                        user: Annotated[User, Depends(get_current_user)],
-                        session: Annotated[Session, Depends(get_session)],
-                        question_id: Annotated[int, Path(ge=1)],
-                        id: Annotated[int, Path(ge=1)],
-                        data: Annotated[AnswerCreateUpdate, Body()]):
+def update_answer(*,
+                  user: Annotated[User, Depends(get_current_user)],
+                  session: Annotated[Session, Depends(get_session)],
+                  question_id: Annotated[int, Path(ge=1)],
+                  id: Annotated[int, Path(ge=1)],
+                  data: Annotated[AnswerCreateUpdate, Body()]):
     question = session.get(Question, question_id)
     if not question:
         raise HTTPException(
@@ -118,12 +219,12 @@ async def update_answer(*,
 
 
 @router.delete('/questions/{question_id}/answers/{id}', status_code=status.HTTP_204_NO_CONTENT)
-async def delete_answer(*,
-                        user: Annotated[User, Depends(get_current_user)],
-                        session: Annotated[Session, Depends(get_session)],
-                        question_id: Annotated[int, Path(ge=1)],
-                        id: Annotated[int, Path(ge=1)],
-                        ):
+def delete_answer(*,
+                  user: Annotated[User, Depends(get_current_user)],
+                  session: Annotated[Session, Depends(get_session)],
+                  question_id: Annotated[int, Path(ge=1)],
+                  id: Annotated[int, Path(ge=1)],
+                  ):
     question = session.get(Question, question_id)
     if not question:
         raise HTTPException(
@@ -149,4 +250,99 @@ async def delete_answer(*,
         )
     session.delete(answer)
     session.commit()
+    invalidate_profiles([user.username])
+    return None
+
+
+def get_answer_to_vote(*,
+                       user: User,
+                       session: Session,
+                       question_id: int,
+                       id: int) -> Answer:
+    question = session.get(Question, question_id)
+    if not question:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Question with id {question_id} was not found.'
+        )
+    answer = get_answer_by_id_and_question_id(
+        session=session, question_id=question_id, id=id
+    )
+    if not answer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Answer with id {id} was not found for question with id {question_id}.'
+        )
+    if answer.user == user:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f'Current user cannot vote for their own answer with id {id}.'
+        )
+    return answer
+
+
+def change_answer_score(session: Session, answer_id: int, delta: int):
+    # score is changed in the database rather than in python,
+    # so concurrent votes on the same answer are not lost
+    if delta:
+        session.exec(update(Answer).
+                     where(Answer.id == answer_id).
+                     values(score=Answer.score + delta))
+
+
+def record_answer_vote(session: Session, user_id: int, answer_id: int, value: int) -> int:
+    # Returns the change of the answer's score. Of two first votes by the
+    # same user at once, the one losing the race on the primary key
+    # changes the other's vote instead, under a savepoint.
+    begin_write(session)
+    vote = get_answer_vote(session=session, user_id=user_id, answer_id=answer_id, lock=True)
+    if vote is None:
+        try:
+            with session.begin_nested():
+                session.add(AnswerVote(user_id=user_id, answer_id=answer_id, value=value))
+            return value
+        except IntegrityError:
+            vote = get_answer_vote(session=session, user_id=user_id, answer_id=answer_id,
+                                   lock=True)
+    delta = value - vote.value
+    vote.value = value
+    session.add(vote)
+    return delta
+
+
+@router.put('/questions/{question_id}/answers/{id}/vote', response_model=AnswerRead)
+def vote_answer(*,
+                user: Annotated[User, Depends(get_current_user)],
+                session: Annotated[Session, Depends(get_session)],
+                question_id: Annotated[int, Path(ge=1)],
+                id: Annotated[int, Path(ge=1)],
+                data: Annotated[AnswerVoteCreate, Body()]):
+    answer = get_answer_to_vote(user=user, session=session,
+                                question_id=question_id, id=id)
+    delta = record_answer_vote(session=session, user_id=user.id, answer_id=id,
+                               value=data.value)
+    change_answer_score(session=session, answer_id=id, delta=delta)
+    session.commit()
+    session.refresh(answer)
+    return answer
+
+
+@router.delete('/questions/{question_id}/answers/{id}/vote', status_code=status.HTTP_204_NO_CONTENT)
+def delete_answer_vote(*,
+                       user: Annotated[User, Depends(get_current_user)],
+                       session: Annotated[Session, Depends(get_session)],
+                       question_id: Annotated[int, Path(ge=1)],
+                       id: Annotated[int, Path(ge=1)]):
+    get_answer_to_vote(user=user, session=session,
+                       question_id=question_id, id=id)
+    begin_write(session)
+    vote = get_answer_vote(session=session, user_id=user.id, answer_id=id, lock=True)
+    if not vote:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Current user has not voted for the answer with id {id}.'
+        )
+    change_answer_score(session=session, answer_id=id, delta=-vote.value)
+    session.delete(vote)
+    session.commit()
     return None
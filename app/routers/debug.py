@@ -0,0 +1,64 @@
+import hmac
+from typing import Annotated
+
+from decouple import config
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from sqlmodel import Session
+
+from ..admission import limiters
+from ..database import engine, statement_cache_stats, slow_query_log, \
+    get_read_session
+from ..jobs import get_queue_stats
+from ..singleflight import question_reads
+
+
+# The routes below expose the app's internals, they only answer requests
+# carrying the X-Debug-Token header with this token (empty disables them).
+DEBUG_TOKEN = config('DEBUG_TOKEN', default='')
+
+
+async def check_debug_token(x_debug_token: Annotated[str | None, Header()] = None):
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Not Found')
+    if x_debug_token is None or not hmac.compare_digest(x_debug_token, DEBUG_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='A valid X-Debug-Token header is required.'
+        )
+
+
+router = APIRouter(
+    tags=['debug'],
+    prefix='/debug',
+    dependencies=[Depends(check_debug_token)]
+)
+
+
+@router.get('/admission')
+async def get_admission_stats() -> dict[str, dict]:
+    # requests admitted, queued and shed for every request class
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+@router.get('/singleflight')
+async def get_singleflight_stats() -> dict[str, dict]:
+    # question reads executed and shared with concurrent identical reads
+    return {'question_reads': question_reads.stats()}
+
+
+@router.get('/statement-cache')
+async def get_statement_cache_stats() -> dict[str, int]:
+    # compiled statements reused from the engine's cache and compiled anew
+    return statement_cache_stats.stats(engine)
+
+
+@router.get('/slow-queries')
+async def get_slow_queries() -> list[dict]:
+    # the slowest statements recently executed, the newest first
+    return list(reversed(slow_query_log.entries))
+
+
+@router.get('/jobs')
+def get_jobs_stats(session: Annotated[Session, Depends(get_read_session)]) -> dict:
+    # jobs waiting to be run and failed for good, by kind
+    return get_queue_stats(session=session)
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Request, status
+from fastapi.responses import JSONResponse
+
+
+router = APIRouter(
+    tags=['health'],
+    prefix='/health'
+)
+
+
+@router.get('/live')
+async def live(request: Request):
+    # red once the warmup gave up, a restart may get the process going
+    state = getattr(request.app.state, 'warmup', None)
+    if state and state.failed:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={'live': False, 'error': state.error})
+    return {'live': True}
+
+
+@router.get('/ready')
+async def ready(request: Request):
+    # green only once the warmup started by the lifespan has finished
+    state = getattr(request.app.state, 'warmup', None)
+    content = {
+        'ready': bool(state and state.ready),
+        'error': state.error if state else None,
+        'timings': state.timings if state else {}
+    }
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if content['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=content
+    )
@@ -1,15 +1,41 @@
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, Body, HTTPException, status, Path, Query
+from decouple import config
+from fastapi import APIRouter, Depends, Body, HTTPException, status, Path, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from sqlalchemy.engine import Engine
 from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
 
 
 from ..auth import get_current_user
-from ..database import get_session
-from ..crud import get_tag_by_name, get_question_by_id, get_all_questions
-from ..schemas import QuestionCreate, QuestionRead, QuestionUpdate
-from ..models import Question, Tag, User
+from ..database import get_session, get_read_session, statement_timeout
+from ..crud import get_tags_by_names, get_all_questions, get_questions_ids, \
+    get_questions_titles, get_all_answers, get_answers_authors, QUESTION_FIELDS
+from ..schemas import QuestionCreate, QuestionRead, QuestionUpdate, DuplicateQuestion, \
+    QuestionBatchItem, QuestionWithAnswersRead, AnswerRead
+from ..models import Question, Tag, User, Answer, ArchivedAnswer
+from ..ranking import get_hot_questions, QUESTION_WEIGHT, VIEW_WEIGHT
+from ..tag_index import tag_index, normalize_tag_name
+from ..related import remove_related, get_related_questions
+from ..duplicates import duplicates_index
+from ..singleflight import question_reads
+from ..profiles import invalidate_profiles
+from ..jobs import enqueue
+from ..documents import save_documents, delete_documents, get_documents
+from ..archive import get_archived_document
+from ..counts import CountMode, get_questions_count
+
+
+# maximum number of items in a single batch request
+BATCH_LIMIT = config('BATCH_LIMIT', default=100, cast=int)
+# seconds the statements of a listing may take, a search can't scan for longer
+LISTING_STATEMENT_TIMEOUT = config('LISTING_STATEMENT_TIMEOUT', default=2.0, cast=float)
+
+listing_statement_timeout = statement_timeout(LISTING_STATEMENT_TIMEOUT)
 
 
 router = APIRouter(
@@ -17,68 +43,285 @@ router = APIRouter(
 )
 
 
+def get_tags_objects_lists(tags_lists: list[list[str]], session: Session) -> list[list[Tag]]:
+    # resolves the tags of many questions with a single query,
+    # a tag missing from the database is created once and shared by all of them
+    names_lists = [list(dict.fromkeys(normalize_tag_name(tag) for tag in tags))
+                   for tags in tags_lists]
+    all_names = list(dict.fromkeys(name for names in names_lists for name in names))
+    tags_objects = {tag.name: tag for tag in get_tags_by_names(session=session,
+                                                               names=all_names)}
+    for name in all_names:
+        if name not in tags_objects:
+            tags_objects[name] = Tag(name=name)
+    return [[tags_objects[name] for name in names] for names in names_lists]
+
+
 def get_tags_objects(tags: list[str], session: Session) -> list[Tag]:
-    tags_objects_list = []
-    for tag in tags:
-        tag: str = tag.strip().replace(' ', '-').lower()
-        tag_object = get_tag_by_name(session=session, name=tag)
-        if tag_object:
-            tags_objects_list.append(tag_object)
-        else:
-            new_tag_object = Tag(name=tag)
-            tags_objects_list.append(new_tag_object)
+    return get_tags_objects_lists(tags_lists=[tags], session=session)[0]
+
+
+def index_new_questions(session: Session, questions: list[Question]):
+    # enqueued in the transaction creating the questions, after they are flushed
+    at = datetime.utcnow().isoformat()
+    enqueue(session=session, kind='question_activity',
+            payloads=[{'question_id': question.id, 'weight': QUESTION_WEIGHT, 'at': at}
+                      for question in questions])
+    enqueue(session=session, kind='refresh_related',
+            payloads=[{'question_id': question.id} for question in questions])
+    save_documents(session=session, questions=questions, new=True)
+
+
+def index_new_questions_after_commit(questions: list[Question]):
+    for question in questions:
+        tag_index.update_usage(added=[tag.name for tag in question.tags])
+        duplicates_index.add(question_id=question.id,
+                             title=question.title, content=question.content)
+
+
+def parse_ids(ids: str) -> list[int]:
+    ids_list = list(dict.fromkeys(int(id) for id in ids.split(',')))
+    if len(ids_list) > BATCH_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'At most {BATCH_LIMIT} ids can be requested at once.'
+        )
+    return ids_list
 
-    return tags_objects_list
 
+def parse_fields(fields: str, allowed: tuple[str, ...]) -> list[str]:
+    fields_list = list(dict.fromkeys(fields.split(',')))
+    unknown = [field for field in fields_list if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Unknown fields: {", ".join(unknown)}. '
+                   f'Available fields are: {", ".join(allowed)}.'
+        )
+    return fields_list
 
-@router.get('/questions', response_model=list[QuestionRead])
+
+def get_id(item: Question | dict) -> int:
+    return item['id'] if isinstance(item, dict) else item.id
+
+
+@router.get('/questions', response_model=list[QuestionRead],
+            dependencies=[Depends(listing_statement_timeout)])
 async def get_questions(*,
-                        session: Annotated[Session, Depends(get_session)],
+                        session: Annotated[Session, Depends(get_read_session)],
                         offset: Annotated[int | None, Query(gt=0)] = None,
                         limit: Annotated[int | None, Query(gt=0)] = None,
-                        search_string: Annotated[str | None, Query()] = None):
-    questions = get_all_questions(
-        session=session, offset=offset, limit=limit, search_string=search_string)
-    return questions
+                        search_string: Annotated[str | None, Query()] = None,
+                        ids: Annotated[str | None, Query(pattern=r'^\d+(,\d+)*$')] = None,
+                        fields: Annotated[str | None, Query(pattern=r'^\w+(,\w+)*$')] = None,
+                        count: Annotated[CountMode | None, Query()] = None):
+    ids_list = parse_ids(ids) if ids else None
+    fields_list = parse_fields(fields, QUESTION_FIELDS) if fields else None
+    if fields_list:
+        if ids_list and 'id' not in fields_list:
+            # needed to tell which of the requested questions are missing
+            fields_list.insert(0, 'id')
+        questions = get_all_questions(
+            session=session, offset=offset, limit=limit, search_string=search_string,
+            ids=ids_list, fields=fields_list)
+        # only the requested fields are selected, so QuestionRead can't validate them
+        response = JSONResponse(content=jsonable_encoder(questions))
+        found = {get_id(question) for question in questions} if ids_list else set()
+    else:
+        # the page's ids, then their stored documents sent as they are
+        questions_ids = get_questions_ids(
+            session=session, offset=offset, limit=limit, search_string=search_string,
+            ids=ids_list)
+        documents = get_documents(session=session, questions_ids=questions_ids)
+        response = Response(
+            content='[' + ','.join(documents[id] for id in questions_ids if id in documents) + ']',
+            media_type='application/json')
+        found = set(documents)
+    if ids_list:
+        missing = [str(id) for id in ids_list if id not in found]
+        if missing:
+            response.headers['X-Missing-Ids'] = ','.join(missing)
+    if count:
+        response.headers['X-Total-Count'] = str(get_questions_count(
+            session=session, mode=count, search_string=search_string, ids=ids_list))
+    return response
+
+
+@router.post('/questions/batch', response_model=list[QuestionBatchItem])
+def post_questions_batch(user: Annotated[User, Depends(get_current_user)],
+                         data: Annotated[list[dict], Body()],
+                         session: Annotated[Session, Depends(get_session)]):
+    # Items are validated one by one, invalid ones are reported with their index
+    # and the valid ones are created together in a single transaction.
+    if not data or len(data) > BATCH_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Between 1 and {BATCH_LIMIT} questions can be posted at once.'
+        )
+    results = []
+    valid = []
+    for index, item in enumerate(data):
+        try:
+            valid.append((index, QuestionCreate.parse_obj(item)))
+        except ValidationError as error:
+            results.append(QuestionBatchItem(index=index, errors=error.errors()))
+    tags_lists = get_tags_objects_lists(tags_lists=[item.tags for _, item in valid],
+                                        session=session)
+    questions = [Question(title=item.title,
+                          content=item.content,
+                          tags=tags,
+                          user_id=user.id) for (_, item), tags in zip(valid, tags_lists)]
+    if questions:
+        session.add_all(questions)
+        session.flush()
+        index_new_questions(session=session, questions=questions)
+        questions_ids = [question.id for question in questions]
+        session.commit()
+        invalidate_profiles([user.username])
+        # reloads all of them with their tags and users in one query
+        questions = {question.id: question
+                     for question in get_all_questions(session=session, ids=questions_ids)}
+        index_new_questions_after_commit(questions=list(questions.values()))
+        for (index, _), id in zip(valid, questions_ids):
+            results.append(QuestionBatchItem(index=index,
+                                             question=QuestionRead.from_orm(questions[id])))
+    results.sort(key=lambda result: result.index)
+    return results
 
 
 @router.post('/questions',
              response_model=QuestionRead,
              status_code=status.HTTP_201_CREATED)
-async def post_question(user: Annotated[User, Depends(get_current_user)],
-                        data: Annotated[QuestionCreate, Body()],
-                        session: Annotated[Session, Depends(get_session)]):
+def post_question(user: Annotated[User, Depends(get_current_user)],
+                  data: Annotated[QuestionCreate, Body()],
+                  session: Annotated[Session, Depends(get_session)],
+                  check_duplicates: Annotated[bool, Query()] = False):
+    if check_duplicates:
+        candidates = dict(duplicates_index.find(title=data.title,
+                                                content=data.content))
+        # the index may still hold questions deleted before the last restart
+        titles = get_questions_titles(session=session, ids=list(candidates))
+        if titles:
+            duplicates = [DuplicateQuestion(id=id, title=titles[id], similarity=candidates[id])
+                          for id in candidates if id in titles]
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={'message': 'Similar questions already exist, '
+                                   'post again without check_duplicates to create it anyway.',
+                        'duplicates': [duplicate.dict() for duplicate in duplicates]}
+            )
     # if tags are not set, [] will be used as it is defined as default value
     tags = get_tags_objects(tags=data.tags, session=session)
     question = Question(
         title=data.title,
         content=data.content,
         tags=tags,
-        user=user
+        user_id=user.id
     )
     session.add(question)
+    session.flush()
+    index_new_questions(session=session, questions=[question])
     session.commit()
+    invalidate_profiles([user.username])
     session.refresh(question)
+    index_new_questions_after_commit(questions=[question])
     return question
 
 
-@router.get('/questions/{id}', response_model=QuestionRead)
+# declared before /questions/{id}, so that 'hot' is not taken for an id
+@router.get('/questions/hot', response_model=list[QuestionRead])
+async def get_hot(*,
+                  session: Annotated[Session, Depends(get_read_session)],
+                  limit: Annotated[int, Query(gt=0, le=100)] = 10):
+    return get_hot_questions(session=session, limit=limit)
+
+
+def load_question_document(bind: Engine,
+                           id: int,
+                           include: str | None,
+                           answers_limit: int) -> bytes | None:
+    # runs in the threadpool, shared by all concurrent identical reads,
+    # with a session of its own: the request that started it may be gone
+    with Session(bind) as session:
+        return read_question_document(session=session, id=id, include=include,
+                                      answers_limit=answers_limit)
+
+
+def read_question_document(session: Session,
+                           id: int,
+                           include: str | None,
+                           answers_limit: int) -> bytes | None:
+    document = get_documents(session=session, questions_ids=[id]).get(id)
+    answers_model = Answer
+    if document is None:
+        # an archived question is read as it was archived
+        document = get_archived_document(session=session, question_id=id)
+        if document is None:
+            return None
+        answers_model = ArchivedAnswer
+    if include == 'answers':
+        # a single query for the first answers and their users,
+        # Question.answers is never loaded; the answers are added as
+        # the last key of the document, as QuestionWithAnswersRead has them
+        answers = get_all_answers(session=session, question_id=id,
+                                  limit=answers_limit, model=answers_model)
+        answers_json = JSONResponse(
+            content=jsonable_encoder([AnswerRead.from_orm(answer) for answer in answers])).body
+        return document.encode()[:-1] + b',"answers":' + answers_json + b'}'
+    return document.encode()
+
+
+def record_views(session: Session, id: int, views: int):
+    # in the threadpool, waiting for the writer's lock
+    # must not block the event loop
+    enqueue(session=session, kind='question_activity',
+            payloads=[{'question_id': id, 'weight': VIEW_WEIGHT * views,
+                       'at': datetime.utcnow().isoformat()}])
+    session.commit()
+
+
+# the response model only documents the route, the JSON document is rendered
+# by load_question_document and sent as is
+@router.get('/questions/{id}', response_model=QuestionWithAnswersRead | QuestionRead)
 async def get_question(id: Annotated[int, Path()],
-                       session: Annotated[Session, Depends(get_session)]):
-    question = get_question_by_id(session=session, id=id)
+                       session: Annotated[Session, Depends(get_read_session)],
+                       write_session: Annotated[Session, Depends(get_session)],
+                       include: Annotated[Literal['answers'] | None, Query()] = None,
+                       answers_limit: Annotated[int, Query(gt=0, le=100)] = 10):
+    document, shared_by = await question_reads.do(
+        ('get_question', id, include, answers_limit),
+        load_question_document, session.get_bind(), id, include, answers_limit)
+    if document is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Question with id {id} was not found.'
+        )
+    if shared_by:
+        # the request that loaded the question counts the views of all
+        # the requests it answered, the others don't write anything
+        await run_in_threadpool(record_views, write_session, id, shared_by)
+    return Response(content=document, media_type='application/json')
+
+
+@router.get('/questions/{id}/related', response_model=list[QuestionRead])
+async def get_related(*,
+                      id: Annotated[int, Path()],
+                      session: Annotated[Session, Depends(get_read_session)],
+                      limit: Annotated[int | None, Query(gt=0)] = None):
+    question = session.get(Question, id)
     if not question:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Question with id {id} was not found.'
         )
-    return question
+    return get_related_questions(session=session, question_id=id, limit=limit)
 
 
 @router.patch('/questions/{id}', response_model=QuestionRead)
-async def update_question(id: Annotated[int, Path()],
-                          session: Annotated[Session, Depends(get_session)],
-                          data: Annotated[QuestionUpdate, Body()],
-                          user: Annotated[User, Depends(get_current_user)]):
+def update_question(id: Annotated[int, Path()],
+                    session: Annotated[Session, Depends(get_session)],
+                    data: Annotated[QuestionUpdate, Body()],
+                    user: Annotated[User, Depends(get_current_user)]):
     question = session.get(Question, id)
     if not question:
         raise HTTPException(
@@ -105,20 +348,32 @@ async def update_question(id: Annotated[int, Path()],
     if 'content' in data:
         question.content = data['content']
     if 'tags' in data:
+        old_tags_names = [tag.name for tag in question.tags]
         tags_objects_list = get_tags_objects(
             session=session, tags=data['tags'])
         question.tags = tags_objects_list
     question.updated = datetime.utcnow()
     session.add(question)
+    if 'tags' in data:
+        enqueue(session=session, kind='refresh_related',
+                payloads=[{'question_id': question.id}])
+    session.flush()
+    save_documents(session=session, questions=[question])
     session.commit()
     session.refresh(question)
+    if 'tags' in data:
+        tag_index.update_usage(added=[tag.name for tag in question.tags],
+                               removed=old_tags_names)
+    if new_title or 'content' in data:
+        duplicates_index.add(question_id=question.id,
+                             title=question.title, content=question.content)
     return question
 
 
 @router.delete('/questions/{id}', status_code=status.HTTP_204_NO_CONTENT)
-async def delete_question(id: Annotated[int, Path()],
-                          session: Annotated[Session, Depends(get_session)],
-                          user: Annotated[User, Depends(get_current_user)]):
+def delete_question(id: Annotated[int, Path()],
+                    session: Annotated[Session, Depends(get_session)],
+                    user: Annotated[User, Depends(get_current_user)]):
     question = session.get(Question, id)
     if not question:
         raise HTTPException(
@@ -130,6 +385,14 @@ async def delete_question(id: Annotated[int, Path()],
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f'Current user has no permission to delete question with id {id}.'
         )
+    tags_names = [tag.name for tag in question.tags]
+    # the question's answers are deleted with it
+    usernames = [user.username] + get_answers_authors(session=session, question_id=id)
+    remove_related(session=session, question_id=id)
+    delete_documents(session=session, questions_ids=[id])
     session.delete(question)
     session.commit()
+    invalidate_profiles(usernames)
+    tag_index.update_usage(removed=tags_names)
+    duplicates_index.remove(question_id=id)
     return None
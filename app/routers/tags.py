@@ -0,0 +1,20 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Query
+
+from ..schemas import TagSuggestion
+from ..tag_index import tag_index
+
+
+router = APIRouter(
+    tags=['tags'],
+    prefix='/tags'
+)
+
+
+@router.get('/suggest', response_model=list[TagSuggestion])
+async def suggest_tags(prefix: Annotated[str, Query(min_length=1, max_length=255)],
+                       limit: Annotated[int, Query(gt=0, le=50)] = 10):
+    # served from the in-memory index loaded at startup, the database is not queried
+    return [TagSuggestion(name=name, usage=usage)
+            for name, usage in tag_index.suggest(prefix=prefix, limit=limit)]
@@ -1,17 +1,19 @@
 from datetime import timedelta
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, Body, HTTPException, status
+from fastapi import APIRouter, Depends, Body, HTTPException, status, Path
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
+from sqlmodel import Session
 
 
 from ..auth import create_access_token, get_current_user, authenticate_user, Token,\
     ACCESS_TOKEN_EXPIRES_HOURS, generate_password_hash
-from ..database import get_session
-from ..schemas import UserCreate, UserRead, UserUpdate
+from ..database import get_session, get_read_session
+from ..schemas import UserCreate, UserRead, UserUpdate, UserProfileRead
 from ..models import User
 from ..crud import get_user_with_username, get_user_with_email
+from ..profiles import get_user_profile, invalidate_profiles
+from ..jobs import enqueue
 
 
 router = APIRouter(
@@ -22,8 +24,8 @@ router = APIRouter(
 
 @router.post('/', response_model=UserRead,
              status_code=status.HTTP_201_CREATED)
-async def register(session: Annotated[Session, Depends(get_session)],
-                   data: Annotated[UserCreate, Body()]):
+def register(session: Annotated[Session, Depends(get_session)],
+             data: Annotated[UserCreate, Body()]):
     if get_user_with_username(session=session, username=data.username):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -45,22 +47,23 @@ async def register(session: Annotated[Session, Depends(get_session)],
 
 
 @router.post('/login', response_model=Token)
-async def login(
+def login(
     data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    session: Annotated[Session, Depends(get_session)]
+    session: Annotated[Session, Depends(get_read_session)]
 ):
-    user = authenticate_user(session=session,
-                             username=data.username,
-                             password=data.password)
-    if not user:
+    authenticated = authenticate_user(session=session,
+                                      username=data.username,
+                                      password=data.password)
+    if not authenticated:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"}
         )
+    _, username = authenticated
     access_token_expires = timedelta(hours=ACCESS_TOKEN_EXPIRES_HOURS)
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={"sub": username},
         expires_delta=access_token_expires
     )
     return {
@@ -75,7 +78,7 @@ async def get_users_me(user: Annotated[User, Depends(get_current_user)]):
 
 
 @router.patch('/me', response_model=UserRead)
-async def update_user(
+def update_user(
     current_user: Annotated[User, Depends(get_current_user)],
     session: Annotated[Session, Depends(get_session)],
     data: Annotated[UserUpdate, Body()]
@@ -86,7 +89,10 @@ async def update_user(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No data provided"
         )
+    # read by get_current_user's session, which only reads
+    current_user = session.merge(current_user)
 
+    old_username = current_user.username
     new_username = data.get("username")
     if new_username:
         user_with_username = get_user_with_username(session=session,
@@ -109,6 +115,23 @@ async def update_user(
         current_user.email = new_email
 
     session.add(current_user)
+    # the user's questions' documents hold the username and email,
+    # a user with many questions would hold the request and the write lock
+    enqueue(session=session, kind='user_documents', payloads=[{'user_id': current_user.id}])
     session.commit()
     session.refresh(current_user)
+    invalidate_profiles([old_username])
     return current_user
+
+
+# declared after /me, so that 'me' isn't taken for a username
+@router.get('/{username}', response_model=UserProfileRead)
+async def get_user(username: Annotated[str, Path()],
+                   session: Annotated[Session, Depends(get_read_session)]):
+    profile = get_user_profile(session=session, username=username)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'User with username {username} was not found.'
+        )
+    return profile
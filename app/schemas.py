@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Literal
 from sqlmodel import SQLModel, Field
 from pydantic import EmailStr, BaseModel
 
@@ -22,6 +23,14 @@ class UserRead(UserBase):
     id: int
 
 
+class UserProfileRead(UserRead):
+    questions_count: int
+    answers_count: int
+    last_question_published: datetime | None
+    last_answer_published: datetime | None
+    last_active: datetime | None
+
+
 class UserUpdate(SQLModel):
     username: str | None = Field(max_length=255, min_length=5,
                                  default=None)
@@ -36,6 +45,12 @@ class TagRead(TagBase):
     id: int
 
 
+class TagSuggestion(SQLModel):
+    name: str
+    # number of questions tagged with it
+    usage: int
+
+
 class QuestionBase(SQLModel):
     title: str = Field(max_length=255, min_length=5)
     content: str | None = Field(default=None, min_length=10)
@@ -54,6 +69,21 @@ class QuestionRead(QuestionBase):
     tags: list[TagRead]
 
 
+class DuplicateQuestion(SQLModel):
+    id: int
+    title: str
+    # estimated share of word triples the two questions have in common
+    similarity: float
+
+
+class QuestionBatchItem(SQLModel):
+    # position of the item in the request body,
+    # either the created question or the validation errors are set
+    index: int
+    question: QuestionRead | None = None
+    errors: list[dict] | None = None
+
+
 class QuestionUpdate(SQLModel):
     # Apart from allowing values to be optional,
     # they will(default values) also be used in Body().dict() if exclude_unset=False
@@ -72,7 +102,23 @@ class AnswerRead(AnswerBase):
     user: UserRead
     published: datetime
     updated: datetime | None
+    score: int
 
 
 class AnswerCreateUpdate(AnswerBase):
     pass
+
+
+class AnswerVoteCreate(SQLModel):
+    value: Literal[1, -1]
+
+
+class AnswerBatchItem(SQLModel):
+    # same as QuestionBatchItem
+    index: int
+    answer: AnswerRead | None = None
+    errors: list[dict] | None = None
+
+
+class QuestionWithAnswersRead(QuestionRead):
+    answers: list[AnswerRead]
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Callable, Hashable
+
+from starlette.concurrency import run_in_threadpool
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share a single execution:
+    # the first caller runs the function in the threadpool, the ones arriving
+    # while it runs wait for its result (or exception) instead of running it again.
+    # The execution is shielded, a cancelled caller doesn't cancel it for the others.
+
+    def __init__(self):
+        self._calls: dict[Hashable, list] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, function: Callable, *args: Any) -> tuple[Any, int]:
+        # Returns the result, together with the number of callers it was
+        # shared with (the caller itself included) for the caller that started
+        # the execution, and 0 for the callers that joined it.
+        call = self._calls.get(key)
+        if call is not None:
+            call[1] += 1
+            self.shared += 1
+            return await asyncio.shield(call[0]), 0
+        task = asyncio.ensure_future(run_in_threadpool(function, *args))
+        call = self._calls[key] = [task, 1]
+        self.executed += 1
+        task.add_done_callback(lambda task: self._forget(key, task))
+        return await asyncio.shield(task), call[1]
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            # retrieved here, so that asyncio doesn't warn when nobody awaited it
+            task.exception()
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._calls), 'executed': self.executed,
+                'shared': self.shared}
+
+
+question_reads = SingleFlight()
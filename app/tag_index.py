@@ -0,0 +1,82 @@
+import heapq
+from bisect import bisect_left, insort
+from threading import Lock
+
+from sqlmodel import Session, select
+from sqlalchemy import func
+
+from .models import Tag, TaggedQuestions
+
+
+def normalize_tag_name(name: str) -> str:
+    return name.strip().replace(' ', '-').lower()
+
+
+class TagIndex:
+    # Sorted array of normalized tag names together with the number of questions
+    # using each of them. Names sharing a prefix form a contiguous slice of the array,
+    # which is found with two binary searches, so suggestions never touch the database.
+
+    def __init__(self):
+        self._lock = Lock()
+        self._names: list[str] = []
+        self._usage: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def clear(self):
+        with self._lock:
+            self._names = []
+            self._usage = {}
+
+    def load(self, session: Session):
+        rows = session.exec(
+            select(Tag.name, func.count(TaggedQuestions.question_id)).
+            outerjoin(TaggedQuestions, TaggedQuestions.tag_id == Tag.id).
+            group_by(Tag.id, Tag.name)).all()
+        usage = {name: count for name, count in rows}
+        with self._lock:
+            self._usage = usage
+            self._names = sorted(usage)
+
+    def update_usage(self,
+                     added: list[str] | None = None,
+                     removed: list[str] | None = None):
+        # names that are not indexed yet (newly created tags) are inserted
+        with self._lock:
+            for name in added or []:
+                if name not in self._usage:
+                    self._usage[name] = 0
+                    insort(self._names, name)
+                self._usage[name] += 1
+            for name in removed or []:
+                if name in self._usage:
+                    self._usage[name] = max(self._usage[name] - 1, 0)
+
+    def set_usage(self, name: str, usage: int):
+        with self._lock:
+            if name not in self._usage:
+                insort(self._names, name)
+            self._usage[name] = usage
+
+    def remove(self, names: list[str]):
+        # tags deleted from the database
+        with self._lock:
+            for name in names:
+                if self._usage.pop(name, None) is not None:
+                    self._names.pop(bisect_left(self._names, name))
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[tuple[str, int]]:
+        prefix = normalize_tag_name(prefix)
+        with self._lock:
+            start = bisect_left(self._names, prefix)
+            end = bisect_left(self._names, prefix + '\U0010ffff', lo=start)
+            names = self._names[start:end]
+            usage = self._usage
+            best = heapq.nsmallest(limit, names,
+                                   key=lambda name: (-usage[name], name))
+            return [(name, usage[name]) for name in best]
+
+
+tag_index = TagIndex()
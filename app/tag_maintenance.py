@@ -0,0 +1,201 @@
+from decouple import config
+from sqlalchemy import exists, func
+from sqlmodel import Session, select, update, delete
+
+from .archive import update_archived_documents_tags
+from .crud import get_tag_by_name, get_tags_by_names
+from .database import begin_write
+from .documents import rebuild_documents
+from .indexes import bump_index_versions
+from .jobs import enqueue
+from .models import Tag, TaggedQuestions, ArchivedTaggedQuestions
+from .tag_index import tag_index, normalize_tag_name
+
+
+# Tags are merged, renamed and collected by set-based statements on the link
+# tables, TAGS_BATCH_SIZE links a transaction, instead of editing questions
+# one by one through the ORM. Every batch rebuilds the documents of the
+# questions it touched. The transaction renaming or deleting tags bumps
+# the tag index's version, so that every app process reloads its index
+# (see app/indexes.py); the calling process updates its own at the end.
+# Each transaction begins before what it reads (see begin_write).
+TAGS_BATCH_SIZE = config('TAGS_BATCH_SIZE', default=500, cast=int)
+
+LINK_MODELS = (TaggedQuestions, ArchivedTaggedQuestions)
+
+
+def get_tag_usage(session: Session, tag_id: int) -> int:
+    # the usage the tag index counts, hot questions only
+    return session.exec(select(func.count()).
+                        where(TaggedQuestions.tag_id == tag_id)).one()
+
+
+def follow_links_change(session: Session,
+                        link_model: type[TaggedQuestions] | type[ArchivedTaggedQuestions],
+                        questions_ids: list[int]):
+    # the links are flushed, the caller commits
+    if link_model is ArchivedTaggedQuestions:
+        update_archived_documents_tags(session=session, questions_ids=questions_ids)
+        return
+    rebuild_documents(session=session, questions_ids=questions_ids)
+    enqueue(session=session, kind='refresh_related',
+            payloads=[{'question_id': id} for id in questions_ids])
+
+
+def move_links(session: Session,
+               link_model: type[TaggedQuestions] | type[ArchivedTaggedQuestions],
+               source_id: int,
+               target_id: int,
+               batch_size: int) -> list[int]:
+    # Moves a batch of the source tag's links to the target tag and returns
+    # their questions' ids. Questions tagged with both lose the source link;
+    # this is decided beforehand, MySQL can't UPDATE a table it reads in a subquery.
+    begin_write(session)
+    questions_ids = session.exec(
+        select(link_model.question_id).
+        where(link_model.tag_id == source_id).
+        order_by(link_model.question_id).
+        limit(batch_size)).all()
+    if not questions_ids:
+        return []
+    tagged = set(session.exec(
+        select(link_model.question_id).
+        where(link_model.tag_id == target_id,
+              link_model.question_id.in_(questions_ids))).all())
+    moved = [id for id in questions_ids if id not in tagged]
+    if moved:
+        session.exec(update(link_model).
+                     where(link_model.tag_id == source_id,
+                           link_model.question_id.in_(moved)).
+                     values(tag_id=target_id))
+    if tagged:
+        session.exec(delete(link_model).
+                     where(link_model.tag_id == source_id,
+                           link_model.question_id.in_(tagged)))
+    session.flush()
+    return questions_ids
+
+
+def delete_unused_tags(session: Session, tags_ids: list[int]) -> list[int]:
+    # the links are checked again by the DELETE itself,
+    # a tag used since it was looked at is kept; the caller commits
+    session.exec(delete(Tag).
+                 where(Tag.id.in_(tags_ids),
+                       ~exists().where(TaggedQuestions.tag_id == Tag.id),
+                       ~exists().where(ArchivedTaggedQuestions.tag_id == Tag.id)).
+                 execution_options(synchronize_session=False))
+    kept = set(session.exec(select(Tag.id).where(Tag.id.in_(tags_ids))).all())
+    return [id for id in tags_ids if id not in kept]
+
+
+def merge_tags(session: Session,
+               names: list[str],
+               into: str,
+               batch_size: int = TAGS_BATCH_SIZE,
+               progress=None) -> int:
+    # Moves every question of the tags to the `into` tag, created if missing,
+    # and deletes them. Returns the number of links moved.
+    target_name = normalize_tag_name(into)
+    begin_write(session)
+    sources = [tag for tag in get_tags_by_names(
+        session=session, names=[normalize_tag_name(name) for name in names])
+        if tag.name != target_name]
+    target = get_tag_by_name(session=session, name=target_name)
+    if target is None:
+        target = Tag(name=target_name)
+        session.add(target)
+        session.commit()
+        session.refresh(target)
+    done = 0
+    for source in sources:
+        for link_model in LINK_MODELS:
+            while questions_ids := move_links(session=session, link_model=link_model,
+                                              source_id=source.id, target_id=target.id,
+                                              batch_size=batch_size):
+                follow_links_change(session=session, link_model=link_model,
+                                    questions_ids=questions_ids)
+                session.commit()
+                done += len(questions_ids)
+                if progress:
+                    progress(done)
+    names_by_id = {tag.id: tag.name for tag in sources}
+    begin_write(session)
+    deleted = delete_unused_tags(session=session, tags_ids=list(names_by_id))
+    bump_index_versions(session=session, names=['tags'])
+    session.commit()
+    tag_index.remove([names_by_id[id] for id in deleted])
+    tag_index.set_usage(target.name, get_tag_usage(session=session, tag_id=target.id))
+    return done
+
+
+def rename_tag(session: Session,
+               name: str,
+               new_name: str,
+               batch_size: int = TAGS_BATCH_SIZE,
+               progress=None) -> int:
+    # renaming to the name of another tag merges them;
+    # returns the number of documents rebuilt
+    begin_write(session)
+    tag = get_tag_by_name(session=session, name=normalize_tag_name(name))
+    if tag is None:
+        raise LookupError(f'Tag {name} was not found.')
+    new_name = normalize_tag_name(new_name)
+    if new_name == tag.name:
+        return 0
+    if get_tag_by_name(session=session, name=new_name) is not None:
+        return merge_tags(session=session, names=[tag.name], into=new_name,
+                          batch_size=batch_size, progress=progress)
+    old_name = tag.name
+    tag.name = new_name
+    session.add(tag)
+    bump_index_versions(session=session, names=['tags'])
+    session.commit()
+    done = 0
+    for link_model in LINK_MODELS:
+        last_id = 0
+        while questions_ids := session.exec(
+                select(link_model.question_id).
+                where(link_model.tag_id == tag.id, link_model.question_id > last_id).
+                order_by(link_model.question_id).
+                limit(batch_size)).all():
+            begin_write(session)
+            if link_model is ArchivedTaggedQuestions:
+                update_archived_documents_tags(session=session, questions_ids=questions_ids)
+            else:
+                rebuild_documents(session=session, questions_ids=questions_ids)
+            session.commit()
+            done += len(questions_ids)
+            last_id = questions_ids[-1]
+            if progress:
+                progress(done)
+    tag_index.remove([old_name])
+    tag_index.set_usage(new_name, get_tag_usage(session=session, tag_id=tag.id))
+    return done
+
+
+def collect_unused_tags(session: Session,
+                        batch_size: int = TAGS_BATCH_SIZE,
+                        progress=None) -> list[str]:
+    # deletes the tags no question, hot or archived, uses;
+    # returns their names
+    collected = []
+    last_id = 0
+    while rows := session.exec(
+            select(Tag.id, Tag.name).
+            where(Tag.id > last_id,
+                  ~exists().where(TaggedQuestions.tag_id == Tag.id),
+                  ~exists().where(ArchivedTaggedQuestions.tag_id == Tag.id)).
+            order_by(Tag.id).
+            limit(batch_size)).all():
+        names_by_id = dict(rows)
+        deleted = delete_unused_tags(session=session, tags_ids=list(names_by_id))
+        if deleted:
+            bump_index_versions(session=session, names=['tags'])
+        session.commit()
+        names = [names_by_id[id] for id in deleted]
+        tag_index.remove(names)
+        collected.extend(names)
+        last_id = rows[-1][0]
+        if progress:
+            progress(len(collected))
+    return collected
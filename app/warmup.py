@@ -0,0 +1,140 @@
+import logging
+import time
+from threading import Event
+
+from decouple import config
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from .auth import pwd_context
+from .crud import get_user_with_username, get_user_with_email, get_questions_ids, \
+    get_all_questions, get_all_answers, get_answers_by_score, get_answer_by_id_and_question_id
+from .documents import get_documents
+from .archive import get_archived_document
+from .models import ArchivedAnswer
+from .duplicates import duplicates_index
+from .ranking import get_hot_questions
+from .related import get_related_questions
+from .tag_index import tag_index
+from .indexes import index_watcher
+
+
+# number of connections opened before the app is reported as ready
+WARMUP_POOL_CONNECTIONS = config('WARMUP_POOL_CONNECTIONS', default=5, cast=int)
+# a failed warmup is retried from the step that failed, after
+# WARMUP_RETRY_DELAY * 2 ** (attempt - 1) seconds; once WARMUP_ATTEMPTS
+# failed the process reports itself as not live, to be restarted
+WARMUP_ATTEMPTS = config('WARMUP_ATTEMPTS', default=5, cast=int)
+WARMUP_RETRY_DELAY = config('WARMUP_RETRY_DELAY', default=1.0, cast=float)
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupState:
+
+    def __init__(self):
+        self.ready = False
+        self.error: str | None = None
+        self.timings: dict[str, float] = {}
+        self.attempts = 0
+        # set once every attempt failed
+        self.failed = False
+        # set at shutdown, ends the wait for the next attempt
+        self.stop = Event()
+
+
+def fill_pool(engine: Engine, connections: int):
+    # all of them are checked out at once, so that the pool has to open
+    # a separate connection for each, they stay in the pool once closed
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+def compile_statements(engine: Engine):
+    # Runs every hot crud query once with arguments matching nothing,
+    # so their compiled forms are in the engine's statement cache
+    # before the first real request needs them.
+    with Session(engine) as session:
+        get_user_with_username(session=session, username='')
+        get_user_with_email(session=session, email='')
+        get_documents(session=session, questions_ids=[0])
+        get_questions_ids(session=session, limit=1, offset=1)
+        get_questions_ids(session=session, limit=1, offset=1, search_string='-')
+        get_all_questions(session=session, ids=[0])
+        get_all_answers(session=session, question_id=0, limit=1, offset=1)
+        get_answers_by_score(session=session, question_id=0, limit=1)
+        get_answer_by_id_and_question_id(session=session, question_id=0, id=0)
+        get_archived_document(session=session, question_id=0)
+        get_all_answers(session=session, question_id=0, limit=1, offset=1,
+                        model=ArchivedAnswer)
+        get_hot_questions(session=session, limit=1)
+        get_related_questions(session=session, question_id=0, limit=1)
+
+
+def load_indexes(engine: Engine):
+    # the duplicates index is read as saved, it catches up once ready
+    with Session(engine) as session:
+        index_watcher.record(session=session)
+        tag_index.load(session=session)
+    duplicates_index.read()
+
+
+def catch_up_duplicates(engine: Engine):
+    with Session(engine) as session:
+        duplicates_index.catch_up(session=session)
+
+
+def init_bcrypt():
+    # loads the bcrypt backend, which passlib does lazily on first use
+    pwd_context.hash('warmup')
+
+
+def warm_up(engine: Engine, state: WarmupState,
+            connections: int = WARMUP_POOL_CONNECTIONS,
+            read_engine: Engine | None = None,
+            attempts: int = WARMUP_ATTEMPTS,
+            retry_delay: float = WARMUP_RETRY_DELAY):
+    # in SQLite mode only the readers' pool is filled, the writer's has its
+    # connections opened as they're used; each engine has its own statement cache
+    read_engine = read_engine or engine
+    engines = [engine] if read_engine is engine else [engine, read_engine]
+    steps = (('pool', lambda: fill_pool(read_engine, connections)),
+             ('statements', lambda: [compile_statements(each) for each in engines]),
+             ('indexes', lambda: load_indexes(engine)),
+             ('bcrypt', init_bcrypt))
+    while True:
+        state.attempts += 1
+        try:
+            for name, step in steps:
+                if name in state.timings:
+                    continue
+                start = time.perf_counter()
+                step()
+                state.timings[name] = time.perf_counter() - start
+            break
+        except Exception as error:
+            state.error = repr(error)
+            logger.exception('Warmup failed at %s, attempt %s of %s',
+                             name, state.attempts, attempts)
+        if state.attempts >= attempts:
+            state.failed = True
+            return
+        if state.stop.wait(retry_delay * 2 ** (state.attempts - 1)):
+            return
+    state.error = None
+    state.ready = True
+    logger.info('Warmup finished: %s', state.timings)
+    # minhashing the questions changed since the index was saved takes
+    # a while, requests are served meanwhile
+    start = time.perf_counter()
+    try:
+        catch_up_duplicates(read_engine)
+    except Exception:
+        logger.exception('Duplicates index catch up failed')
+        return
+    state.timings['duplicates'] = time.perf_counter() - start
@@ -0,0 +1,67 @@
+# Shows the size and CPU cost of compressing a GET /questions page
+# with gzip and brotli at a few levels, and the cost of serving
+# the same page again from the compressed bodies cache.
+#
+#   python -m benchmarks.bench_compression --questions 100
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+from app.compression import CompressionMiddleware, compress, brotli
+
+
+WORDS = ['session', 'model', 'relationship', 'query', 'loaded', 'closed', 'link',
+         'table', 'column', 'index', 'why', 'does', 'the', 'not', 'when', 'my', 'a']
+
+
+def questions_page(questions: int) -> bytes:
+    random.seed(0)
+    page = [{
+        'title': f'How do I do thing number {id} with SQLModel relationships?',
+        'content': ' '.join(random.choices(WORDS, k=60)),
+        'id': id,
+        'published': datetime(2023, 9, 1, 12, id % 60).isoformat(),
+        'updated': None,
+        'user': {'username': f'user_{id % 50}', 'email': f'user_{id % 50}@gmail.com',
+                 'id': id % 50},
+        'tags': [{'name': name, 'id': number}
+                 for number, name in enumerate(['python', 'sqlmodel', 'fastapi'][:id % 3 + 1])]
+    } for id in range(1, questions + 1)]
+    return json.dumps(page).encode()
+
+
+def timed(function, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    body = questions_page(args.questions)
+    print(f'uncompressed: {len(body):9d} bytes')
+    settings = [('gzip', level) for level in (1, 6, 9)]
+    if brotli is not None:
+        settings += [('br', quality) for quality in (1, 5, 11)]
+    for encoding, level in settings:
+        size = len(compress(body, encoding, level, level))
+        cpu_ms = timed(lambda: compress(body, encoding, level, level),
+                       repeat=args.repeat if level < 9 else max(args.repeat // 10, 1))
+        print(f'{encoding:4s} level {level:2d}: {size:9d} bytes '
+              f'({size / len(body):6.1%}), {cpu_ms:7.3f} ms CPU per response')
+
+    middleware = CompressionMiddleware(app=None)
+    middleware.compress(body, 'gzip')
+    cached_ms = timed(lambda: middleware.compress(body, 'gzip'), repeat=args.repeat)
+    print(f'gzip from cache:  {cached_ms:7.3f} ms CPU per response (digest and lookup)')
+
+
+if __name__ == '__main__':
+    main()
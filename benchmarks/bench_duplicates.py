@@ -0,0 +1,61 @@
+# Measures how long the near-duplicate check of post_question takes
+# with a large in-memory MinHash/LSH index, and how long saving and
+# reading the index file take.
+#
+#   python -m benchmarks.bench_duplicates --questions 50000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.duplicates import DuplicatesIndex
+
+
+WORDS = [f'word{number}' for number in range(5000)]
+
+
+def random_text(words: int) -> str:
+    return ' '.join(random.choices(WORDS, k=words))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    path = os.path.join(tempfile.mkdtemp(), 'index.bin')
+    index = DuplicatesIndex(path=path)
+    start = time.perf_counter()
+    texts = []
+    for question_id in range(1, args.questions + 1):
+        title, content = random_text(8), random_text(40)
+        index.add(question_id=question_id, title=title, content=content)
+        if question_id <= args.repeat:
+            texts.append((title, content))
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for title, content in texts:
+        index.find(title=title, content=content)
+    find_ms = (time.perf_counter() - start) / len(texts) * 1000
+
+    start = time.perf_counter()
+    index.save()
+    save_s = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded = DuplicatesIndex(path=path)
+    loaded.read()
+    read_s = time.perf_counter() - start
+
+    print(f'questions={args.questions} file={os.path.getsize(path) / 2 ** 20:.1f} MiB')
+    print(f'build:            {build_s:8.2f} s')
+    print(f'find (post time): {find_ms:8.3f} ms per question')
+    print(f'save:             {save_s:8.2f} s')
+    print(f'read:             {read_s:8.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Compares building a user profile by loading the User.questions and
+# User.answers relationships with the aggregate query of get_user_stats,
+# and with the profiles cache, for a user with many answers.
+#
+#   python -m benchmarks.bench_profiles --answers 100000
+import argparse
+import time
+from datetime import datetime
+
+from sqlmodel import SQLModel, Session, create_engine, insert, select
+
+from app.crud import get_user_stats
+from app.models import User, Question, Answer
+from app.profiles import get_user_profile, profiles_cache
+
+
+def populate(session: Session, questions: int, answers: int, users: int):
+    published = datetime.utcnow()
+    session.exec(insert(User), params=[
+        {'id': id, 'username': f'bench_user_{id}', 'email': f'bench_user_{id}@gmail.com',
+         'hashed_password': '-'} for id in range(1, users + 1)])
+    # the first user posts a question in ten and most of the answers,
+    # the others share the rest
+    session.exec(insert(Question), params=[
+        {'id': id, 'title': f'Question {id}', 'published': published,
+         'user_id': 1 if id % 10 == 0 else id % users + 1}
+        for id in range(1, questions + 1)])
+    session.exec(insert(Answer), params=[
+        {'id': id, 'content': f'Answer {id}', 'published': published, 'score': 0,
+         'question_id': id % questions + 1,
+         'user_id': 1 if id % 5 else id % users + 1}
+        for id in range(1, answers + 1)])
+    session.commit()
+
+
+def timed(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--answers', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--url', default='sqlite://')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        populate(session, args.questions, args.answers, args.users)
+
+    def by_relationships():
+        with Session(engine) as session:
+            user = session.exec(select(User).where(User.username == 'bench_user_1')).one()
+            return len(user.questions), len(user.answers)
+
+    def by_aggregate():
+        with Session(engine) as session:
+            row = get_user_stats(session=session, username='bench_user_1')
+            return row.questions_count, row.answers_count
+
+    def cached():
+        with Session(engine) as session:
+            return get_user_profile(session=session, username='bench_user_1')
+
+    counts = by_aggregate()
+    assert by_relationships() == counts
+    profiles_cache.clear()
+    cached()
+    print(f'questions={args.questions} answers={args.answers} users={args.users}, '
+          f'the profiled user has {counts[0]} questions and {counts[1]} answers')
+    print(f'relationships loaded:  {timed(by_relationships, args.repeat):10.3f} ms per profile')
+    print(f'aggregate query:       {timed(by_aggregate, args.repeat):10.3f} ms per profile')
+    print(f'profiles cache:        {timed(cached, args.repeat):10.3f} ms per profile')
+
+
+if __name__ == '__main__':
+    main()
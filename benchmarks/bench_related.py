@@ -0,0 +1,90 @@
+# Compares reading related questions from the related_question index
+# with the naive self join of tagged_questions, and measures the cost
+# of refreshing the index when a question is posted.
+#
+#   python -m benchmarks.bench_related --questions 20000 --tags 500
+import argparse
+import random
+import time
+from datetime import datetime
+
+from sqlmodel import SQLModel, Session, create_engine, insert
+
+from app.models import User, Tag, Question, TaggedQuestions
+from app.related import refresh_related, get_related_questions, \
+    get_related_questions_ids_by_join, RELATED_LIMIT
+
+
+def populate(session: Session, questions: int, tags: int, tags_per_question: int):
+    random.seed(0)
+    user = User(username='bench_user', email='bench_user@gmail.com',
+                hashed_password='-')
+    session.add(user)
+    session.flush()
+    session.exec(insert(Tag), params=[{'id': id, 'name': f'tag-{id}'}
+                                      for id in range(1, tags + 1)])
+    session.exec(insert(Question), params=[
+        {'id': id, 'title': f'Question {id}', 'user_id': user.id,
+         'published': datetime.utcnow()}
+        for id in range(1, questions + 1)])
+    # a few tags are used by most of the questions, like 'python' would be
+    weights = [1 / rank for rank in range(1, tags + 1)]
+    links = []
+    for question_id in range(1, questions + 1):
+        tags_ids = set(random.choices(range(1, tags + 1), weights=weights,
+                                      k=tags_per_question))
+        links.extend({'question_id': question_id, 'tag_id': tag_id}
+                     for tag_id in tags_ids)
+    session.exec(insert(TaggedQuestions), params=links)
+    session.commit()
+
+
+def tags_of(session: Session, question_id: int) -> list[int]:
+    return [tag.id for tag in session.get(Question, question_id).tags]
+
+
+def timed(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--tags-per-question', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--url', default='sqlite://')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        populate(session, args.questions, args.tags, args.tags_per_question)
+        sample = random.sample(range(1, args.questions + 1), args.repeat)
+
+        start = time.perf_counter()
+        for question_id in sample:
+            refresh_related(session=session, question_id=question_id,
+                            tags_ids=tags_of(session, question_id))
+        session.commit()
+        refresh_ms = (time.perf_counter() - start) / len(sample) * 1000
+
+        join_ms = timed(lambda: [get_related_questions_ids_by_join(
+            session=session, question_id=question_id, limit=RELATED_LIMIT)
+            for question_id in sample], repeat=1) / len(sample)
+        index_ms = timed(lambda: [get_related_questions(
+            session=session, question_id=question_id, limit=RELATED_LIMIT)
+            for question_id in sample], repeat=1) / len(sample)
+
+    print(f'questions={args.questions} tags={args.tags} '
+          f'tags_per_question={args.tags_per_question}')
+    print(f'refresh on post/retag:   {refresh_ms:8.3f} ms per question')
+    print(f'naive self join (ids):   {join_ms:8.3f} ms per read')
+    print(f'related_question index:  {index_ms:8.3f} ms per read (full rows)')
+
+
+if __name__ == '__main__':
+    main()
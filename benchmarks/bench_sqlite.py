@@ -0,0 +1,144 @@
+# Compares the throughput of worker processes sharing a SQLite file, as the
+# app's workers do, each with a few threads as its threadpool has, with the
+# file opened with SQLAlchemy's defaults (rollback journal, a new connection
+# per session, pysqlite's default 5 seconds busy wait) and in SQLite mode
+# (see create_engines in app/database.py). Every operation authenticates
+# its user from a token as get_current_user does, then reads a page of the
+# listing or a question's answers, and every --write-every operations posts
+# an answer. Failed operations are "database is locked" and pool timeouts.
+#
+#   python -m benchmarks.bench_sqlite --processes 4 --threads 4 --seconds 10
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError, TimeoutError
+from sqlmodel import SQLModel, Session, create_engine, insert
+
+from app.auth import create_access_token, get_current_user
+from app.crud import get_questions_ids, get_all_answers
+from app.database import create_engines
+from app.documents import get_documents, rebuild_all_documents
+from app.models import User, Question, Answer
+
+
+def populate(engine, questions: int):
+    published = datetime.utcnow()
+    with Session(engine) as session:
+        session.exec(insert(User), params=[
+            {'id': 1, 'username': 'bench_user', 'email': 'bench_user@gmail.com',
+             'hashed_password': '-'}])
+        session.exec(insert(Question), params=[
+            {'id': id, 'title': f'Question {id}', 'published': published, 'user_id': 1}
+            for id in range(1, questions + 1)])
+        session.exec(insert(Answer), params=[
+            {'content': f'Answer number {id}', 'published': published, 'score': 0,
+             'question_id': id % questions + 1, 'user_id': 1}
+            for id in range(questions * 5)])
+        session.commit()
+        rebuild_all_documents(session=session)
+
+
+def get_engines(setup: str, url: str):
+    if setup == 'default':
+        engine = create_engine(url, connect_args={'check_same_thread': False})
+        return engine, engine
+    return create_engines(url)
+
+
+def run_process(setup: str, url: str, seed: int, threads: int, seconds: float,
+                write_every: int, questions: int, results):
+    # a worker process, with engines of its own
+    engine, read_engine = get_engines(setup, url)
+    token = create_access_token(data={'sub': 'bench_user'})
+    counts = {'reads': 0, 'writes': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def work(seed: int):
+        rng = random.Random(seed)
+        done = {'reads': 0, 'writes': 0, 'failed': 0}
+        operation = 0
+        while time.perf_counter() < deadline:
+            operation += 1
+            try:
+                with Session(read_engine) as session:
+                    user = get_current_user(token=token, session=session)
+                    if operation % write_every:
+                        if operation % 2:
+                            ids = get_questions_ids(session=session, limit=20,
+                                                    offset=rng.randint(0, questions - 20))
+                            get_documents(session=session, questions_ids=ids)
+                        else:
+                            get_all_answers(session=session, limit=10,
+                                            question_id=rng.randint(1, questions))
+                        done['reads'] += 1
+                        continue
+                with Session(engine) as session:
+                    session.add(Answer(content='Another answer', user_id=user.id,
+                                       question_id=rng.randint(1, questions)))
+                    session.commit()
+                done['writes'] += 1
+            except (OperationalError, TimeoutError):
+                done['failed'] += 1
+        with lock:
+            for key, value in done.items():
+                counts[key] += value
+
+    workers = [threading.Thread(target=work, args=(seed * threads + number,))
+               for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    engine.dispose()
+    read_engine.dispose()
+    results.put(counts)
+
+
+def run(setup: str, url: str, processes: int, threads: int, seconds: float,
+        write_every: int, questions: int) -> tuple[int, int, int]:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [context.Process(target=run_process,
+                               args=(setup, url, seed, threads, seconds, write_every,
+                                     questions, results))
+               for seed in range(processes)]
+    for worker in workers:
+        worker.start()
+    counts = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return tuple(sum(each[key] for each in counts) for key in ('reads', 'writes', 'failed'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-every', type=int, default=10)
+    parser.add_argument('--questions', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"setup":<12} {"reads/s":>10} {"writes/s":>10} {"failed":>8}')
+        for setup in ('default', 'sqlite mode'):
+            url = f'sqlite:///{os.path.join(directory, setup.replace(" ", "_") + ".sqlite3")}'
+            engine, _ = get_engines(setup, url)
+            SQLModel.metadata.create_all(engine)
+            populate(engine, args.questions)
+            engine.dispose()
+            reads, writes, failed = run(setup, url, args.processes, args.threads,
+                                        args.seconds, args.write_every, args.questions)
+            print(f'{setup:<12} {reads / args.seconds:10.0f} '
+                  f'{writes / args.seconds:10.0f} {failed:8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Compares the per call Python overhead of the hot crud queries built
+# as lambda statements with the same queries built with a new select()
+# on every call, as they used to be. The tables hold a few rows only,
+# so the time is spent building, caching and executing the statements.
+#
+#   python -m benchmarks.bench_statements --repeat 5000
+import argparse
+import time
+
+from sqlalchemy import asc
+from sqlalchemy.orm import joinedload
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from app.crud import get_user_with_username, get_question_by_id, \
+    get_all_questions, get_all_answers
+from app.database import StatementCacheStats, track_statement_cache
+from app.models import User, Tag, Question, Answer
+
+
+def get_user_with_username_select(session: Session, username: str):
+    return session.exec(select(User).where(User.username == username)).first()
+
+
+def get_question_by_id_select(session: Session, id: int):
+    return session.exec(select(Question).
+                        where(Question.id == id).
+                        options(joinedload(Question.tags), joinedload(Question.user))).first()
+
+
+def get_all_questions_select(session: Session, limit: int, offset: int, search_string: str):
+    statement = select(Question).where(Question.title.contains(search_string)).\
+        offset(offset=offset).limit(limit=limit).order_by(asc(Question.id))
+    return session.exec(statement.options(joinedload(Question.tags),
+                                          joinedload(Question.user))).unique().all()
+
+
+def get_all_answers_select(session: Session, question_id: int, limit: int, offset: int):
+    statement = select(Answer).where(Answer.question_id == question_id).\
+        offset(offset=offset).limit(limit=limit).order_by(asc(Answer.id))
+    return session.exec(statement.options(joinedload(Answer.user))).all()
+
+
+def populate(session: Session):
+    user = User(username='bench_user', email='bench_user@gmail.com',
+                hashed_password='-')
+    session.add(user)
+    session.flush()
+    for id in range(1, 11):
+        session.add(Question(title=f'Question {id}', user_id=user.id,
+                             tags=[Tag(name=f'tag-{id}')]))
+    session.flush()
+    for id in range(1, 11):
+        session.add(Answer(content=f'Answer number {id}', question_id=1, user_id=user.id))
+    session.commit()
+
+
+def timed(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for index in range(repeat):
+        function(index)
+    return (time.perf_counter() - start) / repeat * 1000 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5000)
+    parser.add_argument('--url', default='sqlite://')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    SQLModel.metadata.create_all(engine)
+    stats = track_statement_cache(engine, StatementCacheStats())
+    with Session(engine) as session:
+        populate(session)
+        cases = (
+            ('get_user_with_username',
+             lambda index: get_user_with_username_select(session, 'bench_user'),
+             lambda index: get_user_with_username(session, 'bench_user')),
+            ('get_question_by_id',
+             lambda index: get_question_by_id_select(session, index % 10 + 1),
+             lambda index: get_question_by_id(session, index % 10 + 1)),
+            ('get_all_questions',
+             lambda index: get_all_questions_select(session, 5, index % 5, 'Question'),
+             lambda index: get_all_questions(session, limit=5, offset=index % 5,
+                                             search_string='Question')),
+            ('get_all_answers',
+             lambda index: get_all_answers_select(session, 1, 5, index % 5),
+             lambda index: get_all_answers(session, question_id=1, limit=5,
+                                           offset=index % 5)),
+        )
+        print(f'{"query":<24} {"select()":>12} {"lambda":>12}')
+        for name, select_call, lambda_call in cases:
+            # once each, so that both are compiled and cached before timing
+            select_call(0)
+            lambda_call(0)
+            select_us = timed(select_call, args.repeat)
+            lambda_us = timed(lambda_call, args.repeat)
+            print(f'{name:<24} {select_us:9.1f} us {lambda_us:9.1f} us')
+    print(f'statement cache: {stats.stats(engine)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,15 @@ from sqlmodel import SQLModel, Session, create_engine
 from sqlmodel.pool import StaticPool
 
 from app.main import app
-from app.database import get_session
+from app.routers import debug
+from app.database import get_session, get_read_session
 from app.models import User
 from app.auth import generate_password_hash
+from app.tag_index import tag_index
+from app.indexes import index_watcher
+from app.duplicates import duplicates_index
+from app.profiles import profiles_cache
+from app.counts import counts_cache
 
 DATABASE_TEST_URL = 'sqlite:///:memory:'
 
@@ -26,15 +32,21 @@ def session_fixture():
         yield session
 
 
+DEBUG_TOKEN = 'test-debug-token'
+
+
 @pytest.fixture(name='client')
-def client_fixture(session: Session):
+def client_fixture(session: Session, monkeypatch: pytest.MonkeyPatch, tmp_path):
     def get_session_override():
         return session
 
     app.debug = False
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    monkeypatch.setattr(debug, 'DEBUG_TOKEN', DEBUG_TOKEN)
+    monkeypatch.setattr(duplicates_index, 'path', str(tmp_path / 'duplicates_index.bin'))
 
-    client = TestClient(app)
+    client = TestClient(app, headers={'X-Debug-Token': DEBUG_TOKEN})
     yield client
     app.dependency_overrides.clear()
 
@@ -58,3 +70,13 @@ class AuthActions(object):
 @pytest.fixture
 def auth(client: TestClient):
     return AuthActions(client)
+
+
+@pytest.fixture(autouse=True)
+def clear_indexes():
+    yield
+    tag_index.clear()
+    duplicates_index.clear()
+    index_watcher.clear()
+    profiles_cache.clear()
+    counts_cache.clear()
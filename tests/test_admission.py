@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.admission import AdmissionMiddleware, ConcurrencyLimiter, get_request_class
+
+
+@pytest.mark.parametrize(
+    ('method', 'path', 'request_class'),
+    (
+        ('GET', '/questions', 'read'),
+        ('POST', '/questions', 'write'),
+        ('DELETE', '/questions/1', 'write'),
+        ('POST', '/users/login', 'auth'),
+        ('POST', '/users/', 'auth'),
+        ('GET', '/users/me', 'read'),
+        ('GET', '/debug/jobs', 'read'),
+        ('GET', '/health/ready', None)
+    )
+)
+def test_get_request_class(method, path, request_class):
+    assert get_request_class(method, path) == request_class
+
+
+def test_limiter_sheds_when_queue_is_full():
+    async def run():
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, queue_timeout=0.5)
+        assert await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        # the queue is full, shed without waiting
+        assert not await limiter.acquire()
+        limiter.release()
+        assert await waiting
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats['admitted'] == 2
+    assert stats['shed_queue_full'] == 1
+    assert stats['in_flight'] == 1
+
+
+def test_limiter_sheds_after_queue_timeout():
+    async def run():
+        limiter = ConcurrencyLimiter(limit=1, max_queue=10, queue_timeout=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats['shed_timeout'] == 1
+    assert stats['queued'] == 0
+
+
+def test_overloaded_requests_get_503():
+    async def run():
+        release = asyncio.Event()
+        app = FastAPI()
+
+        @app.get('/slow')
+        async def slow():
+            await release.wait()
+            return {'done': True}
+
+        limiters = {name: ConcurrencyLimiter(limit=1, max_queue=0, queue_timeout=1)
+                    for name in ('read', 'write', 'auth')}
+        app.add_middleware(AdmissionMiddleware, limiters=limiters)
+        async with httpx.AsyncClient(app=app, base_url='http://test') as client:
+            first = asyncio.create_task(client.get('/slow'))
+            await asyncio.sleep(0.05)
+            shed = await client.get('/slow')
+            release.set()
+            return await first, shed
+
+    first, shed = asyncio.run(run())
+    assert first.status_code == 200
+    assert shed.status_code == 503
+    assert shed.headers['Retry-After'] == '1'
+
+
+def test_get_admission_stats(client: TestClient):
+    client.get('/questions')
+    response = client.get('/debug/admission')
+    assert response.status_code == 200
+    assert set(response.json()) == {'read', 'write', 'auth'}
+    assert response.json()['read']['admitted'] >= 1
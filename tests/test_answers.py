@@ -0,0 +1,213 @@
+import pytest
+from fastapi.testclient import TestClient
+from fastapi import status
+from sqlmodel import Session, select
+
+
+from app.models import User, Question, Answer, AnswerVote
+from app.auth import generate_password_hash
+from app.routers import answers
+
+
+from .conftest import AuthActions
+
+
+@pytest.fixture(name='question')
+def question_fixture(session: Session):
+    author = User(username='author',
+                  email='author@gmail.com',
+                  hashed_password=generate_password_hash('34somepassword34'))
+    question = Question(title='Some question', user=author)
+    session.add(question)
+    session.commit()
+    session.refresh(question)
+    return question
+
+
+def add_answers(session: Session, question: Question, scores: list[int]) -> list[Answer]:
+    answers = [Answer(content='Some answer content', score=score,
+                      question=question, user=question.user) for score in scores]
+    session.add_all(answers)
+    session.commit()
+    for answer in answers:
+        session.refresh(answer)
+    return answers
+
+
+def test_vote_answer(client: TestClient, auth: AuthActions,
+                     session: Session, question: Question):
+    answer = add_answers(session, question, [0])[0]
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.put(f'/questions/{question.id}/answers/{answer.id}/vote',
+                          json={'value': 1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['score'] == 1
+    # changing the vote replaces the previous one
+    response = client.put(f'/questions/{question.id}/answers/{answer.id}/vote',
+                          json={'value': -1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['score'] == -1
+    votes = session.exec(select(AnswerVote).
+                         where(AnswerVote.answer_id == answer.id)).all()
+    assert len(votes) == 1
+    assert votes[0].value == -1
+
+
+def test_concurrent_first_votes(client: TestClient, auth: AuthActions, session: Session,
+                                question: Question, monkeypatch: pytest.MonkeyPatch):
+    answer = add_answers(session, question, [-1])[0]
+    # the same user's other first vote commits between the read and the insert
+    session.add(AnswerVote(user_id=1, answer_id=answer.id, value=-1))
+    session.commit()
+    get_answer_vote = answers.get_answer_vote
+    reads = []
+
+    def get_answer_vote_before_commit(**kwargs):
+        reads.append(kwargs)
+        return get_answer_vote(**kwargs) if len(reads) > 1 else None
+
+    monkeypatch.setattr(answers, 'get_answer_vote', get_answer_vote_before_commit)
+    headers = {'Authorization': f'Bearer {auth.login()}'}
+    response = client.put(f'/questions/{question.id}/answers/{answer.id}/vote',
+                          json={'value': 1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['score'] == 1
+    assert len(reads) == 2
+    assert session.get(AnswerVote, (1, answer.id), populate_existing=True).value == 1
+
+
+def test_delete_answer_vote(client: TestClient, auth: AuthActions,
+                            session: Session, question: Question):
+    answer = add_answers(session, question, [0])[0]
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    client.put(f'/questions/{question.id}/answers/{answer.id}/vote',
+               json={'value': 1}, headers=headers)
+    response = client.delete(f'/questions/{question.id}/answers/{answer.id}/vote',
+                             headers=headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    session.refresh(answer)
+    assert answer.score == 0
+    response = client.delete(f'/questions/{question.id}/answers/{answer.id}/vote',
+                             headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize('value', (0, 2, None))
+def test_vote_answer_with_invalid_value(client: TestClient, auth: AuthActions,
+                                        session: Session, question: Question, value):
+    answer = add_answers(session, question, [0])[0]
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.put(f'/questions/{question.id}/answers/{answer.id}/vote',
+                          json={'value': value}, headers=headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_vote_own_answer(client: TestClient, auth: AuthActions,
+                         session: Session, question: Question):
+    test_user = session.exec(select(User).where(
+        User.username == 'test_user')).first()
+    answer = Answer(content='Some answer content',
+                    question=question, user=test_user)
+    session.add(answer)
+    session.commit()
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.put(f'/questions/{question.id}/answers/{answer.id}/vote',
+                          json={'value': 1}, headers=headers)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_get_answers_sorted_by_score(client: TestClient,
+                                     session: Session, question: Question):
+    answers = add_answers(session, question, [1, 5, 1, -2])
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'sort': 'score', 'limit': 2})
+    assert response.status_code == status.HTTP_200_OK
+    first_page = response.json()
+    assert [answer['id'] for answer in first_page] == [answers[1].id,
+                                                       answers[2].id]
+    last = first_page[-1]
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'sort': 'score', 'limit': 2,
+                                  'after_score': last['score'],
+                                  'after_id': last['id']})
+    assert response.status_code == status.HTTP_200_OK
+    assert [answer['id'] for answer in response.json()] == [answers[0].id,
+                                                            answers[3].id]
+
+
+@pytest.mark.parametrize(
+    'params',
+    (
+        {'sort': 'score', 'offset': 1},
+        {'sort': 'score', 'by_date_asc': True},
+        {'sort': 'score', 'after_score': 1},
+        {'after_score': 1, 'after_id': 1}
+    )
+)
+def test_get_answers_with_invalid_paging(client: TestClient, question: Question, params):
+    response = client.get(f'/questions/{question.id}/answers', params=params)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_post_answers_batch(client: TestClient, auth: AuthActions,
+                            session: Session, question: Question):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post(f'/questions/{question.id}/answers/batch', json=[
+        {'content': 'Some answer content'},
+        {'content': 'short'},
+        {'content': 'Another answer content'}
+    ], headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    first, invalid, second = response.json()
+    assert first['answer']['content'] == 'Some answer content'
+    assert first['answer']['user']['username'] == 'test_user'
+    assert invalid['errors'][0]['loc'] == ['content']
+    assert second['answer']['content'] == 'Another answer content'
+    answers = session.exec(select(Answer).
+                           where(Answer.question_id == question.id)).all()
+    assert len(answers) == 2
+
+
+def test_post_answers_batch_not_found(client: TestClient, auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/questions/1000/answers/batch',
+                           json=[{'content': 'Some answer content'}], headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_get_answers_with_fields(client: TestClient, session: Session, question: Question):
+    answers = add_answers(session, question, [0, 3])
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'fields': 'id,score'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{'id': answers[0].id, 'score': 0},
+                               {'id': answers[1].id, 'score': 3}]
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'fields': 'content,user', 'sort': 'score'})
+    assert response.json() == [
+        {'content': 'Some answer content',
+         'user': {'username': 'author', 'email': 'author@gmail.com', 'id': question.user_id}}
+    ] * 2
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'fields': 'tags'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_get_answers_total_count(client: TestClient, session: Session, question: Question):
+    add_answers(session, question, [0, 3, 1])
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'limit': 1, 'count': 'exact'})
+    assert len(response.json()) == 1
+    assert response.headers['X-Total-Count'] == '3'
+    response = client.get(f'/questions/{question.id}/answers',
+                          params={'fields': 'id,score', 'sort': 'score', 'count': 'approx'})
+    assert response.headers['X-Total-Count'] == '3'
+    add_answers(session, question, [2])
+    response = client.get(f'/questions/{question.id}/answers', params={'count': 'approx'})
+    assert response.headers['X-Total-Count'] == '3'
@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, select, update
+
+from app import archive
+from app.archive import archive_inactive_questions, schedule_archival
+from app.database import create_engines
+from app.duplicates import duplicates_index
+from app.indexes import index_watcher
+from app.jobs import run_pending
+from app.models import Question, Answer, AnswerVote, QuestionRank, RelatedQuestion, \
+    ArchivedQuestion, ArchivedAnswer, ArchivedAnswerVote, ArchivedTaggedQuestions, User, Job
+from app.auth import generate_password_hash
+from app.tag_maintenance import merge_tags, collect_unused_tags
+
+from .conftest import AuthActions
+
+
+def post_questions(client: TestClient, auth: AuthActions, session: Session) -> tuple[int, int]:
+    # an old question with an answer voted by another user, and a recent one
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    old_id = client.post('/questions', json={'title': 'Old question', 'tags': ['python']},
+                         headers=headers).json()['id']
+    new_id = client.post('/questions', json={'title': 'New question', 'tags': ['python']},
+                         headers=headers).json()['id']
+    client.post(f'/questions/{old_id}/answers', json={'content': 'An answer to the question'},
+                headers=headers)
+    session.add(User(username='voting_user', email='voting_user@gmail.com',
+                     hashed_password=generate_password_hash('34qwerty34')))
+    session.commit()
+    voter = {'Authorization': f'Bearer {auth.login(username="voting_user")}'}
+    client.put(f'/questions/{old_id}/answers/1/vote', json={'value': 1}, headers=voter)
+    run_pending(session)
+    long_ago = datetime.utcnow() - timedelta(days=100)
+    session.exec(update(Question).where(Question.id == old_id).values(published=long_ago))
+    session.exec(update(QuestionRank).where(QuestionRank.question_id == old_id).
+                 values(updated=long_ago))
+    session.commit()
+    return old_id, new_id
+
+
+def test_archive_moves_inactive_questions(client: TestClient, auth: AuthActions,
+                                          session: Session):
+    old_id, new_id = post_questions(client, auth, session)
+    assert session.exec(select(RelatedQuestion)).all()
+
+    assert archive_inactive_questions(session=session, days=30, chunk_size=1, pause=0) == 1
+    session.expire_all()
+    assert session.get(Question, old_id) is None
+    assert session.exec(select(Answer)).all() == []
+    assert session.exec(select(AnswerVote)).all() == []
+    assert session.exec(select(RelatedQuestion)).all() == []
+    assert session.get(Question, new_id) is not None
+    assert session.get(ArchivedQuestion, old_id).title == 'Old question'
+    assert [answer.id for answer in session.exec(select(ArchivedAnswer))] == [1]
+    assert len(session.exec(select(ArchivedAnswerVote)).all()) == 1
+    assert len(session.exec(select(ArchivedTaggedQuestions)).all()) == 1
+    # the recent question is archived at the next runs if it stays inactive
+    assert archive_inactive_questions(session=session, days=30, pause=0) == 0
+
+
+def test_archive_runs_as_a_single_job(client: TestClient, auth: AuthActions,
+                                      session: Session, monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_AFTER_DAYS', 30)
+    monkeypatch.setattr(archive, 'ARCHIVE_PAUSE', 0)
+    old_id, new_id = post_questions(client, auth, session)
+    index_watcher.record(session=session)
+    assert [id for id, _ in duplicates_index.find(title='Old question')] == [old_id]
+
+    schedule_archival(session.get_bind(), interval=0)
+    schedule_archival(session.get_bind(), interval=0)
+    assert len(session.exec(select(Job).where(Job.kind == 'archive')).all()) == 1
+    run_pending(session)
+    assert session.get(ArchivedQuestion, old_id) is not None
+    # the next run waits for the interval
+    job = session.exec(select(Job).where(Job.kind == 'archive')).one()
+    assert job.run_after > datetime.utcnow() + timedelta(hours=1)
+
+    # every process drops the archived question from its indexes
+    assert set(index_watcher.check(session=session)) == {'tags', 'duplicates'}
+    assert duplicates_index.find(title='Old question') == []
+    response = client.get('/tags/suggest', params={'prefix': 'py'})
+    assert response.json() == [{'name': 'python', 'usage': 1}]
+
+
+def test_candidates_are_read_in_the_write_transaction(tmp_path, monkeypatch):
+    engine, _ = create_engines(f'sqlite:///{tmp_path / "db.sqlite3"}')
+    SQLModel.metadata.create_all(engine)
+    get_archive_candidates = archive.get_archive_candidates
+    began = []
+
+    def get_archive_candidates_in_transaction(session: Session, **kwargs):
+        began.append(session.connection().connection.dbapi_connection.in_transaction)
+        return get_archive_candidates(session=session, **kwargs)
+
+    monkeypatch.setattr(archive, 'get_archive_candidates', get_archive_candidates_in_transaction)
+    with Session(engine) as session:
+        assert archive_inactive_questions(session=session, days=30, pause=0) == 0
+    assert began == [True]
+
+
+def test_archived_ids_are_not_given_again(client: TestClient, auth: AuthActions,
+                                          session: Session):
+    old_id, new_id = post_questions(client, auth, session)
+    long_ago = datetime.utcnow() - timedelta(days=100)
+    session.exec(update(Question).where(Question.id == new_id).values(published=long_ago))
+    session.exec(update(QuestionRank).where(QuestionRank.question_id == new_id).
+                 values(updated=long_ago))
+    session.commit()
+    assert archive_inactive_questions(session=session, days=30, pause=0) == 2
+
+    headers = {'Authorization': f'Bearer {auth.login()}'}
+    question_id = client.post('/questions', json={'title': 'Another question'},
+                              headers=headers).json()['id']
+    assert question_id > new_id
+    response = client.post(f'/questions/{question_id}/answers',
+                           json={'content': 'Another answer to the question'},
+                           headers=headers)
+    assert response.json()['id'] > 1
+
+
+def test_archived_questions_are_read_from_the_archive(client: TestClient, auth: AuthActions,
+                                                      session: Session):
+    old_id, new_id = post_questions(client, auth, session)
+    question = client.get(f'/questions/{old_id}').json()
+    answers = client.get(f'/questions/{old_id}/answers').json()
+    archive_inactive_questions(session=session, days=30, pause=0)
+
+    assert client.get(f'/questions/{old_id}').json() == question
+    response = client.get(f'/questions/{old_id}', params={'include': 'answers'})
+    assert response.json() == {**question, 'answers': answers}
+    assert client.get(f'/questions/{old_id}/answers').json() == answers
+    assert client.get(f'/questions/{old_id}/answers', params={'sort': 'score'}).json() == answers
+    response = client.get(f'/questions/{old_id}/answers', params={'fields': 'id,score'})
+    assert response.json() == [{'id': 1, 'score': 1}]
+    assert client.get(f'/questions/{old_id}/answers/1').json() == answers[0]
+    assert client.get('/users/test_user').json()['questions_count'] == 2
+    assert client.get('/users/test_user').json()['answers_count'] == 1
+
+    # listings only scan the hot tables
+    assert [question['id'] for question in client.get('/questions').json()] == [new_id]
+    # and archived questions are read-only
+    headers = {'Authorization': f'Bearer {auth.login()}'}
+    response = client.post(f'/questions/{old_id}/answers',
+                           json={'content': 'Another answer to the question'}, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = client.patch(f'/questions/{old_id}', json={'title': 'Changed title'},
+                            headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    client.patch('/users/me', json={'username': 'renamed_user'}, headers=headers)
+    run_pending(session)
+    assert client.get(f'/questions/{old_id}').json()['user']['username'] == 'renamed_user'
+
+
+def test_missing_questions_are_not_found_in_the_archive(client: TestClient):
+    assert client.get('/questions/1').status_code == status.HTTP_404_NOT_FOUND
+    assert client.get('/questions/1/answers').status_code == status.HTTP_404_NOT_FOUND
+    assert client.get('/questions/1/answers/1').status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_tag_maintenance_covers_the_archive(client: TestClient, auth: AuthActions,
+                                            session: Session):
+    old_id, new_id = post_questions(client, auth, session)
+    archive_inactive_questions(session=session, days=30, pause=0)
+    assert merge_tags(session=session, names=['python'], into='py') == 2
+    assert client.get(f'/questions/{old_id}').json()['tags'] == [{'name': 'py', 'id': 2}]
+    assert client.get(f'/questions/{new_id}').json()['tags'] == [{'name': 'py', 'id': 2}]
+    # the tag is still used by the archived question
+    headers = {'Authorization': f'Bearer {auth.login()}'}
+    client.patch(f'/questions/{new_id}', json={'tags': []}, headers=headers)
+    assert collect_unused_tags(session=session) == []
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+import sqlalchemy as sa
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+from sqlmodel import Session, select
+
+from app import backfill as backfill_module
+from app.backfill import backfill, run_backfill, run_backfill_in_migration, \
+    get_checkpoint, get_backfills_status
+from app.models import User, Question, Answer, AnswerVote
+
+
+@pytest.fixture(name='chunks')
+def chunks_fixture(session: Session):
+    user = session.exec(select(User)).first()
+    session.add_all([Question(title=f'Question number {number}', user_id=user.id)
+                     for number in range(5)])
+    session.commit()
+    chunks = []
+
+    @backfill('test_backfill', Question, where=Question.title != 'Question number 0')
+    def apply(session: Session, ids: list[int]):
+        if 'fail' in chunks:
+            chunks.remove('fail')
+            raise ValueError('failed on purpose')
+        chunks.append(ids)
+
+    yield chunks
+    del backfill_module.backfills['test_backfill']
+
+
+def test_backfill_runs_in_chunks(session: Session, chunks: list):
+    progress = []
+    checkpoint = run_backfill(session=session, name='test_backfill', chunk_size=3, pause=0,
+                              progress=lambda checkpoint, max_id: progress.append(
+                                  (checkpoint.rows, checkpoint.last_id, max_id)))
+    assert chunks == [[2, 3, 4], [5]]
+    assert progress == [(3, 4, 5), (4, 5, 5)]
+    assert checkpoint.finished is not None
+    # a finished backfill is run again only when restarted
+    run_backfill(session=session, name='test_backfill', chunk_size=3, pause=0)
+    assert len(chunks) == 2
+    run_backfill(session=session, name='test_backfill', chunk_size=3, pause=0, restart=True)
+    assert chunks[2:] == [[2, 3, 4], [5]]
+
+
+def test_backfill_resumes_from_its_checkpoint(session: Session, chunks: list):
+    with pytest.raises(ValueError):
+        run_backfill(session=session, name='test_backfill', chunk_size=2, pause=0,
+                     progress=lambda checkpoint, max_id: chunks.append('fail'))
+    # the failed chunk was rolled back, the checkpoint stayed at the first one
+    session.rollback()
+    checkpoint = get_checkpoint(session=session, name='test_backfill')
+    assert (checkpoint.last_id, checkpoint.rows, checkpoint.finished) == (3, 2, None)
+    run_backfill(session=session, name='test_backfill', chunk_size=2, pause=0)
+    assert chunks == [[2, 3], [4, 5]]
+    assert [status for status in get_backfills_status(session=session)
+            if status['name'] == 'test_backfill'][0]['rows'] == 4
+
+
+def test_answer_scores_backfill(session: Session):
+    user = session.exec(select(User)).first()
+    question = Question(title='Some question', user_id=user.id)
+    session.add(question)
+    session.flush()
+    answers = [Answer(content='Some answer content', question_id=question.id,
+                      user_id=user.id, score=7) for _ in range(3)]
+    session.add_all(answers)
+    session.flush()
+    session.add(AnswerVote(user_id=user.id, answer_id=answers[0].id, value=-1))
+    session.commit()
+    run_backfill(session=session, name='answer_scores', chunk_size=2, pause=0)
+    assert [answer.score for answer in session.exec(
+        select(Answer).execution_options(populate_existing=True))] == [-1, 0, 0]
+
+
+def run_in_migration(session: Session, upgrade):
+    with session.get_bind().connect() as connection:
+        context = MigrationContext.configure(connection)
+        with Operations.context(context):
+            upgrade()
+
+
+def test_backfill_in_migration(session: Session, chunks: list):
+    # with the table frozen in the migration, not the app's models
+    question = sa.table('question', sa.column('id', sa.Integer), sa.column('title', sa.String))
+    run_in_migration(session, lambda: run_backfill_in_migration(
+        'test_migration_backfill', question, lambda session, ids: chunks.append(ids),
+        where=question.c.title != 'Question number 0', chunk_size=10, pause=0))
+    assert chunks == [[2, 3, 4, 5]]
+    # its checkpoint, kept through the frozen backfill_checkpoint, is finished
+    checkpoint = get_checkpoint(session=session, name='test_migration_backfill')
+    assert (checkpoint.last_id, checkpoint.rows) == (5, 4)
+    assert checkpoint.finished is not None
+    run_in_migration(session, lambda: run_backfill_in_migration(
+        'test_migration_backfill', question, lambda session, ids: chunks.append(ids), pause=0))
+    assert chunks == [[2, 3, 4, 5]]
+    assert 'test_migration_backfill' in [status['name'] for status in
+                                         get_backfills_status(session=session)]
+
+
+def test_answer_scores_revision(session: Session):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = Config(os.path.join(root, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(root, 'alembic'))
+    revision = ScriptDirectory.from_config(config).get_revision('e5b9c1d7a2f6')
+    user = session.exec(select(User)).first()
+    question = Question(title='Some question', user_id=user.id)
+    session.add(question)
+    session.flush()
+    answer = Answer(content='Some answer content', question_id=question.id,
+                    user_id=user.id, score=4)
+    session.add(answer)
+    session.flush()
+    session.add(AnswerVote(user_id=user.id, answer_id=answer.id, value=1))
+    session.commit()
+    run_in_migration(session, revision.module.upgrade)
+    session.refresh(answer)
+    assert answer.score == 1
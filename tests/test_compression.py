@@ -0,0 +1,101 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.compression import CompressionMiddleware, choose_encoding, brotli
+
+
+BODY = 'question ' * 500
+
+
+@pytest.fixture(name='compression_client')
+def compression_client_fixture():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get('/large')
+    def large():
+        return PlainTextResponse(BODY)
+
+    @app.get('/small')
+    def small():
+        return PlainTextResponse('question')
+
+    @app.get('/stream')
+    def stream():
+        return StreamingResponse(iter([BODY, BODY]), media_type='text/plain')
+
+    return TestClient(app)
+
+
+@pytest.mark.skipif(brotli is None, reason='brotli is not installed')
+@pytest.mark.parametrize(
+    ('accept_encoding', 'encoding'),
+    (
+        ('gzip', 'gzip'),
+        ('gzip, deflate, br', 'br'),
+        ('br;q=0, gzip;q=0.5', 'gzip'),
+        ('*', 'br'),
+        ('identity', None),
+        ('', None)
+    )
+)
+def test_choose_encoding(accept_encoding, encoding):
+    assert choose_encoding(accept_encoding) == encoding
+
+
+def test_choose_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr('app.compression.brotli', None)
+    assert choose_encoding('gzip, deflate, br') == 'gzip'
+    assert choose_encoding('br') is None
+
+
+@pytest.mark.parametrize('encoding', ('gzip', 'br'))
+def test_large_response_is_compressed(compression_client: TestClient, encoding):
+    if encoding == 'br' and brotli is None:
+        pytest.skip('brotli is not installed')
+    response = compression_client.get('/large', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert int(response.headers['Content-Length']) < len(BODY)
+    assert response.text == BODY
+
+
+def test_small_and_streamed_responses_are_not_compressed(compression_client: TestClient):
+    response = compression_client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.text == 'question'
+    response = compression_client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.text == BODY * 2
+
+
+def test_large_bodies_are_compressed_in_the_threadpool(monkeypatch):
+    compressed = []
+
+    async def run_in_threadpool(function, *args):
+        compressed.append(len(args[0]))
+        return function(*args)
+
+    monkeypatch.setattr('app.compression.run_in_threadpool', run_in_threadpool)
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100, threadpool_min_size=1000)
+
+    @app.get('/{size}')
+    def body(size: int):
+        return PlainTextResponse('q' * size)
+
+    client = TestClient(app)
+    assert client.get('/500', headers={'Accept-Encoding': 'gzip'}).text == 'q' * 500
+    assert client.get('/5000', headers={'Accept-Encoding': 'gzip'}).text == 'q' * 5000
+    assert compressed == [5000]
+
+
+def test_compressed_bodies_are_cached():
+    middleware = CompressionMiddleware(app=None, minimum_size=100)
+    first = middleware.compress(BODY.encode(), 'gzip')
+    second = middleware.compress(BODY.encode(), 'gzip')
+    assert first is second
+    assert middleware.cache.stats()['hits'] == 1
+    assert middleware.compress(BODY.encode(), 'br') is not first
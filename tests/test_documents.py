@@ -0,0 +1,86 @@
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app.documents import rebuild_all_documents
+from app.jobs import run_pending
+from app.models import Question, QuestionDocument, User
+
+from .conftest import AuthActions
+
+
+def get_document(session: Session, question_id: int) -> dict | None:
+    document = session.get(QuestionDocument, question_id, populate_existing=True)
+    return json.loads(document.document) if document else None
+
+
+def test_documents_follow_writes(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/questions', json={'title': 'Some question', 'tags': ['python']},
+                           headers=headers)
+    question_id = response.json()['id']
+    assert get_document(session, question_id) == response.json()
+    assert client.get(f'/questions/{question_id}').json() == response.json()
+
+    response = client.patch(f'/questions/{question_id}',
+                            json={'title': 'Another question', 'tags': ['java']},
+                            headers=headers)
+    assert get_document(session, question_id) == response.json()
+    assert get_document(session, question_id)['tags'] == [{'name': 'java', 'id': 2}]
+
+    client.patch('/users/me', json={'username': 'renamed_user'}, headers=headers)
+    # rebuilt by a job, as the user may have many questions
+    assert get_document(session, question_id)['user']['username'] == 'test_user'
+    run_pending(session)
+    assert get_document(session, question_id)['user']['username'] == 'renamed_user'
+
+    token = auth.login(username='renamed_user')
+    client.delete(f'/questions/{question_id}', headers={'Authorization': f'Bearer {token}'})
+    assert get_document(session, question_id) is None
+
+
+def test_listing_is_served_from_documents(client: TestClient, auth: AuthActions,
+                                          session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    ids = [client.post('/questions', json={'title': f'Question number {number}',
+                                           'tags': ['python', 'fastapi']},
+                       headers=headers).json()['id'] for number in range(3)]
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get('/questions', params={'limit': 2, 'offset': 1})
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert [question['id'] for question in response.json()] == ids[1:]
+    assert response.json()[0]['tags'] == [{'name': 'python', 'id': 1},
+                                          {'name': 'fastapi', 'id': 2}]
+    # the page's ids and their documents
+    assert len(statements) == 2
+
+
+def test_questions_without_documents(client: TestClient, session: Session):
+    user = session.exec(select(User)).first()
+    session.add_all([Question(title=f'Question number {number}', user=user)
+                     for number in range(3)])
+    session.commit()
+    # rendered from the tables until the documents are rebuilt
+    response = client.get('/questions', params={'ids': '1,3,1000'})
+    assert [question['id'] for question in response.json()] == [1, 3]
+    assert response.headers['X-Missing-Ids'] == '1000'
+    assert client.get('/questions/2').json()['title'] == 'Question number 1'
+
+    progress = []
+    assert rebuild_all_documents(session=session, chunk_size=2, progress=progress.append) == 3
+    assert progress == [2, 3]
+    assert get_document(session, 2) == client.get('/questions/2').json()
+    assert client.get('/questions/2', params={'include': 'answers'}).json() == \
+        {**get_document(session, 2), 'answers': []}
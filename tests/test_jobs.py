@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel, Session, select
+
+from app import database, jobs
+from app.database import create_engines
+from app.jobs import enqueue, run_batch, run_pending, work, get_queue_stats, job_handler
+from app.models import Job
+
+
+@pytest.fixture(name='calls')
+def calls_fixture():
+    calls = []
+
+    @job_handler('test_job')
+    def handle_test_job(session: Session, payloads: list[dict]):
+        calls.append(payloads)
+        if any(payload.get('fail') for payload in payloads):
+            raise ValueError('failed on purpose')
+
+    yield calls
+    del jobs.handlers['test_job']
+
+
+def test_jobs_of_a_kind_are_batched(session: Session, calls: list):
+    enqueue(session=session, kind='test_job', payloads=[{'n': 1}, {'n': 2}])
+    enqueue(session=session, kind='test_job', payloads=[{'n': 3}])
+    session.commit()
+    assert run_batch(session=session, limit=2) == 2
+    assert calls == [[{'n': 1}, {'n': 2}]]
+    assert run_pending(session) == 1
+    assert calls[1:] == [[{'n': 3}]]
+    assert session.exec(select(Job)).all() == []
+
+
+def test_failed_jobs_are_retried_then_given_up(session: Session, calls: list,
+                                               monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(jobs, 'JOBS_MAX_ATTEMPTS', 2)
+    enqueue(session=session, kind='test_job', payloads=[{'fail': True}])
+    enqueue(session=session, kind='unknown_job', payloads=[{}])
+    session.commit()
+    assert run_pending(session) == 2
+    failed, unknown = session.exec(select(Job).order_by(Job.id)).all()
+    assert (failed.attempts, failed.failed) == (1, False)
+    assert 'failed on purpose' in failed.last_error
+    assert "KeyError('unknown_job')" == unknown.last_error
+    # not due before the retry delay
+    assert failed.run_after > datetime.utcnow()
+    assert run_pending(session) == 0
+
+    for job in (failed, unknown):
+        job.run_after = datetime.utcnow() - timedelta(seconds=1)
+        session.add(job)
+    session.commit()
+    assert run_pending(session) == 2
+    session.refresh(failed)
+    assert (failed.attempts, failed.failed) == (2, True)
+    stats = get_queue_stats(session=session)
+    assert stats['pending'] == 0
+    assert stats['failed'] == 2
+    assert stats['kinds']['test_job'] == {'pending': 0, 'failed': 1}
+
+
+def test_a_failing_job_fails_alone(session: Session, calls: list):
+    enqueue(session=session, kind='test_job', payloads=[{'n': 1}, {'fail': True}, {'n': 2}])
+    session.commit()
+    assert run_batch(session=session) == 3
+    # the batch, then its jobs one by one
+    assert calls == [[{'n': 1}, {'fail': True}, {'n': 2}],
+                     [{'n': 1}], [{'fail': True}], [{'n': 2}]]
+    failed = session.exec(select(Job)).one()
+    assert (failed.payload, failed.attempts) == ('{"fail": true}', 1)
+
+
+def test_claimed_jobs_are_leased(session: Session):
+    enqueue(session=session, kind='test_job', payloads=[{}])
+    session.commit()
+    claimed = jobs.claim_jobs(session=session, limit=10)
+    assert len(claimed) == 1
+    assert claimed[0].run_after > datetime.utcnow() + timedelta(seconds=jobs.JOBS_LEASE_SECONDS - 5)
+    assert jobs.claim_jobs(session=session, limit=10) == []
+
+
+def test_idle_workers_dont_take_the_write_lock(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(database, 'SQLITE_BUSY_TIMEOUT', 50)
+    engine, _ = create_engines(f'sqlite:///{tmp_path / "db.sqlite3"}')
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as writer, Session(engine) as worker:
+        enqueue(session=writer, kind='test_job', payloads=[{}])
+        writer.flush()
+        # a request's write transaction is open, nothing is due yet
+        assert jobs.claim_jobs(session=worker, limit=10) == []
+        writer.commit()
+        assert len(jobs.claim_jobs(session=worker, limit=10)) == 1
+
+
+def test_handlers_run_in_the_write_transaction(tmp_path):
+    # in SQLite mode, what a handler reads is read under the write lock
+    engine, _ = create_engines(f'sqlite:///{tmp_path / "db.sqlite3"}')
+    SQLModel.metadata.create_all(engine)
+    began = []
+
+    @job_handler('test_reading_job')
+    def handle_test_reading_job(session: Session, payloads: list[dict]):
+        began.append(session.connection().connection.dbapi_connection.in_transaction)
+
+    try:
+        with Session(engine) as session:
+            enqueue(session=session, kind='test_reading_job', payloads=[{}])
+            session.commit()
+            assert run_pending(session) == 1
+    finally:
+        del jobs.handlers['test_reading_job']
+    assert began == [True]
+
+
+def test_worker_runs_jobs(session: Session, calls: list):
+    enqueue(session=session, kind='test_job', payloads=[{'n': 1}])
+    session.commit()
+
+    async def run():
+        stop = asyncio.Event()
+        worker = asyncio.create_task(work(session.get_bind(), stop))
+        for _ in range(100):
+            if calls:
+                break
+            await asyncio.sleep(0.01)
+        stop.set()
+        await worker
+
+    asyncio.run(run())
+    assert calls == [[{'n': 1}]]
+
+
+def test_get_jobs_stats(client: TestClient, session: Session):
+    enqueue(session=session, kind='question_activity',
+            payloads=[{'question_id': 1000, 'weight': 1, 'at': datetime.utcnow().isoformat()}])
+    session.commit()
+    response = client.get('/debug/jobs')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['pending'] == 1
+    assert response.json()['kinds'] == {'question_activity': {'pending': 1, 'failed': 0}}
+    # the question doesn't exist, the job is done without ranking it
+    assert run_pending(session) == 1
+    assert client.get('/debug/jobs').json()['pending'] == 0
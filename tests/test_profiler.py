@@ -0,0 +1,76 @@
+import json
+import time
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.profiler import ProfilerMiddleware, get_bucket
+
+
+def frame(filename: str, name: str):
+    return SimpleNamespace(f_code=SimpleNamespace(co_filename=filename, co_name=name))
+
+
+def test_get_bucket():
+    route = frame('/site-packages/fastapi/routing.py', 'run_endpoint_function')
+    crud = frame('/project/app/crud.py', 'get_all_questions')
+    orm = frame('/site-packages/sqlalchemy/orm/loading.py', 'instances')
+    execute = frame('/site-packages/sqlalchemy/engine/default.py', 'do_execute')
+    assert get_bucket([route, crud, orm]) == 'crud'
+    assert get_bucket([route, crud, orm, execute]) == 'db'
+    assert get_bucket([route, frame('/site-packages/passlib/handlers/bcrypt.py', '_calc')]) \
+        == 'bcrypt'
+    assert get_bucket([frame('/site-packages/fastapi/routing.py', 'serialize_response'),
+                       frame('/site-packages/fastapi/encoders.py', 'jsonable_encoder')]) \
+        == 'serialization'
+    assert get_bucket([route]) == 'other'
+
+
+def create_app(tmp_path, max_per_minute: int = 10) -> FastAPI:
+    test_app = FastAPI()
+
+    @test_app.get('/slow/{id}')
+    def slow(id: int):
+        time.sleep(0.05)
+        return {'id': id}
+
+    @test_app.get('/busy')
+    async def busy():
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+        return {}
+
+    test_app.add_middleware(ProfilerMiddleware, token='secret', sample_rate=0.0,
+                            interval=0.001, output_dir=str(tmp_path),
+                            max_per_minute=max_per_minute)
+    return test_app
+
+
+def test_profiled_request_writes_stacks_and_summary(tmp_path):
+    client = TestClient(create_app(tmp_path))
+    assert client.get('/slow/1').status_code == 200
+    assert client.get('/slow/1', headers={'X-Profile': 'wrong'}).status_code == 200
+    assert list(tmp_path.iterdir()) == []
+
+    assert client.get('/slow/1', headers={'X-Profile': 'secret'}).json() == {'id': 1}
+    assert client.get('/busy', headers={'X-Profile': 'secret'}).status_code == 200
+    summaries = sorted(tmp_path.glob('*.json'))
+    assert len(summaries) == 2
+    slow, busy = [json.loads(path.read_text()) for path in summaries]
+    assert slow['route'] == '/slow/{id}'
+    assert slow['status'] == 200
+    assert slow['samples'] > 0
+    assert busy['path'] == '/busy'
+    assert busy['samples'] > 0
+    stacks = (tmp_path / busy['stacks']).read_text().splitlines()
+    assert any('busy (test_profiler.py)' in line for line in stacks)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+
+
+def test_captures_are_capped_per_minute(tmp_path):
+    client = TestClient(create_app(tmp_path, max_per_minute=2))
+    for id in range(4):
+        client.get(f'/slow/{id}', headers={'X-Profile': 'secret'})
+    assert len(list(tmp_path.glob('*.json'))) == 2
@@ -0,0 +1,380 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from fastapi import status
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+
+from app.models import User, Question, QuestionRank, Answer
+from app.ranking import record_activity, VIEW_WEIGHT, ANSWER_WEIGHT
+from app.duplicates import DuplicatesIndex, NUM_PERM
+from app.jobs import run_pending
+from app.documents import rebuild_documents
+from app.routers.questions import load_question_document
+
+
+from .conftest import AuthActions
+
+
+@pytest.fixture(name='questions')
+def questions_fixture(session: Session) -> list[Question]:
+    test_user = session.exec(select(User).where(
+        User.username == 'test_user')).first()
+    questions = [Question(title=f'Question number {number}', user=test_user)
+                 for number in range(3)]
+    session.add_all(questions)
+    session.commit()
+    for question in questions:
+        session.refresh(question)
+    return questions
+
+
+def test_get_question(client: TestClient, session: Session, questions: list[Question]):
+    question = questions[0]
+    response = client.get(f'/questions/{question.id}')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['id'] == question.id
+    assert response.json()['title'] == question.title
+    assert response.json()['user']['username'] == 'test_user'
+
+
+def test_shared_question_read_has_its_own_session(session: Session, questions: list[Question]):
+    # the request that started it may be gone, with its session closed
+    with Session(session.get_bind()) as request_session:
+        bind = request_session.get_bind()
+    document = load_question_document(bind, questions[0].id, 'answers', 10)
+    assert b'"title":"Question number 0"' in document
+
+
+def test_get_question_not_found(client: TestClient):
+    response = client.get('/questions/1000')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_post_question_is_ranked(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/questions', json={'title': 'New question',
+                                               'tags': ['python']},
+                           headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    # ranked by a job
+    assert session.get(QuestionRank, response.json()['id']) is None
+    assert run_pending(session) == 2
+    assert session.get(QuestionRank, response.json()['id']) is not None
+
+
+def test_get_hot_questions(client: TestClient, session: Session, questions: list[Question]):
+    now = datetime.utcnow()
+    # many old views lose to a single fresh answer
+    for _ in range(20):
+        record_activity(session=session, question_id=questions[0].id,
+                        weight=VIEW_WEIGHT, at=now - timedelta(days=10))
+    record_activity(session=session, question_id=questions[1].id,
+                    weight=ANSWER_WEIGHT, at=now)
+    record_activity(session=session, question_id=questions[2].id,
+                    weight=VIEW_WEIGHT, at=now)
+    session.commit()
+    response = client.get('/questions/hot', params={'limit': 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert [question['id'] for question in response.json()] == [questions[1].id,
+                                                                questions[2].id]
+
+
+def test_views_and_answers_make_question_hot(client: TestClient, auth: AuthActions,
+                                             session: Session, questions: list[Question]):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get(f'/questions/{questions[2].id}')
+    client.post(f'/questions/{questions[0].id}/answers',
+                json={'content': 'Some answer content'}, headers=headers)
+    run_pending(session)
+    response = client.get('/questions/hot')
+    assert response.status_code == status.HTTP_200_OK
+    assert [question['id'] for question in response.json()] == [questions[0].id,
+                                                                questions[2].id]
+
+
+def test_delete_question_removes_rank(client: TestClient, auth: AuthActions,
+                                      session: Session, questions: list[Question]):
+    question_id = questions[0].id
+    record_activity(session=session, question_id=question_id, weight=VIEW_WEIGHT)
+    session.commit()
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.delete(f'/questions/{question_id}', headers=headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert session.get(QuestionRank, question_id) is None
+
+
+def post_question(client: TestClient, headers: dict, tags: list[str]) -> int:
+    response = client.post('/questions', json={'title': 'Some question',
+                                               'tags': tags},
+                           headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    return response.json()['id']
+
+
+def test_get_related_questions(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    first = post_question(client, headers, ['python', 'fastapi', 'sqlmodel'])
+    second = post_question(client, headers, ['python'])
+    third = post_question(client, headers, ['python', 'fastapi'])
+    post_question(client, headers, ['java'])
+    run_pending(session)
+    response = client.get(f'/questions/{first}/related')
+    assert response.status_code == status.HTTP_200_OK
+    assert [question['id'] for question in response.json()] == [third, second]
+    response = client.get(f'/questions/{second}/related')
+    assert [question['id'] for question in response.json()] == [third, first]
+
+
+def test_related_questions_follow_tags_changes(client: TestClient, auth: AuthActions,
+                                               session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    first = post_question(client, headers, ['python'])
+    second = post_question(client, headers, ['python'])
+    third = post_question(client, headers, ['java'])
+    client.patch(f'/questions/{second}', json={'tags': ['java']},
+                 headers=headers)
+    run_pending(session)
+    response = client.get(f'/questions/{first}/related')
+    assert response.json() == []
+    response = client.get(f'/questions/{third}/related')
+    assert [question['id'] for question in response.json()] == [second]
+    client.delete(f'/questions/{second}', headers=headers)
+    response = client.get(f'/questions/{third}/related')
+    assert response.json() == []
+
+
+def test_get_related_questions_not_found(client: TestClient):
+    response = client.get('/questions/1000/related')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_post_question_with_duplicates_check(client: TestClient, auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    question = {'title': 'How to run blocking database calls in FastAPI',
+                'content': 'My endpoints use a sync SQLModel session and block the event loop.'}
+    response = client.post('/questions', json=question, headers=headers)
+    first = response.json()['id']
+    repost = {'title': 'How to run blocking database calls in FastAPI?',
+              'content': 'My endpoints use a sync SQLModel session and block the event loop!'}
+    response = client.post('/questions', params={'check_duplicates': True},
+                           json=repost, headers=headers)
+    assert response.status_code == status.HTTP_409_CONFLICT
+    duplicates = response.json()['detail']['duplicates']
+    assert [duplicate['id'] for duplicate in duplicates] == [first]
+    assert duplicates[0]['similarity'] > 0.9
+    other = {'title': 'Difference between list and tuple',
+             'content': 'When should a tuple be preferred over a list in Python?'}
+    response = client.post('/questions', params={'check_duplicates': True},
+                           json=other, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    # without the check the repost is created
+    response = client.post('/questions', json=repost, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+
+
+def test_deleted_question_is_not_a_duplicate(client: TestClient, auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    question = {'title': 'How to run blocking database calls in FastAPI'}
+    response = client.post('/questions', json=question, headers=headers)
+    client.delete(f'/questions/{response.json()["id"]}', headers=headers)
+    response = client.post('/questions', params={'check_duplicates': True},
+                           json=question, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+
+
+def test_duplicates_index_save_and_load(session: Session, tmp_path, questions: list[Question]):
+    index = DuplicatesIndex(path=str(tmp_path / 'index.bin'))
+    index.load(session=session)
+    assert len(index) == len(questions)
+    index.save()
+    # edited after the save, found by load through question.updated
+    questions[0].title = 'A completely different title'
+    questions[0].updated = datetime.utcnow() + timedelta(seconds=1)
+    session.add(questions[0])
+    session.commit()
+    loaded = DuplicatesIndex(path=index.path)
+    loaded.load(session=session)
+    assert len(loaded) == len(questions)
+    assert loaded.find(title='A completely different title')[0][0] == questions[0].id
+
+
+def test_duplicates_index_catches_up_with_other_processes(session: Session, tmp_path,
+                                                          questions: list[Question]):
+    index = DuplicatesIndex(path=str(tmp_path / 'index.bin'))
+    index.load(session=session)
+    # this process's own question, then another process's with a lower id
+    index.add(question_id=1000, title='A question posted here')
+    other = Question(title='A question posted by another process',
+                     user_id=questions[0].user_id)
+    session.add(other)
+    session.commit()
+    assert other.id < 1000
+    index.save()
+    loaded = DuplicatesIndex(path=index.path)
+    loaded.load(session=session)
+    assert loaded.find(title='A question posted by another process')[0][0] == other.id
+    assert loaded.find(title='A question posted here')[0][0] == 1000
+
+
+def test_duplicates_index_catch_up(session: Session, tmp_path, questions: list[Question]):
+    index = DuplicatesIndex(path=str(tmp_path / 'index.bin'))
+    assert index.read() is None
+    # written by requests while catching up, newer than what it reads
+    index.add(question_id=questions[0].id, title='A completely different title')
+    index.remove(question_id=questions[1].id)
+    assert index.catch_up(session=session, chunk_size=1) == len(questions)
+    assert index.complete
+    assert index.find(title='A completely different title')[0][0] == questions[0].id
+    assert len(index) == len(questions) - 1
+    # a removed question's slot is reused
+    index.remove(question_id=questions[2].id)
+    index.add(question_id=1000, title='Yet another title')
+    assert len(index) == len(questions) - 1
+    assert len(index._signatures) == (len(questions) - 1) * NUM_PERM
+    assert index.find(title='Yet another title')[0][0] == 1000
+
+
+def test_post_questions_batch(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/questions/batch', json=[
+        {'title': 'First question', 'tags': ['python', 'Fast API']},
+        {'title': 'x'},
+        {'title': 'Second question', 'tags': ['python']}
+    ], headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    first, invalid, second = response.json()
+    assert first['index'] == 0
+    assert first['question']['title'] == 'First question'
+    assert [tag['name'] for tag in first['question']['tags']] == ['python', 'fast-api']
+    assert invalid['index'] == 1
+    assert invalid['question'] is None
+    assert invalid['errors'][0]['loc'] == ['title']
+    assert second['question']['tags'] == [first['question']['tags'][0]]
+    assert len(session.exec(select(Question)).all()) == 2
+
+
+@pytest.mark.parametrize('size', (0, 101))
+def test_post_questions_batch_with_invalid_size(client: TestClient, auth: AuthActions, size):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/questions/batch',
+                           json=[{'title': 'Some question'}] * size, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_get_questions_by_ids(client: TestClient, questions: list[Question]):
+    response = client.get('/questions', params={'ids': f'{questions[2].id},{questions[0].id},1000'})
+    assert response.status_code == status.HTTP_200_OK
+    assert [question['id'] for question in response.json()] == [questions[0].id,
+                                                                questions[2].id]
+    assert response.headers['X-Missing-Ids'] == '1000'
+
+
+def test_get_questions_total_count(client: TestClient, session: Session,
+                                   questions: list[Question]):
+    response = client.get('/questions', params={'limit': 1})
+    assert 'X-Total-Count' not in response.headers
+    response = client.get('/questions', params={'limit': 1, 'count': 'exact'})
+    assert response.headers['X-Total-Count'] == '3'
+    response = client.get('/questions', params={'search_string': 'number 1', 'count': 'exact'})
+    assert response.headers['X-Total-Count'] == '1'
+    response = client.get('/questions', params={'ids': f'{questions[0].id},1000',
+                                                'count': 'exact'})
+    assert response.headers['X-Total-Count'] == '1'
+    # approximate counts are cached, a new question shows in exact ones only
+    assert client.get('/questions', params={'count': 'approx'}).headers['X-Total-Count'] == '3'
+    session.add(Question(title='Question number 3', user_id=questions[0].user_id))
+    session.commit()
+    assert client.get('/questions', params={'count': 'approx'}).headers['X-Total-Count'] == '3'
+    assert client.get('/questions', params={'count': 'exact'}).headers['X-Total-Count'] == '4'
+    response = client.get('/questions', params={'count': 'all'})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize('ids', ('', 'a,b', '1,', '1;2'))
+def test_get_questions_with_invalid_ids(client: TestClient, ids):
+    response = client.get('/questions', params={'ids': ids})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_get_question_with_answers(client: TestClient, session: Session,
+                                   questions: list[Question]):
+    question = questions[0]
+    answers = [Answer(content=f'Answer number {number}',
+                      question=question, user=question.user) for number in range(3)]
+    session.add_all(answers)
+    session.commit()
+    response = client.get(f'/questions/{question.id}')
+    assert 'answers' not in response.json()
+    response = client.get(f'/questions/{question.id}',
+                          params={'include': 'answers', 'answers_limit': 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['title'] == question.title
+    assert [answer['content'] for answer in response.json()['answers']] == ['Answer number 0',
+                                                                           'Answer number 1']
+    assert response.json()['answers'][0]['user']['username'] == 'test_user'
+
+
+def test_get_question_with_answers_queries(client: TestClient, session: Session,
+                                           questions: list[Question]):
+    question = questions[0]
+    session.add_all([Answer(content=f'Answer number {number}',
+                            question=question, user=question.user) for number in range(30)])
+    session.commit()
+    question_id = question.id
+    rebuild_documents(session=session, questions_ids=[question_id])
+    session.commit()
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(f'/questions/{question_id}',
+                              params={'include': 'answers', 'answers_limit': 5})
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert len(response.json()['answers']) == 5
+    # the question's document and the answers with their users,
+    # the view is enqueued
+    assert len(statements) == 2
+
+
+def test_get_questions_with_fields(client: TestClient, auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    first = post_question(client, headers, ['python', 'fastapi'])
+    second = post_question(client, headers, [])
+    response = client.get('/questions', params={'fields': 'id,title'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{'id': first, 'title': 'Some question'},
+                               {'id': second, 'title': 'Some question'}]
+    response = client.get('/questions', params={'fields': 'tags,user', 'limit': 1})
+    assert response.json() == [{
+        'tags': [{'name': 'python', 'id': 1}, {'name': 'fastapi', 'id': 2}],
+        'user': {'username': 'test_user', 'email': 'test_user@gmail.com', 'id': 1}
+    }]
+    response = client.get('/questions', params={'fields': 'title', 'ids': f'{second},1000'})
+    assert response.json() == [{'id': second, 'title': 'Some question'}]
+    assert response.headers['X-Missing-Ids'] == '1000'
+
+
+@pytest.mark.parametrize('fields', ('password', 'id,', 'id,user.email'))
+def test_get_questions_with_invalid_fields(client: TestClient, fields):
+    response = client.get('/questions', params={'fields': fields})
+    assert response.status_code in (status.HTTP_400_BAD_REQUEST,
+                                    status.HTTP_422_UNPROCESSABLE_ENTITY)
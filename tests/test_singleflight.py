@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def load(id):
+        calls.append(id)
+        started.set()
+        release.wait(timeout=5)
+        return f'question {id}'
+
+    async def run():
+        group = SingleFlight()
+        leader = asyncio.create_task(group.do(('question', 1), load, 1))
+        await asyncio.to_thread(started.wait, 5)
+        followers = [asyncio.create_task(group.do(('question', 1), load, 1))
+                     for _ in range(5)]
+        other = asyncio.create_task(group.do(('question', 2), load, 2))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await leader, await asyncio.gather(*followers), await other, group.stats()
+
+    leader, followers, other, stats = asyncio.run(run())
+    assert leader == ('question 1', 6)
+    assert followers == [('question 1', 0)] * 5
+    assert other == ('question 2', 1)
+    assert sorted(calls) == [1, 2]
+    assert stats == {'in_flight': 0, 'executed': 2, 'shared': 5}
+
+
+def test_exception_is_shared():
+    release = threading.Event()
+
+    def fail():
+        release.wait(timeout=5)
+        raise ValueError('database is gone')
+
+    async def run():
+        group = SingleFlight()
+        leader = asyncio.create_task(group.do('key', fail))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(group.do('key', fail))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
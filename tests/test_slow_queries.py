@@ -0,0 +1,66 @@
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, text
+
+from app.main import app
+from app.routers import debug
+from app.database import SlowQueryLog, StatementTimeoutError, current_statement_timeout, \
+    set_statement_timeouts, slow_query_log, track_slow_queries
+from .test_database import SLOW_QUERY
+
+
+def test_slow_queries_are_recorded_with_their_route(client: TestClient, session: Session):
+    log = track_slow_queries(session.get_bind(),
+                             SlowQueryLog(threshold=0.000001, size=3, explain=True))
+    response = client.get('/questions', params={'search_string': 'python'})
+    assert response.status_code == status.HTTP_200_OK
+    entry = log.entries[-1]
+    assert entry['route'] == 'GET /questions'
+    assert entry['statement'].startswith('SELECT')
+    # the parameters' values are never kept
+    assert 'str' in entry['parameter_types']
+    assert 'python' not in str(entry)
+    assert entry['plan'] and any('question' in ' '.join(row) for row in entry['plan'])
+    for _ in range(5):
+        client.get('/questions/hot')
+    # a ring buffer, the oldest are dropped
+    assert len(log.entries) == 3
+    assert log.entries[-1]['route'] == 'GET /questions/hot'
+
+
+def test_fast_and_failed_queries_are_not_recorded():
+    engine = create_engine('sqlite://')
+    set_statement_timeouts(engine)
+    log = track_slow_queries(engine, SlowQueryLog(threshold=0.01, size=10, explain=True))
+    token = current_statement_timeout.set(0.05)
+    try:
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            with pytest.raises(StatementTimeoutError):
+                connection.execute(SLOW_QUERY)
+    finally:
+        current_statement_timeout.reset(token)
+    assert list(log.entries) == []
+
+
+def test_get_slow_queries(client: TestClient):
+    slow_query_log.entries.append({'statement': 'SELECT 1'})
+    slow_query_log.entries.append({'statement': 'SELECT 2'})
+    try:
+        response = client.get('/debug/slow-queries')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()[:2] == [{'statement': 'SELECT 2'}, {'statement': 'SELECT 1'}]
+    finally:
+        slow_query_log.clear()
+
+
+def test_debug_routes_require_the_token(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    anonymous = TestClient(app)
+    for path in ('/debug/slow-queries', '/debug/jobs', '/debug/admission'):
+        assert anonymous.get(path).status_code == status.HTTP_403_FORBIDDEN
+        response = anonymous.get(path, headers={'X-Debug-Token': 'wrong'})
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+    # disabled without a token
+    monkeypatch.setattr(debug, 'DEBUG_TOKEN', '')
+    assert client.get('/debug/slow-queries').status_code == status.HTTP_404_NOT_FOUND
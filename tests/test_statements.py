@@ -0,0 +1,44 @@
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.crud import get_all_questions, get_all_answers, get_question_by_id, \
+    get_user_with_username
+from app.database import StatementCacheStats, track_statement_cache
+
+from .conftest import AuthActions
+
+
+def test_hot_queries_reuse_compiled_statements(client: TestClient, session: Session,
+                                               auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    for title in ('First question', 'Second question', 'Third one'):
+        response = client.post('/questions', json={'title': title, 'tags': ['python']},
+                               headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+    client.post('/questions/1/answers', json={'content': 'Some answer'}, headers=headers)
+
+    stats = track_statement_cache(session.get_bind(), StatementCacheStats())
+
+    def run(search_string: str, ids: list[int], offset: int):
+        return (get_user_with_username(session=session, username='test_user').id,
+                get_question_by_id(session=session, id=ids[0]).title,
+                [question.id for question in get_all_questions(
+                    session=session, limit=2, offset=offset, search_string=search_string)],
+                [question.id for question in get_all_questions(session=session, ids=ids)],
+                [answer.id for answer in get_all_answers(
+                    session=session, question_id=ids[0], limit=10, by_date_asc=False)])
+
+    assert run('question', [1, 3], 0) == (1, 'First question', [1, 2], [1, 3], [1])
+    misses, hits = stats.misses, stats.hits
+    # different values, same statements
+    assert run('ir', [2], 1) == (1, 'Second question', [3], [2], [])
+    assert stats.misses == misses
+    assert stats.hits == hits + 5
+
+
+def test_statement_cache_stats(client: TestClient):
+    response = client.get('/debug/statement-cache')
+    assert response.status_code == status.HTTP_200_OK
+    assert set(response.json()) == {'size', 'maxsize', 'hits', 'misses', 'uncached'}
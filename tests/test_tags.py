@@ -0,0 +1,142 @@
+import pytest
+from fastapi.testclient import TestClient
+from fastapi import status
+from sqlmodel import Session, select
+
+
+from app.models import Tag, TaggedQuestions
+from app.tag_index import tag_index
+from app.indexes import index_watcher, bump_index_versions, get_index_versions
+from app.tag_maintenance import merge_tags, rename_tag, collect_unused_tags
+
+
+from .conftest import AuthActions
+
+
+def post_question(client: TestClient, headers: dict, tags: list[str]):
+    response = client.post('/questions', json={'title': 'Some question',
+                                               'tags': tags},
+                           headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    return response.json()
+
+
+def test_suggest_tags(client: TestClient, auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    post_question(client, headers, ['python', 'python-3', 'pytest'])
+    post_question(client, headers, ['Python 3', 'java'])
+    response = client.get('/tags/suggest', params={'prefix': 'Py'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{'name': 'python-3', 'usage': 2},
+                               {'name': 'pytest', 'usage': 1},
+                               {'name': 'python', 'usage': 1}]
+    response = client.get('/tags/suggest', params={'prefix': 'pyt', 'limit': 1})
+    assert response.json() == [{'name': 'python-3', 'usage': 2}]
+
+
+def test_suggest_tags_after_update_and_delete(client: TestClient, auth: AuthActions):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    question = post_question(client, headers, ['python'])
+    client.patch(f'/questions/{question["id"]}', json={'tags': ['django']},
+                 headers=headers)
+    response = client.get('/tags/suggest', params={'prefix': 'd'})
+    assert response.json() == [{'name': 'django', 'usage': 1}]
+    response = client.get('/tags/suggest', params={'prefix': 'p'})
+    assert response.json() == [{'name': 'python', 'usage': 0}]
+    client.delete(f'/questions/{question["id"]}', headers=headers)
+    response = client.get('/tags/suggest', params={'prefix': 'd'})
+    assert response.json() == [{'name': 'django', 'usage': 0}]
+
+
+def test_load_tag_index(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    post_question(client, headers, ['python'])
+    session.add(Tag(name='unused'))
+    session.commit()
+    tag_index.clear()
+    tag_index.load(session=session)
+    assert tag_index.suggest(prefix='') == [('python', 1), ('unused', 0)]
+
+
+def test_merge_tags(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    both = post_question(client, headers, ['python', 'python3'])
+    other = post_question(client, headers, ['python-3'])
+    merged = post_question(client, headers, ['python3', 'java'])
+    assert merge_tags(session=session, names=['python3', 'Python 3'], into='python',
+                      batch_size=1) == 3
+    session.expire_all()
+    assert sorted(session.exec(select(TaggedQuestions.question_id).
+                               join(Tag, Tag.id == TaggedQuestions.tag_id).
+                               where(Tag.name == 'python')).all()) == \
+        [both['id'], other['id'], merged['id']]
+    assert [tag.name for tag in session.exec(select(Tag).order_by(Tag.name))] == \
+        ['java', 'python']
+    assert tag_index.suggest(prefix='') == [('python', 3), ('java', 1)]
+    tags = client.get(f'/questions/{merged["id"]}').json()['tags']
+    assert sorted(tag['name'] for tag in tags) == ['java', 'python']
+
+
+def test_rename_tag(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    question = post_question(client, headers, ['pyhton'])
+    post_question(client, headers, ['python'])
+    assert rename_tag(session=session, name='pyhton', new_name='Py Thon') == 1
+    assert client.get(f'/questions/{question["id"]}').json()['tags'] == \
+        [{'name': 'py-thon', 'id': question['tags'][0]['id']}]
+    assert tag_index.suggest(prefix='py') == [('py-thon', 1), ('python', 1)]
+    # renamed to a taken name, the tags are merged
+    assert rename_tag(session=session, name='py-thon', new_name='python') == 1
+    assert tag_index.suggest(prefix='py') == [('python', 2)]
+    with pytest.raises(LookupError):
+        rename_tag(session=session, name='missing', new_name='python')
+
+
+def test_tag_maintenance_reloads_every_process_index(client: TestClient, auth: AuthActions,
+                                                     session: Session):
+    headers = {'Authorization': f'Bearer {auth.login()}'}
+    post_question(client, headers, ['python'])
+    post_question(client, headers, ['python3'])
+    index_watcher.record(session=session)
+    assert index_watcher.check(session=session) == []
+    merge_tags(session=session, names=['python3'], into='python')
+    # as the index of another process, that didn't run the merge, is
+    tag_index.set_usage('python3', 1)
+    tag_index.set_usage('python', 1)
+    assert index_watcher.check(session=session) == ['tags']
+    assert tag_index.suggest(prefix='py') == [('python', 2)]
+    rename_tag(session=session, name='python', new_name='py')
+    assert index_watcher.check(session=session) == ['tags']
+    assert collect_unused_tags(session=session) == []
+    assert index_watcher.check(session=session) == []
+
+
+def test_bump_index_versions(session: Session):
+    # a missing row is added by the first bump, the next ones increment it
+    for version in (1, 2):
+        bump_index_versions(session=session, names=['test_index'])
+        session.commit()
+        assert get_index_versions(session=session)['test_index'] == version
+
+
+def test_collect_unused_tags(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    question = post_question(client, headers, ['python', 'django'])
+    client.patch(f'/questions/{question["id"]}', json={'tags': ['python']}, headers=headers)
+    session.add(Tag(name='unused'))
+    session.commit()
+    assert sorted(collect_unused_tags(session=session, batch_size=1)) == ['django', 'unused']
+    assert [tag.name for tag in session.exec(select(Tag))] == ['python']
+    assert tag_index.suggest(prefix='') == [('python', 1)]
+
+
+@pytest.mark.parametrize('params', ({}, {'prefix': ''}, {'prefix': 'py', 'limit': 0}))
+def test_suggest_tags_with_invalid_params(client: TestClient, params):
+    response = client.get('/tags/suggest', params=params)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
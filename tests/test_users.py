@@ -226,3 +226,34 @@ def test_update_user_for_not_logged_user(client: TestClient):
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
     assert "www-authenticate" in dict(response.headers)
     assert dict(response.headers)["www-authenticate"] == "Bearer"
+
+
+def test_get_user_profile(client: TestClient, auth: AuthActions, session: Session):
+    token = auth.login()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/users/test_user')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'username': 'test_user', 'email': 'test_user@gmail.com',
+                               'id': 1, 'questions_count': 0, 'answers_count': 0,
+                               'last_question_published': None,
+                               'last_answer_published': None, 'last_active': None}
+
+    # the profile is cached until the user writes
+    for title in ('First question', 'Second question'):
+        client.post('/questions', json={'title': title}, headers=headers)
+    response = client.get('/users/test_user')
+    assert response.json()['questions_count'] == 2
+    assert response.json()['answers_count'] == 0
+    client.post('/questions/1/answers', json={'content': 'Some answer'}, headers=headers)
+    profile = client.get('/users/test_user').json()
+    assert profile['answers_count'] == 1
+    assert profile['last_active'] == profile['last_answer_published']
+
+    client.delete('/questions/1', headers=headers)
+    profile = client.get('/users/test_user').json()
+    assert (profile['questions_count'], profile['answers_count']) == (1, 0)
+
+
+def test_get_user_profile_not_found(client: TestClient):
+    response = client.get('/users/nobody')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
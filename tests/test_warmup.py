@@ -0,0 +1,86 @@
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine
+
+from app import warmup
+from app.main import app
+from app.duplicates import duplicates_index
+from app.tag_index import tag_index
+from app.warmup import WarmupState, warm_up
+
+from .conftest import AuthActions
+
+
+def test_warm_up(client: TestClient, session: Session, auth: AuthActions):
+    token = auth.login()
+    client.post('/questions', json={'title': 'Some question', 'tags': ['python']},
+                headers={'Authorization': f'Bearer {token}'})
+    tag_index.clear()
+    duplicates_index.clear()
+    state = WarmupState()
+    warm_up(session.get_bind(), state, connections=2)
+    assert state.ready
+    assert state.error is None
+    assert list(state.timings) == ['pool', 'statements', 'indexes', 'bcrypt', 'duplicates']
+    assert tag_index.suggest('py', limit=5) == [('python', 1)]
+    assert duplicates_index.complete
+    assert [id for id, _ in duplicates_index.find(title='Some question')] == [1]
+
+
+def test_warm_up_failure():
+    engine = create_engine('sqlite:////nonexistent/directory/db.sqlite3')
+    state = WarmupState()
+    warm_up(engine, state, connections=1, attempts=3, retry_delay=0)
+    assert not state.ready
+    assert state.failed
+    assert state.attempts == 3
+    assert 'OperationalError' in state.error
+    assert state.timings == {}
+
+
+def test_warm_up_retries_the_failed_step(session: Session, monkeypatch):
+    init_bcrypt = warmup.init_bcrypt
+    calls = []
+
+    def init_bcrypt_once_failing():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError('failed on purpose')
+        init_bcrypt()
+
+    monkeypatch.setattr(warmup, 'init_bcrypt', init_bcrypt_once_failing)
+    state = WarmupState()
+    warm_up(session.get_bind(), state, connections=1, retry_delay=0)
+    assert state.ready
+    assert not state.failed
+    assert state.attempts == 2
+    assert state.error is None
+    assert list(state.timings) == ['pool', 'statements', 'indexes', 'bcrypt', 'duplicates']
+
+
+def test_readiness(client: TestClient):
+    response = client.get('/health/live')
+    assert response.status_code == status.HTTP_200_OK
+    # no lifespan ran, nothing is warm
+    response = client.get('/health/ready')
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()['ready'] is False
+
+    state = app.state.warmup = WarmupState()
+    try:
+        state.timings['pool'] = 0.01
+        response = client.get('/health/ready')
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json() == {'ready': False, 'error': None,
+                                   'timings': {'pool': 0.01}}
+        state.ready = True
+        response = client.get('/health/ready')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['ready'] is True
+        # a warmup that gave up fails liveness, for the process to be restarted
+        state.ready, state.failed, state.error = False, True, "OSError('failed')"
+        response = client.get('/health/live')
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json() == {'live': False, 'error': "OSError('failed')"}
+    finally:
+        del app.state.warmup